@@ -0,0 +1,289 @@
+# ── ASGI ──────────────────────────────────────────────────────────────────────
+# Production entry point, for uvicorn alone or as gunicorn workers:
+#
+#   gunicorn -c gunicorn.conf.py asgi:app    # several workers, see there
+#   python asgi.py                           # one process, via uvicorn.run
+#
+# `python main.py` stays the development server.
+#
+# Routes registered with main.async_view (catalogue, suggestions, the JSON
+# API, the holds long-poll and the SSE stream) run as coroutines on the
+# event loop inside a Flask request context, so request, session and the
+# app's before / after request hooks work as in any view. A streamed body
+# (the catalogue page) is made a chunk at a time on the thread pool and
+# sent as it comes, after the request context has closed. Every other
+# request runs the Flask WSGI app on a pool of LIBRARY_THREADS threads,
+# one thread for the request's whole life, body included; when the pool is
+# busy, requests queue instead of more threads starting.
+#
+# Lifespan startup starts the background scheduler. On SIGTERM / SIGINT the
+# SSE streams are closed straight away (browsers reconnect, to another
+# worker if there is one), so they don't hold up the server's graceful
+# shutdown; in-flight requests finish, then the scheduler and pools stop.
+
+import asyncio, os, signal, sys, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+from werkzeug.exceptions import HTTPException
+from metrics import observe_request, perf_counter
+import main
+
+THREADS    = int(os.environ.get('LIBRARY_THREADS', 32))
+SSE_MAX    = int(os.environ.get('LIBRARY_SSE_MAX', 10000))   # streams here are awaits, not threads
+BODY_SPOOL = 1 << 20   # request bodies larger than this wait in a temp file
+
+
+def _headers(pairs):
+    return [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in pairs]
+
+
+class ASGIApp:
+    def __init__(self, flask_app, views, prefix='', threads=THREADS,
+                 on_startup=(), on_drain=(), on_shutdown=()):
+        self.flask       = flask_app
+        self.views       = views     # { endpoint: coroutine function }
+        self.prefix      = prefix    # stripped as main.PrefixMiddleware does
+        self.pool        = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.on_startup  = list(on_startup)
+        self.on_drain    = list(on_drain)      # on the stop signal
+        self.on_shutdown = list(on_shutdown)   # once requests are done
+        self.drained     = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'unsupported ASGI scope {scope["type"]!r}')
+        environ = self.environ(scope, await self.read_body(receive))
+        try:
+            view = self.match(environ)
+            if view is None:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.pool, self.run_wsgi, environ, send, loop)
+            else:
+                await self.run_view(view, environ, send, receive)
+        finally:
+            environ['wsgi.input'].close()
+
+    # ── requests ──
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(BODY_SPOOL)
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body.write(message.get('body', b''))
+            more = message.get('more_body', False)
+        body.seek(0)
+        return body
+
+    def environ(self, scope, body):
+        script, path = scope.get('root_path', ''), scope['path']
+        if self.prefix and path.startswith(self.prefix):
+            script, path = script + self.prefix, path[len(self.prefix):] or '/'
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD':    scope['method'],
+            'SCRIPT_NAME':       script.encode('utf-8').decode('latin-1'),
+            'PATH_INFO':         path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING':      scope['query_string'].decode('latin-1'),
+            'SERVER_NAME':       server[0],
+            'SERVER_PORT':       str(server[1] or 80),
+            'SERVER_PROTOCOL':   'HTTP/' + scope.get('http_version', '1.1'),
+            'REMOTE_ADDR':       client[0],
+            'REMOTE_PORT':       str(client[1]),
+            'wsgi.version':      (1, 0),
+            'wsgi.url_scheme':   scope.get('scheme', 'http'),
+            'wsgi.input':        body,
+            'wsgi.errors':       sys.stderr,
+            'wsgi.multithread':  True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once':     False,
+        }
+        for name, value in scope['headers']:
+            key = name.decode('latin-1').upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            value = value.decode('latin-1')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def match(self, environ):
+        # the async view for this request, or None to run it through WSGI
+        try:
+            endpoint, _ = self.flask.url_map.bind_to_environ(environ).match()
+        except HTTPException:   # 404, 405, slash redirects: Flask answers those
+            return None
+        return self.views.get(endpoint)
+
+    # ── async views ──
+
+    async def run_view(self, view, environ, send, receive):
+        # Flask.wsgi_app / full_dispatch_request, with the view awaited
+        start, app = perf_counter(), self.flask
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                resp = app.finalize_request(rv)
+            except Exception as e:
+                resp = app.handle_exception(e)
+
+        try:
+            await send({'type': 'http.response.start', 'status': resp.status_code,
+                        'headers': _headers(resp.get_wsgi_headers(environ).to_wsgi_list())})
+            body = resp.response
+            if not hasattr(body, '__aiter__'):
+                if not resp.is_streamed:
+                    await send({'type': 'http.response.body',
+                                'body': b''.join(resp.get_app_iter(environ))})
+                else:   # a generator (main.stream_page): chunks as they're made
+                    await self.stream(self.pull(resp.get_app_iter(environ)), send, receive)
+            elif environ['REQUEST_METHOD'] == 'HEAD':
+                await body.aclose()
+                await send({'type': 'http.response.body', 'body': b''})
+            else:
+                await self.stream(body, send, receive)
+        finally:
+            resp.close()
+            observe_request(environ, str(resp.status_code), perf_counter() - start)
+
+    async def stream(self, body, send, receive):
+        # an async body until it ends or the client goes away, whichever is first
+        async def pump():
+            async for chunk in body:
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': chunk.encode() if isinstance(chunk, str) else chunk})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(watch())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await body.aclose()
+        if tasks[0] in done:
+            tasks[0].result()   # re-raise a failed stream
+
+    async def pull(self, chunks):
+        # a sync body, each chunk made on the pool: it may do store work
+        loop, chunks = asyncio.get_running_loop(), iter(chunks)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.pool, next, chunks, None)
+                if chunk is None:
+                    return
+                if chunk:
+                    yield chunk
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self.pool, chunks.close)
+
+    # ── WSGI views ──
+
+    def run_wsgi(self, environ, send, loop):
+        # on a pool thread, as a threaded WSGI server would run it; each
+        # message waits for the loop to take it, so a slow client slows the
+        # thread down rather than buffering the whole body
+        head = {}
+
+        def push(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and head.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            head.update(status=int(status.split(' ', 1)[0]), headers=_headers(headers))
+            return write
+
+        def write(chunk, more=True):
+            if not head.get('sent'):
+                push({'type': 'http.response.start', 'status': head['status'],
+                      'headers': head['headers']})
+                head['sent'] = True
+            push({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+
+        body = self.flask(environ, start_response)
+        try:
+            held = b''   # one chunk behind, so the last goes out as the last
+            for chunk in body:
+                if chunk:
+                    if held:
+                        write(held)
+                    held = chunk
+            write(held, more=False)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    # ── lifespan ──
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    for fn in self.on_startup:
+                        fn()
+                    self.catch_signals()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': repr(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.drain()
+                for fn in self.on_shutdown:
+                    fn()
+                self.pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def catch_signals(self):
+        # drain first, then whatever the server does on the signal; the
+        # server only sends lifespan.shutdown once every connection is done
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if callable(previous):
+                def handler(signum, frame, previous=previous):
+                    self.drain()
+                    previous(signum, frame)
+                signal.signal(sig, handler)
+
+    def drain(self):
+        if not self.drained:
+            self.drained = True
+            for fn in self.on_drain:
+                fn()
+
+
+main.BROKER.max_subscribers = SSE_MAX
+
+app = ASGIApp(main.app, main.ASYNC_VIEWS, prefix=main.PREFIX,
+              on_startup=[main.SCHEDULER.start],
+              on_drain=[main.BROKER.close],
+              on_shutdown=[main.SCHEDULER.stop, main.ASTORE.close])
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('python asgi.py needs uvicorn: pip install uvicorn')
+    print(f'Loaded {main.STORE.count_books()} books')
+    uvicorn.run(app, host=os.environ.get('LIBRARY_HOST', '127.0.0.1'), port=5050,
+                timeout_graceful_shutdown=20)
@@ -0,0 +1,112 @@
+# ── JOURNAL ───────────────────────────────────────────────────────────────────
+# The in-memory store's write-ahead journal (see journal.py): how many
+# borrow / return round trips concurrent members get through with every one
+# on disk before it returns, and how long a restart takes to replay a
+# journal of millions of records, before and after compaction.
+#
+#   python bench/journal_bench.py                  # 32 threads, 1M records
+#   python bench/journal_bench.py --threads 8 --events 5000000
+#
+# Commits per fsync is the group commit at work: each fsync covers every
+# record queued while the one before it ran.
+
+import argparse, os, shutil, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ['LIBRARY_DB'] = ''
+
+from journal import Journal
+from metrics import METRICS
+from storage import MemoryStore
+
+
+def seeded(directory=None):
+    import main   # the CSV loader only; its STORE is not used
+    store = MemoryStore(Journal(directory) if directory else None)
+    store.seed(main._load_books)
+    return store
+
+
+def close(store):
+    store.journal.wait(store.journal.seq)
+    store.journal.lockfile.close()
+
+
+def round_trips(store, threads, seconds):
+    # borrow + return of a book per thread, as fast as they go; ops / second
+    done, stop = [0] * threads, time.perf_counter() + seconds
+    books = [b['id'] for b in store.books if b['available']][:threads]
+
+    def run(n):
+        email = f'bench{n}@journal.test'
+        while time.perf_counter() < stop:
+            store.borrow(books[n], email, 'Bench', 0)
+            store.return_loan(books[n], email, 0)
+            done[n] += 2
+
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for t in workers: t.start()
+    for t in workers: t.join()
+    return sum(done) / seconds
+
+
+def fill(journal, store, events):
+    # `events` loan records, straight into the journal: each loan borrowed
+    # then returned, so replay is last write wins on half of them
+    copies = [c for c in store.copies.values() if c['available']]
+    loan_id = journal.highs.get('L', 0)
+    for start in range(0, events, 2000):
+        batch = []
+        for i in range(start, min(events, start + 2000), 2):
+            loan_id += 1
+            copy = copies[loan_id % len(copies)]
+            rec  = ['L', loan_id, copy['book_id'], copy['id'], copy['format'],
+                    store.book_by_id[copy['book_id']]['title'],
+                    f'm{loan_id % 5000}@journal.test', 'Member', i, None, i + 86400, None]
+            batch += [rec, rec[:9] + [i + 1] + rec[10:]]
+        journal.append(*batch)
+    journal.wait(journal.seq)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--threads', type=int, default=32)
+    ap.add_argument('--seconds', type=float, default=5)
+    ap.add_argument('--events', type=int, default=1_000_000)
+    args = ap.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='journal-bench-')
+    try:
+        plain = round_trips(seeded(), args.threads, args.seconds)
+        store = seeded(directory)
+        commits = METRICS.histogram('journal_commit_seconds').counts
+        fsyncs  = sum(commits)
+        ops     = round_trips(store, args.threads, args.seconds)
+        fsyncs  = sum(commits) - fsyncs
+        print(f'{args.threads} threads, borrow + return for {args.seconds:.0f}s')
+        print(f'  {"no journal":<24}{plain:>10.0f} writes/s')
+        print(f'  {"journal, fsync each":<24}{ops:>10.0f} writes/s'
+              f'  ({ops * args.seconds / max(fsyncs, 1):.1f} commits per fsync)')
+
+        fill(store.journal, store, args.events)
+        close(store)
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+        print(f'{args.events} records in the journal, {size / 1e6:.0f}MB on disk')
+        t = time.perf_counter()
+        store = MemoryStore(Journal(directory))
+        print(f'  {"restart, replay":<24}{time.perf_counter() - t:>10.2f}s'
+              f'  ({len(store.loans)} loans)')
+        t = time.perf_counter()
+        store.compact()
+        print(f'  {"compact":<24}{time.perf_counter() - t:>10.2f}s')
+        close(store)
+        t = time.perf_counter()
+        store = MemoryStore(Journal(directory))
+        print(f'  {"restart, snapshot":<24}{time.perf_counter() - t:>10.2f}s')
+        close(store)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
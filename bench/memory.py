@@ -0,0 +1,74 @@
+# ── RECORD FOOTPRINT ──────────────────────────────────────────────────────────
+# Bytes per record in the memory store: the old dict records with formatted
+# time strings against the slotted records in storage.py with Unix seconds
+# and interned names.
+#
+#   python bench/memory.py              # 200k loans
+#   python bench/memory.py --loans 1000000
+#
+# Names and emails are rebuilt per loan, as they would be coming out of each
+# request's session cookie; titles are shared with the book either way.
+
+import argparse, os, sys, time, tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage
+
+USERS = 2000
+BOOKS = 5000
+
+
+def old_loan(i, title, email, name, at):
+    return {'id': i, 'book_id': i % BOOKS, 'copy_id': i % 7000, 'format': 'PB',
+            'book_title': title, 'user_email': email, 'user_name': name,
+            'borrowed_at': datetime.fromtimestamp(at).strftime('%Y-%m-%d %H:%M'),
+            'returned_at': datetime.fromtimestamp(at + 86400).strftime('%Y-%m-%d %H:%M')}
+
+def new_loan(i, title, email, name, at):
+    return storage._Loan(i, i % BOOKS, i % 7000, 'PB', title, sys.intern(email),
+                         sys.intern(name), at, at + 86400, at + 21 * 86400, None)
+
+def old_book(i, title):
+    return {'id': i, 'title': title, 'author': 'Agatha Christie', 'isbn': '9780007527533',
+            'location': 'F1-B09-S05', 'total': 3, 'available': 2}
+
+def new_book(i, title):
+    return storage._Book(i, title, 'Agatha Christie', '9780007527533', 'F1-B09-S05', 3, 2)
+
+
+def measure(make, n):
+    # bytes held per record, everything the records keep alive included
+    titles = [f'Title number {b}' for b in range(BOOKS)]
+    at     = int(time.time())
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep   = [make(i, titles[i % BOOKS], ''.join(['user', str(i % USERS), '@example.com']),
+                   ''.join(['User ', str(i % USERS)]), at + i) for i in range(n)]
+    used   = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del keep
+    return used / n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--loans', type=int, default=200_000)
+    args = ap.parse_args()
+
+    rows = [
+        ('loan', args.loans, old_loan, new_loan),
+        ('book', BOOKS, lambda i, t, *_: old_book(i, t), lambda i, t, *_: new_book(i, t)),
+    ]
+    print(f'{"record":<8}{"count":>10}{"dict":>12}{"slotted":>12}{"saved":>8}')
+    for name, n, old, new in rows:
+        a, b = measure(old, n), measure(new, n)
+        print(f'{name:<8}{n:>10}{a:>10.0f} B{b:>10.0f} B{1 - b / a:>8.0%}')
+        if name == 'loan':
+            total = f'{n} loans: {a * n / 2**20:.0f} MB as dicts, {b * n / 2**20:.0f} MB slotted'
+    print('\n' + total)
+
+
+if __name__ == '__main__':
+    main()
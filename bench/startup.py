@@ -0,0 +1,106 @@
+# ── STARTUP COST ──────────────────────────────────────────────────────────────
+# How long a fresh worker takes to import main.py (which seeds the memory
+# store) and how much memory it holds, with and without the catalogue
+# snapshot, plus the seed loaders on their own.
+#
+#   python bench/startup.py               # library_booklist.csv as shipped
+#   python bench/startup.py --scale 50    # catalogue blown up 50x
+#
+# PSS splits shared pages (the interpreter, shared libraries) between the
+# processes using them, so it's the fairer per-worker figure when several run
+# at once. The snapshot is decoded into the store, so it adds nothing shared.
+
+import argparse, csv, os, subprocess, sys, tempfile, time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# run in a child: import main, then print seconds, RSS kB, PSS kB
+CHILD = r'''
+import sys, time
+sys.path.insert(0, {root!r})
+t = time.perf_counter()
+import snapshot
+if {no_snap}:
+    snapshot.open_snapshot = lambda path, parse: None
+import main
+secs = time.perf_counter() - t
+mem  = {{}}
+try:
+    for line in open('/proc/self/smaps_rollup'):
+        k, v = line.split(':', 1)
+        mem[k] = int(v.split()[0])
+except OSError:
+    pass
+print(secs, mem.get('Rss', 0), mem.get('Pss', 0))
+'''
+
+
+def child(csv_path, no_snap):
+    out = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, no_snap=no_snap)],
+                         capture_output=True, text=True, check=True, cwd=ROOT,
+                         env={**os.environ, 'LIBRARY_DB': '', 'LIBRARY_CSV': csv_path})
+    secs, rss, pss = out.stdout.split()
+    return float(secs), int(rss), int(pss)
+
+
+def scaled_csv(scale):
+    # a temp copy of library_booklist.csv, repeated `scale` times with distinct titles
+    with open(os.path.join(ROOT, 'library_booklist.csv'), newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    fd, path = tempfile.mkstemp(suffix='.csv', prefix='startup-')
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+        out = csv.DictWriter(f, fieldnames=list(rows[0]))
+        out.writeheader()
+        for n in range(scale):
+            for r in rows:
+                out.writerow({**r, 'title': f'{r["title"]} ({n})' if n else r['title']})
+    return path
+
+
+def timed(fn):
+    t = time.perf_counter()
+    fn()
+    return time.perf_counter() - t
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type=int, default=1)
+    ap.add_argument('--runs', type=int, default=5)
+    args = ap.parse_args()
+
+    # always a temp copy: the snapshot the runs build and delete sits beside
+    # it, never beside the repo's own CSV
+    csv_path = scaled_csv(args.scale)
+    snap     = os.path.splitext(csv_path)[0] + '.snap'
+    os.environ['LIBRARY_CSV'] = csv_path
+    try:
+        first = child(csv_path, False)   # parses, then writes the snapshot
+        runs  = {'csv': [], 'snapshot': []}
+        for _ in range(args.runs):
+            runs['csv'].append(child(csv_path, True))
+            runs['snapshot'].append(child(csv_path, False))
+
+        print(f'catalogue x{args.scale}, best of {args.runs} fresh processes')
+        print(f'  {"":<22}{"import main":>12}{"RSS":>10}{"PSS":>10}')
+        for name, results in [('first start (build)', [first])] + list(runs.items()):
+            secs = min(r[0] for r in results)
+            rss  = min(r[1] for r in results)
+            pss  = min(r[2] for r in results)
+            print(f'  {name:<22}{secs * 1000:>10.0f}ms{rss / 1024:>8.1f}MB{pss / 1024:>8.1f}MB')
+
+        # the seed loaders alone, in this process
+        import main, snapshot
+        for name, load in (('parse csv', main._parse_csv),
+                           ('decode snapshot', lambda: list(snapshot.Snapshot(snap).books()))):
+            best = min(timed(load) for _ in range(args.runs))
+            print(f'  {name:<22}{best * 1000:>10.1f}ms')
+    finally:
+        for path in (csv_path, snap):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
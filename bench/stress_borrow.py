@@ -0,0 +1,91 @@
+# ── BORROW / RETURN STRESS CHECK ──────────────────────────────────────────────
+# Fires hundreds of concurrent borrow and return requests at the app and then
+# checks that no copy ever ended up with more than one open loan.
+#
+#   python bench/stress_borrow.py                          # memory store, threads
+#   LIBRARY_DB=/tmp/stress.db python bench/stress_borrow.py --procs 4
+#
+# Exits non-zero if an invariant is broken.
+
+import argparse, os, sys, threading
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def login(client, main, email):
+    # straight into the session: hundreds of real logins from one address
+    # would only exercise the login throttle
+    main.STORE.add_user(email, {'name': email.split('@')[0], 'password': '',
+                                'address': 'x', 'is_staff': False})
+    with client.session_transaction() as s:
+        s['user_email'], s['user_name'], s['is_staff'] = email, email.split('@')[0], False
+
+
+def hammer(worker, users, books, rounds):
+    # each thread is one logged-in user racing everyone else for the same books
+    import main
+    barrier = threading.Barrier(users)
+
+    def run(n):
+        client = main.app.test_client()
+        login(client, main, f'w{worker}u{n}@stress.test')
+        barrier.wait()
+        for _ in range(rounds):
+            for bid in books:
+                client.post(main.PREFIX + f'/books/borrow/{bid}')
+                client.post(main.PREFIX + f'/books/return/{bid}')
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(users)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+
+def check(main):
+    # no copy or (user, title) has two open loans, and every title's
+    # available counter matches its copies on the shelf
+    open_copies, open_users = {}, {}
+    for loan in main.STORE.all_loans_newest():
+        if loan['returned_at'] is None:
+            for seen, key in ((open_copies, loan['copy_id']),
+                              (open_users, (loan['user_email'], loan['book_id']))):
+                seen[key] = seen.get(key, 0) + 1
+    doubles = {k: n for k, n in {**open_copies, **open_users}.items() if n > 1}
+    counts  = [b['id'] for b in main.STORE.list_books()
+               if b['available'] != sum(c['available'] for c in main.STORE.list_copies(b['id']))
+               or any(c['available'] == (c['id'] in open_copies)
+                      for c in main.STORE.list_copies(b['id']))]
+    return doubles, counts
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--users',  type=int, default=200, help='concurrent users per process')
+    ap.add_argument('--books',  type=int, default=5,   help='titles everyone fights over')
+    ap.add_argument('--rounds', type=int, default=3)
+    ap.add_argument('--procs',  type=int, default=1,   help='worker processes (SQLite only)')
+    args = ap.parse_args()
+    if args.procs > 1 and not os.environ.get('LIBRARY_DB'):
+        ap.error('--procs needs LIBRARY_DB so processes share one store')
+
+    books = list(range(1, args.books + 1))
+    if args.procs == 1:
+        hammer(0, args.users, books, args.rounds)
+    else:
+        import main    # create / seed the database once before forking
+        with ProcessPoolExecutor(args.procs) as pool:
+            list(pool.map(hammer, range(args.procs), [args.users] * args.procs,
+                          [books] * args.procs, [args.rounds] * args.procs))
+
+    import main
+    doubles, counts = check(main)
+    loans = main.STORE.all_loans_newest()
+    print(f'{len(loans)} loans from {args.users * args.procs} concurrent users '
+          f'over {args.books} titles')
+    print(f'double loans: {doubles or "none"}')
+    print(f'availability counter mismatches: {counts or "none"}')
+    sys.exit(1 if doubles or counts else 0)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,344 @@
+# ── LOAD TEST SUITE ───────────────────────────────────────────────────────────
+# Latency and throughput of the catalogue and loan hot paths against a
+# synthetic catalogue and loan history (see synth.py), written out as JSON so
+# runs can be compared across commits.
+#
+#   python bench/suite.py                                  # 10k books, test client
+#   python bench/suite.py --books 100000 --loans 200000
+#   python bench/suite.py --server --workers 4             # local multi-worker server
+#   python bench/suite.py --out new.json --compare old.json
+#
+# The default drives the app in-process through Flask's test client (memory
+# store unless --db). --server seeds a temporary SQLite database, forks
+# --workers server processes sharing one listening socket, and talks HTTP.
+#
+# Scenarios (one operation each, timed end to end):
+#   browse         anonymous first pages of the catalogue
+#   browse_member  the same, logged in (no whole-page cache)
+#   search         a title / author word
+#   paginate       any page, sometimes with a floor or format facet
+#   borrow_return  borrow a random title, then return it
+#   my_loans       My Loans, first or an older page
+#   staff          All Loans (filtered or not) and the loans API
+#   mix            80% reads, 10% search, 10% borrow / return
+
+import argparse, http.client, json, os, platform, random, socket, subprocess, sys
+import tempfile, threading, time
+from urllib.parse import urlencode
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(1, HERE)   # after ROOT, so the app's modules win over scripts here
+
+import synth
+
+PER_PAGE = 24
+
+
+# ── clients ──
+
+class TestClient:
+    def __init__(self, app, prefix):
+        self.client = app.test_client()
+        self.prefix = prefix
+
+    def request(self, method, path, data=None):
+        resp = self.client.open(self.prefix + path, method=method, data=data)
+        resp.get_data()
+        resp.close()
+        return resp.status_code
+
+
+class HTTPClient:
+    # one keep-alive-if-possible connection and a session cookie per client
+    def __init__(self, port, prefix):
+        self.conn   = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.prefix = prefix
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        body    = urlencode(data) if data else None
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        if body:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in (1, 2):
+            try:
+                self.conn.request(method, self.prefix + path, body, headers)
+                resp = self.conn.getresponse()
+                resp.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                self.conn.close()
+                if attempt == 2:
+                    raise
+        for value in resp.headers.get_all('Set-Cookie') or ():
+            if value.startswith('session='):
+                self.cookie = value.split(';', 1)[0]
+        if resp.getheader('Connection', '').lower() == 'close':
+            self.conn.close()
+        return resp.status
+
+
+def add_users(store, emails, staff=False):
+    # accounts go straight into the store: signups from one address are throttled
+    from passwords import hash_password
+    hashed = hash_password('bench-pass')
+    for email in emails:
+        store.add_user(email, {'name': email.split('@')[0], 'password': hashed,
+                               'address': 'x', 'is_staff': staff})
+
+
+def login(client, email):
+    for _ in range(60):   # waits out the per-address login throttle if need be
+        client.request('POST', '/login', {'email': email, 'password': 'bench-pass'})
+        if client.request('GET', '/my-loans') == 200:
+            return client
+        time.sleep(0.5)
+    raise SystemExit(f'could not log in as {email}')
+
+
+# ── scenarios ──
+# fn(clients, rnd, ctx) -> True if every response was as expected: pages 200,
+# form posts a redirect (a login redirect from a page would hide a broken session)
+
+def ok(*statuses):
+    return all(s == 200 for s in statuses)
+
+def posted(*statuses):
+    return all(s in (302, 303) for s in statuses)
+
+def browse(c, rnd, ctx):
+    return ok(c['anon'].request('GET', f'/?page={rnd.randint(1, min(10, ctx["pages"]))}'))
+
+def browse_member(c, rnd, ctx):
+    return ok(c['member'].request('GET', f'/?page={rnd.randint(1, min(10, ctx["pages"]))}'))
+
+def search(c, rnd, ctx):
+    return ok(c['member'].request('GET', '/?' + urlencode({'q': rnd.choice(ctx['terms'])})))
+
+def paginate(c, rnd, ctx):
+    args = {'page': rnd.randint(1, ctx['pages'])}
+    pick = rnd.random()
+    if pick < 0.25:
+        args['floor'] = rnd.choice(('F0', 'F1', 'F2'))
+    elif pick < 0.5:
+        args['fmt'] = rnd.choice(('PB', 'LP', 'ACD', 'EBK'))
+    return ok(c['member'].request('GET', '/?' + urlencode(args)))
+
+def borrow_return(c, rnd, ctx):
+    bid = rnd.randint(1, ctx['books'])
+    return posted(c['member'].request('POST', f'/books/borrow/{bid}'),
+              c['member'].request('POST', f'/books/return/{bid}'))
+
+def my_loans(c, rnd, ctx):
+    path = '/my-loans' if rnd.random() < 0.7 else f'/my-loans?before={rnd.randint(1, ctx["loans"] or 1)}'
+    return ok(c['member'].request('GET', path))
+
+def staff(c, rnd, ctx):
+    path = rnd.choice(('/all-loans', '/all-loans?status=open',
+                       f'/all-loans?before={rnd.randint(1, ctx["loans"] or 1)}',
+                       '/api/v1/loans?limit=100'))
+    return ok(c['staff'].request('GET', path))
+
+def mix(c, rnd, ctx):
+    r = rnd.random()
+    if r < 0.3:
+        return browse(c, rnd, ctx)
+    if r < 0.6:
+        return browse_member(c, rnd, ctx)
+    if r < 0.8:
+        return paginate(c, rnd, ctx)
+    if r < 0.9:
+        return search(c, rnd, ctx)
+    return borrow_return(c, rnd, ctx)
+
+SCENARIOS = {f.__name__: f for f in (browse, browse_member, search, paginate,
+                                     borrow_return, my_loans, staff, mix)}
+
+
+def run(fn, clients, ctx, seconds):
+    # every thread loops over fn for `seconds`; latency of each operation
+    lat, errors, lock = [], [0], threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def work(n):
+        rnd, mine, bad = random.Random(n), [], 0
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                good = fn(clients[n], rnd, ctx)
+            except Exception:
+                good = False
+            mine.append(time.perf_counter() - start)
+            bad += not good
+        with lock:
+            lat.extend(mine)
+            errors[0] += bad
+
+    start   = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(len(clients))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    lat.sort()
+    pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 3) if lat else None
+    return {'ops': len(lat), 'errors': errors[0], 'ops_per_sec': round(len(lat) / elapsed, 1),
+            'p50_ms': pct(.50), 'p90_ms': pct(.90), 'p99_ms': pct(.99),
+            'max_ms': round(lat[-1] * 1000, 3) if lat else None}
+
+
+# ── setup ──
+
+def prepare(args, tmp):
+    # synthetic catalogue CSV (+ database), then import main with them
+    csv_path = os.path.join(tmp, 'catalogue.csv')
+    t = time.perf_counter()
+    synth.write_catalogue(csv_path, args.books)
+    os.environ['LIBRARY_CSV'] = csv_path
+    if args.server or args.db:
+        os.environ['LIBRARY_DB'] = os.path.join(tmp, 'bench.db')
+    else:
+        os.environ.pop('LIBRARY_DB', None)
+    import main
+    members = [f'bench{n}@bench.test' for n in range(args.threads)]
+    made = synth.seed_loans(main.STORE, args.loans, args.books, users=1000, extra_users=members)
+    add_users(main.STORE, members)
+    add_users(main.STORE, [f'staff{n}@bench.test' for n in range(args.threads)], staff=True)
+    print(f'setup: {args.books} books, {made} loans in {time.perf_counter() - t:.1f}s',
+          file=sys.stderr)
+    return main, members, made
+
+
+def start_server(workers, env):
+    # pre-fork: one listening socket, inherited by every worker process
+    sock = socket.create_server(('127.0.0.1', 0), backlog=1024)
+    sock.set_inheritable(True)
+    procs = [subprocess.Popen([sys.executable, __file__, '--worker-fd', str(sock.fileno())],
+                              pass_fds=[sock.fileno()], env=env, cwd=ROOT)
+             for _ in range(workers)]
+    port = sock.getsockname()[1]
+    for _ in range(300):
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=5).request('GET', '/metrics')
+            break
+        except OSError:
+            time.sleep(0.1)
+    return sock, procs, port
+
+
+def serve_worker(fd):
+    import logging
+    from werkzeug.serving import make_server
+    import main
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)   # no per-request log lines
+    make_server('127.0.0.1', 0, main.app, threaded=True, fd=fd).serve_forever()
+
+
+def git_commit():
+    try:
+        rev   = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return rev + ('-dirty' if dirty else '') if rev else None
+    except OSError:
+        return None
+
+
+def compare(old, new):
+    a, b = old.get('meta', {}), new['meta']
+    print(f'\n{a.get("commit")} -> {b["commit"]}')
+    for key in ('mode', 'store', 'workers', 'books', 'loans', 'threads'):
+        if a.get(key) != b[key]:
+            print(f'  note: {key} differs ({a.get(key)} vs {b[key]})')
+    print(f'{"scenario":<15}{"p50 ms":>18}{"p99 ms":>18}{"ops/s":>18}')
+    for name, cur in new['results'].items():
+        prev = old.get('results', {}).get(name)
+        if not prev:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p99_ms', 'ops_per_sec'):
+            a, b = prev[key], cur[key]
+            change = f'{(b - a) / a:+.0%}' if a else ''
+            cells.append(f'{b:>10} {change:>6}')
+        print(f'{name:<15}' + ''.join(f'{c:>18}' for c in cells))
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--books',     type=int, default=10_000, help='10000, 100000, 1000000 ...')
+    ap.add_argument('--loans',     type=int, default=None, help='loan history size (default: = books)')
+    ap.add_argument('--threads',   type=int, default=4, help='concurrent clients')
+    ap.add_argument('--seconds',   type=float, default=5, help='per scenario')
+    ap.add_argument('--scenarios', default=','.join(SCENARIOS))
+    ap.add_argument('--db',        action='store_true', help='SQLite store in test client mode')
+    ap.add_argument('--server',    action='store_true', help='HTTP against local worker processes')
+    ap.add_argument('--workers',   type=int, default=4)
+    ap.add_argument('--out',       help='write the JSON report here (default: stdout)')
+    ap.add_argument('--compare',   help='earlier JSON report to diff against')
+    ap.add_argument('--worker-fd', type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker_fd is not None:
+        return serve_worker(args.worker_fd)
+    if args.loans is None:
+        args.loans = args.books
+    names = [n for n in args.scenarios.split(',') if n]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        ap.error(f'unknown scenario(s): {", ".join(sorted(unknown))}')
+
+    with tempfile.TemporaryDirectory(prefix='library-bench-') as tmp:
+        main, members, made = prepare(args, tmp)
+        procs = []
+        if args.server:
+            sock, procs, port = start_server(args.workers, dict(os.environ))
+            make = lambda: HTTPClient(port, main.PREFIX)
+        else:
+            make = lambda: TestClient(main.app, main.PREFIX)
+        try:
+            clients = [{'anon':   make(),
+                        'member': login(make(), members[n]),
+                        'staff':  login(make(), f'staff{n}@bench.test')}
+                       for n in range(args.threads)]
+            ctx = {'books': args.books, 'loans': made, 'terms': synth.search_terms(),
+                   'pages': max(1, (args.books + PER_PAGE - 1) // PER_PAGE)}
+            for c in clients:   # warm up: index build, caches, every worker
+                for fn in (browse, search, paginate):
+                    fn(c, random.Random(0), ctx)
+            results = {}
+            for name in names:
+                results[name] = run(SCENARIOS[name], clients, ctx, args.seconds)
+                r = results[name]
+                print(f'{name:<15} {r["ops"]:>7} ops {r["ops_per_sec"]:>8}/s  '
+                      f'p50 {r["p50_ms"]}ms  p99 {r["p99_ms"]}ms  errors {r["errors"]}',
+                      file=sys.stderr)
+        finally:
+            for proc in procs:
+                proc.terminate()
+                proc.wait()
+
+    report = {
+        'meta': {'commit': git_commit(), 'when': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count(),
+                 'mode': 'server' if args.server else 'test-client',
+                 'store': 'sqlite' if args.server or args.db else 'memory',
+                 'workers': args.workers if args.server else 1,
+                 'books': args.books, 'loans': made, 'threads': args.threads,
+                 'seconds': args.seconds},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,76 @@
+# ── SYNTHETIC DATA ────────────────────────────────────────────────────────────
+# Catalogues and loan histories of any size, shaped like library_booklist.csv:
+# every generated title borrows a real title's author, formats and shelf
+# spread, so per-title copy counts, facet values and search terms keep the
+# real distribution.
+
+import csv, os, random, time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def templates():
+    # [(title, author, [(format, location), ...])] grouped as the app groups them
+    seen = {}
+    with open(os.path.join(ROOT, 'library_booklist.csv'), newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            key = (row['title'].strip(), row['author'].strip())
+            seen.setdefault(key, []).append((row['format_code'].strip() or 'PB',
+                                             row['location_code'].strip()))
+    return [(t, a, copies) for (t, a), copies in seen.items()]
+
+
+def isbn13(n):
+    digits = f'979{n % 10**9:09d}'
+    check  = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+def write_catalogue(path, books, seed=1):
+    # CSV with `books` titles; the first pass is the real catalogue unchanged
+    rnd   = random.Random(seed)
+    tmpl  = templates()
+    rows  = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        out = csv.writer(f)
+        out.writerow(['title', 'author', 'isbn_13', 'format_code', 'location_code', 'notes'])
+        for n in range(books):
+            title, author, copies = tmpl[n % len(tmpl)]
+            vol = n // len(tmpl)
+            if vol:
+                title = f'{title} ({rnd.choice(("Vol.", "Part", "Book"))} {vol + 1})'
+            isbn = isbn13(n)
+            for fmt, loc in copies:
+                out.writerow([title, author, isbn, fmt, loc, ''])
+                rows += 1
+    return rows
+
+
+def search_terms(count=200, seed=1):
+    # words that occur in real titles and authors, for search queries
+    rnd   = random.Random(seed)
+    words = sorted({w.lower() for t, a, _ in templates() for w in (t + ' ' + a).split()
+                    if len(w) > 3 and w.isalpha()})
+    return rnd.sample(words, min(count, len(words)))
+
+
+def seed_loans(store, loans, books, users, extra_users=(), seed=1, span_days=365):
+    # `loans` borrow/return pairs spread over the last `span_days`, oldest
+    # first so loan ids follow time; about 5% are left open
+    rnd    = random.Random(seed)
+    emails = [f'reader{u}@bench.test' for u in range(users)] + list(extra_users)
+    now    = int(time.time())
+    start  = now - span_days * 86400
+    step   = span_days * 86400 / max(loans, 1)
+    made   = 0
+    for i in range(loans):
+        at    = int(start + i * step)
+        email = emails[rnd.randrange(len(emails))]
+        bid   = rnd.randint(1, books)
+        outcome, _ = store.borrow(bid, email, email.split('@')[0], at)
+        if outcome != 'ok':
+            continue
+        made += 1
+        if rnd.random() > 0.05:
+            store.return_loan(bid, email, min(now, at + rnd.randint(3600, 21 * 86400)))
+    return made
@@ -0,0 +1,51 @@
+# ── RENDER CACHE ──────────────────────────────────────────────────────────────
+# Bounded LRU caches for rendered HTML.
+# Each entry is stored with a stamp describing the data it was rendered
+# from; a lookup with a different stamp is a miss. That catches changes made
+# by other workers, while the mutation routes also invalidate explicitly so
+# stale entries don't sit around taking space.
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, name, size):
+        self.name   = name
+        self.size   = size
+        self.data   = OrderedDict()   # { key: (stamp, value) }, oldest first
+        self.lock   = threading.Lock()
+        self.hits   = 0
+        self.misses = 0
+
+    def get(self, key, stamp):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, stamp, value):
+        with self.lock:
+            self.data[key] = (stamp, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def drop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'size': len(self.data), 'capacity': self.size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / total, 3) if total else None}
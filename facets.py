@@ -0,0 +1,142 @@
+# ── FACETS ────────────────────────────────────────────────────────────────────
+# Bitmap indexes for the catalogue filters.
+# A bitmap is a plain Python int with bit n set for book id n, so combining
+# filters is a handful of & / | over machine words and counting is
+# int.bit_count(), whatever the size of the catalogue.
+#
+#   fmt    — copy format_code (PB, LP, ACD, ADIG, EBK); a title matches if
+#            any of its copies has that format
+#   floor  — "F1" from a location_code such as F1-B09-S05
+#   bay    — "F1-B09" (bay numbers repeat on each floor)
+#
+# Availability changes on every borrow, so its bitmap lives in the store.
+
+import re
+
+FACETS = ('fmt', 'floor', 'bay')
+
+_LOC_RE = re.compile(r'^(F\d+)-(B\d+)', re.I)
+
+
+def copy_facets(copy):
+    out = [('fmt', copy['format'])]
+    m = _LOC_RE.match(copy['location'] or '')
+    if m:
+        floor = m.group(1).upper()
+        out += [('floor', floor), ('bay', f'{floor}-{m.group(2).upper()}')]
+    return out
+
+
+def floor_of(location):
+    # "F1" from F1-B09-S05; None if the code has no floor
+    m = _LOC_RE.match(location or '')
+    return m.group(1).upper() if m else None
+
+
+# ── bitmap helpers ──
+
+def bits_from_ids(ids):
+    # building through a bytearray keeps this O(len(ids)), not O(len(ids) * width)
+    ids = list(ids)
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+def select_bits(bits, offset=0, limit=None):
+    # ids of set bits in ascending order, skipping the first `offset`
+    if offset:
+        # binary search for the lowest bit position with `offset` set bits below it
+        lo, hi = 0, bits.bit_length()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (bits & ((1 << mid) - 1)).bit_count() < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        bits = (bits >> lo) << lo
+    out = []
+    while bits and (limit is None or len(out) < limit):
+        low = bits & -bits
+        out.append(low.bit_length() - 1)
+        bits ^= low
+    return out
+
+
+class FacetIndex:
+    def __init__(self):
+        self.bits  = {f: {} for f in FACETS}   # { facet: {value: bitmap} }
+        self.terms = {}                        # { book_id: {(facet, value), ...} }
+        self.all   = 0                         # every indexed book
+
+    @classmethod
+    def build(cls, book_ids, copies):
+        idx = cls()
+        ids = {}   # { (facet, value): [book_id, ...] } — bulk build, then one int each
+        for copy in copies:
+            bid = copy['book_id']
+            for term in copy_facets(copy):
+                if term not in idx.terms.setdefault(bid, set()):
+                    idx.terms[bid].add(term)
+                    ids.setdefault(term, []).append(bid)
+        for (facet, value), bids in ids.items():
+            idx.bits[facet][value] = bits_from_ids(bids)
+        idx.all = bits_from_ids(book_ids)
+        return idx
+
+    def copy(self):
+        # a new index to patch; this one is left as it is
+        new = FacetIndex()
+        new.bits  = {f: dict(values) for f, values in self.bits.items()}
+        new.terms = dict(self.terms)
+        new.all   = self.all
+        return new
+
+    def remove(self, book_id):
+        bit = 1 << book_id
+        for facet, value in self.terms.pop(book_id, ()):
+            left = self.bits[facet][value] & ~bit
+            if left:
+                self.bits[facet][value] = left
+            else:
+                del self.bits[facet][value]
+        self.all &= ~bit
+
+    def update(self, book_id, copies):
+        self.remove(book_id)
+        bit   = 1 << book_id
+        terms = self.terms[book_id] = set()
+        for copy in copies:
+            terms.update(copy_facets(copy))
+        for facet, value in terms:
+            self.bits[facet][value] = self.bits[facet].get(value, 0) | bit
+        self.all |= bit
+
+    def values(self, facet):
+        return sorted(self.bits[facet])
+
+    def facet_bits(self, facet, chosen):
+        # OR of the chosen values within one facet
+        out = 0
+        for value in chosen:
+            out |= self.bits[facet].get(value, 0)
+        return out
+
+    def filter(self, base, selected):
+        # base & every selected facet; selected is {facet: [values]}
+        for facet, chosen in selected.items():
+            if chosen:
+                base &= self.facet_bits(facet, chosen)
+        return base
+
+    def counts(self, base, selected):
+        # per-value hit counts; each facet is counted with the other facets
+        # applied but not itself, so picking a value doesn't hide its siblings
+        out = {}
+        for facet in FACETS:
+            others = self.filter(base, {f: v for f, v in selected.items() if f != facet})
+            out[facet] = {value: (others & bits).bit_count()
+                          for value, bits in self.bits[facet].items()}
+        return out
@@ -0,0 +1,27 @@
+# ── GUNICORN ──────────────────────────────────────────────────────────────────
+# Multi-worker production server for the ASGI app (see asgi.py):
+#
+#   pip install gunicorn uvicorn
+#   LIBRARY_DB=library.db gunicorn -c gunicorn.conf.py asgi:app
+#
+# Each worker is its own process with its own event loop, caches and
+# background scheduler, so they need the shared SQLite store: without
+# LIBRARY_DB (the in-memory store lives in one process) there is one worker.
+#
+# SIGTERM (or SIGINT) stops accepting connections, closes live-update streams
+# and gives in-flight requests graceful_timeout seconds before the workers
+# are killed. SIGHUP replaces the workers one by one with fresh ones.
+
+import os
+
+shared  = bool(os.environ.get('LIBRARY_DB'))
+bind    = os.environ.get('LIBRARY_BIND', '0.0.0.0:5050')
+workers = int(os.environ.get('LIBRARY_WORKERS', (os.cpu_count() or 1) if shared else 1))
+if workers > 1 and not shared:
+    raise SystemExit('LIBRARY_WORKERS > 1 needs LIBRARY_DB: the in-memory store is per process')
+
+worker_class     = 'uvicorn.workers.UvicornWorker'
+graceful_timeout = 20   # seconds in-flight requests get after SIGTERM
+timeout          = 60   # a worker whose loop stops answering this long is restarted
+keepalive        = 5
+accesslog        = os.environ.get('LIBRARY_ACCESS_LOG')   # a path, or '-' for stdout
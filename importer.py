@@ -0,0 +1,152 @@
+# ── BULK IMPORT ───────────────────────────────────────────────────────────────
+# Loads a catalogue CSV in the layout of library_booklist.csv — one row per
+# physical copy, columns title, author, isbn_13, format_code, location_code —
+# into the store.
+#
+# The file is read row by row and written in batches through
+# STORE.import_batch(), so a 100k-row upload never sits in memory and each
+# batch is one short transaction. Rows for the same title within a batch are
+# grouped; the store matches titles to existing books (ISBN, then title +
+# author), so re-importing a title adds its copies instead of a duplicate.
+#
+# Used by the staff upload page (in a background thread) and by
+#   flask --app main import-books FILE.csv
+
+import csv, re, threading, time
+
+from storage import FORMATS
+
+BATCH      = 1000   # rows per store transaction
+MAX_ERRORS = 50     # rejected rows kept for the report; the rest are only counted
+
+_FLOAT_RE = re.compile(r'^(\d+)\.0+$')   # 9780140449136.0 from a spreadsheet
+_LOC_RE   = re.compile(r'^F\d+-B\d+(-S\d+)?$', re.I)
+
+
+def clean_isbn(raw):
+    # strip spacing, hyphens and a spreadsheet float's ".0" — and only that,
+    # so ISBNs that really end in 0 keep their digits
+    text = (raw or '').strip().upper()
+    m = _FLOAT_RE.match(text)
+    if m:
+        text = m.group(1)
+    return re.sub(r'[\s-]', '', text)
+
+def isbn_ok(isbn):
+    # ISBN-13 or ISBN-10 with a correct check digit
+    if re.fullmatch(r'\d{13}', isbn):
+        return sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(isbn)) % 10 == 0
+    if re.fullmatch(r'\d{9}[\dX]', isbn):
+        digits = [10 if d == 'X' else int(d) for d in isbn]
+        return sum(d * (10 - i) for i, d in enumerate(digits)) % 11 == 0
+    return False
+
+
+def parse_rows(f):
+    # (line number, copy row or None, error or None) for each row of the
+    # text stream f; raises ValueError if the header is unusable
+    reader  = csv.DictReader(f)
+    missing = {'title', 'author'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f'missing column(s): {", ".join(sorted(missing))}')
+    for row in reader:
+        line   = reader.line_num
+        title  = (row.get('title') or '').strip()
+        author = (row.get('author') or '').strip()
+        isbn   = clean_isbn(row.get('isbn_13'))
+        fmt    = (row.get('format_code') or '').strip().upper() or 'PB'
+        loc    = (row.get('location_code') or '').strip().upper()
+        if not title or not author:
+            yield line, None, 'title and author are required'
+        elif isbn and not isbn_ok(isbn):
+            yield line, None, f'invalid ISBN {row.get("isbn_13")!r}'
+        elif fmt not in FORMATS:
+            yield line, None, f'unknown format {fmt!r}'
+        elif loc and not _LOC_RE.match(loc):
+            yield line, None, f'bad location {loc!r}'
+        else:
+            yield line, {'title': title, 'author': author, 'isbn': isbn,
+                         'format': fmt, 'location': loc}, None
+
+
+class ImportJob:
+    # progress of one import, read by the status page while it runs
+    def __init__(self, name):
+        self.name     = name
+        self.started  = time.time()
+        self.finished = None
+        self.rows     = 0   # data rows read
+        self.copies   = 0   # copies written
+        self.added    = 0   # new books
+        self.merged   = 0   # existing books that got copies
+        self.rejected = 0
+        self.errors   = []  # [(line, message)], first MAX_ERRORS only
+        self.failed   = None
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def status(self):
+        return {'name': self.name, 'rows': self.rows, 'copies': self.copies,
+                'added': self.added, 'merged': self.merged, 'rejected': self.rejected,
+                'errors': self.errors, 'failed': self.failed,
+                'done': self.finished is not None,
+                'seconds': round((self.finished or time.time()) - self.started, 1)}
+
+
+def run_import(store, f, job, on_batch=None, batch=BATCH):
+    # on_batch(added_books, merged_ids, version) runs after each commit
+    pending = {}   # { (title, author) casefolded: title record }
+    queued  = 0
+
+    def flush():
+        added, merged, version = store.import_batch(list(pending.values()), int(time.time()))
+        job.added  += len(added)
+        job.merged += len(merged)
+        job.copies += queued
+        if on_batch:
+            on_batch(added, merged, version)
+        pending.clear()
+
+    try:
+        for line, row, error in parse_rows(f):
+            job.rows += 1
+            if error:
+                job.reject(line, error)
+                continue
+            key   = (row['title'].casefold(), row['author'].casefold())
+            title = pending.get(key)
+            if title is None:
+                title = pending[key] = {'title': row['title'], 'author': row['author'],
+                                        'isbn': row['isbn'], 'copies': []}
+            elif not title['isbn']:
+                title['isbn'] = row['isbn']
+            title['copies'].append({'format': row['format'], 'location': row['location']})
+            queued += 1
+            if queued >= batch:
+                flush()
+                queued = 0
+        if pending:
+            flush()
+    except Exception as e:   # reported on the status page; committed batches stay
+        job.failed = str(e)
+    finally:
+        job.finished = time.time()
+    return job
+
+
+def start_import(store, path, job, on_batch=None, cleanup=None):
+    # run_import() over the file at path in a daemon thread
+    def work():
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                run_import(store, f, job, on_batch)
+        except OSError as e:
+            job.failed, job.finished = str(e), time.time()
+        finally:
+            if cleanup:
+                cleanup()
+    threading.Thread(target=work, name=f'import-{job.name}', daemon=True).start()
+    return job
@@ -0,0 +1,284 @@
+# ── JOURNAL ───────────────────────────────────────────────────────────────────
+# Write-ahead journal that lets the in-memory store survive restarts:
+# LIBRARY_JOURNAL=path/to/dir (see storage.MemoryStore).
+#
+# Every store write appends the records it changed, whole, while it still
+# holds the lock that orders them:
+#   ['B', id, title, author, isbn]         ['-B', id]   book / deleted book
+#   ['C', id, book_id, format, location]   ['-C', id]   copy / deleted copy
+#   ['L', <loan fields>]  ['H', <hold fields>]  ['M', <message fields>]
+#   ['U', email, {user}]
+# Appending only queues the record. One writer thread takes whatever has
+# queued, writes it as one frame and fsyncs, then releases every caller that
+# frame covered: group commit, so while one fsync runs the next batch builds
+# up and N concurrent writers share far fewer than N fsyncs. A store write
+# returns once its records are on disk (wait()), never holding a store lock
+# while it waits.
+#
+# Files in the directory:
+#   journal-<n>.log    frames appended since snapshot n was started
+#   snapshot-<n>.snap  every live record, taken after journal-<n> began
+#   lock               held while a process has the journal open
+# A frame is  <length u32><crc32 u32><JSON array of records>. A torn frame
+# at the end of the newest segment (a crash mid-write) was never
+# acknowledged, so replay stops there and the segment is cut back to it.
+#
+# Recovery loads the newest snapshot and replays the segments from its
+# number on. Records are whole and replay is last write wins per (kind, id),
+# so replaying the tail is a dict assignment per record, and a snapshot can
+# be taken while writes go on: it only has to start after the segment
+# switch. compact() bounds the tail (and so the restart time): switch
+# segment, snapshot, delete what the snapshot covers.
+
+import json, os, threading, zlib
+from struct import Struct
+from metrics import METRICS, perf_counter
+
+try:
+    import orjson   # optional; decodes a long journal several times faster
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:   # no advisory locks (Windows): one process is on trust
+    fcntl = None
+
+FRAME          = Struct('<II')   # payload length, crc32
+SNAPSHOT_BATCH = 10000           # records per snapshot frame
+
+_dumps = orjson.dumps if orjson else (lambda obj: json.dumps(obj, separators=(',', ':')).encode())
+_loads = orjson.loads if orjson else json.loads
+
+
+class JournalError(Exception):
+    pass
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _frame(records):
+    data = _dumps(records)
+    return FRAME.pack(len(data), zlib.crc32(data)) + data
+
+
+def _frames(path):
+    # (records, end offset) per intact frame; stops at the first torn one
+    with open(path, 'rb') as f:
+        pos = 0
+        while True:
+            head = f.read(FRAME.size)
+            if len(head) < FRAME.size:
+                return
+            size, crc = FRAME.unpack(head)
+            data = f.read(size)
+            if len(data) < size or zlib.crc32(data) != crc:
+                return
+            pos += FRAME.size + size
+            yield _loads(data), pos
+
+
+def _numbered(directory, prefix, suffix):
+    out = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            number = name[len(prefix):-len(suffix)]
+            if number.isdigit():
+                out.append(int(number))
+    return sorted(out)
+
+
+class Journal:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.dir      = directory
+        self.lockfile = open(os.path.join(directory, 'lock'), 'a')
+        if fcntl:
+            try:
+                fcntl.flock(self.lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise JournalError(f'{directory} is open in another process') from None
+        self.segment  = 0      # number of the segment being written
+        self.file     = None
+        self.pending  = []     # records not yet written; an int starts that segment
+        self.seq      = 0      # records appended
+        self.durable  = 0      # records written and fsynced
+        self.tail     = 0      # records since the newest snapshot
+        self.highs    = {}     # { kind: highest id ever logged }, ids are never reused
+        self.failed   = None   # the writer's exception, once it has died
+        self.cond     = threading.Condition()
+        self.local    = threading.local()
+        self.recovered = {'snapshot': None, 'records': 0, 'seconds': 0.0}
+
+    def path(self, kind, number):
+        return os.path.join(self.dir, f'journal-{number}.log' if kind == 'log'
+                            else f'snapshot-{number}.snap')
+
+    # ── recovery ──
+
+    def recover(self):
+        # { kind: { id: record } } for every live record, plus self.highs
+        start  = perf_counter()
+        tables = {kind: {} for kind in 'BCLHMU'}
+        highs  = self.highs
+        count  = 0
+
+        def apply(records):
+            for rec in records:
+                kind = rec[0]
+                if kind == '#':
+                    highs.update(rec[1])
+                    continue
+                if kind[0] == '-':
+                    kind = kind[1]
+                    tables[kind].pop(rec[1], None)
+                else:
+                    tables[kind][rec[1]] = rec
+                if kind != 'U' and rec[1] > highs.get(kind, 0):
+                    highs[kind] = rec[1]
+
+        for name in os.listdir(self.dir):   # a snapshot the last run didn't finish
+            if name.endswith('.snap.tmp'):
+                os.remove(os.path.join(self.dir, name))
+        snaps = _numbered(self.dir, 'snapshot-', '.snap')
+        first = 0
+        if snaps:
+            first = snaps[-1]
+            for records, _ in _frames(self.path('snap', first)):
+                apply(records)
+                count += len(records)
+            self.recovered['snapshot'] = first
+        logs = [n for n in _numbered(self.dir, 'journal-', '.log') if n >= first]
+        for i, number in enumerate(logs):
+            path, good = self.path('log', number), 0
+            for records, good in _frames(path):
+                apply(records)
+                self.tail += len(records)
+            if good < os.path.getsize(path):
+                if i < len(logs) - 1:
+                    raise JournalError(f'{path} is corrupt at byte {good}')
+                with open(path, 'r+b') as f:   # the crash's torn write
+                    f.truncate(good)
+        self.segment = (logs[-1] if logs else first) + 1
+        self.recovered.update(records=count + self.tail, seconds=perf_counter() - start)
+        METRICS.observe('journal_recovery_seconds', self.recovered['seconds'])
+        return tables
+
+    # ── writing ──
+
+    def start(self):
+        self.file = open(self.path('log', self.segment), 'ab')
+        _fsync_dir(self.dir)
+        threading.Thread(target=self._run, name='journal', daemon=True).start()
+
+    def append(self, *records):
+        # queue records; cheap enough to call under the store's locks
+        with self.cond:
+            if self.failed:
+                raise JournalError('journal writer failed') from self.failed
+            for rec in records:
+                kind = rec[0][-1]
+                if kind != 'U' and rec[1] > self.highs.get(kind, 0):
+                    self.highs[kind] = rec[1]
+            self.pending.extend(records)
+            self.seq  += len(records)
+            self.tail += len(records)
+            self.local.seq = self.seq
+            self.cond.notify_all()
+
+    def wait(self, seq=None):
+        # until this thread's appends (or everything up to seq) are on disk
+        seq = seq if seq is not None else getattr(self.local, 'seq', 0)
+        if self.durable >= seq:
+            return
+        with self.cond:
+            while self.durable < seq and not self.failed:
+                self.cond.wait()
+            if self.durable < seq:
+                raise JournalError('journal writer failed') from self.failed
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                batch, self.pending = self.pending, []
+                upto = self.seq
+            try:
+                start, records = perf_counter(), []
+                for rec in batch:
+                    if type(rec) is int:   # rotate(): the next segment starts here
+                        self._write(records)
+                        records = []
+                        self._next_segment(rec)
+                    else:
+                        records.append(rec)
+                self._write(records)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                METRICS.observe('journal_commit_seconds', perf_counter() - start)
+            except Exception as e:   # disk full, I/O error: refuse further writes
+                with self.cond:
+                    self.failed = e
+                    self.cond.notify_all()
+                raise
+            with self.cond:
+                self.durable = upto
+                self.cond.notify_all()
+
+    def _write(self, records):
+        if records:
+            self.file.write(_frame(records))
+            METRICS.count('journal_records_total', len(records))
+
+    def _next_segment(self, number):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = open(self.path('log', number), 'ab')
+        _fsync_dir(self.dir)
+
+    # ── compaction ──
+
+    def rotate(self):
+        # later appends go to a new segment; (its number, seq of the switch)
+        with self.cond:
+            self.segment += 1
+            self.pending.append(self.segment)
+            self.tail = 0
+            self.cond.notify_all()
+            return self.segment, self.seq
+
+    def snapshot(self, number, seq, records):
+        # records: every live record, read after rotate() returned `number`
+        start = perf_counter()
+        path  = self.path('snap', number)
+        tmp   = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            with self.cond:
+                highs = dict(self.highs)
+            batch = [['#', highs]]
+            for rec in records:
+                batch.append(rec)
+                if len(batch) >= SNAPSHOT_BATCH:
+                    f.write(_frame(batch))
+                    batch = []
+            f.write(_frame(batch))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        _fsync_dir(self.dir)
+        self.wait(seq)   # the writer has moved on to segment `number`
+        for n in _numbered(self.dir, 'snapshot-', '.snap'):
+            if n < number:
+                os.remove(self.path('snap', n))
+        for n in _numbered(self.dir, 'journal-', '.log'):
+            if n < number:
+                os.remove(self.path('log', n))
+        METRICS.observe('journal_snapshot_seconds', perf_counter() - start)
@@ -0,0 +1,211 @@
+# ── LIVE UPDATES ──────────────────────────────────────────────────────────────
+# In-process publish / subscribe behind the /events Server-Sent Events stream.
+#
+#   BROKER.publish(book_id, 'book', data)        # data: the encoded payload
+#   sub, missed = BROKER.subscribe({1, 2, 3}, last_event_id)
+#   events = sub.get(timeout)                    # or: await sub.wait(timeout)
+#
+# Subscribers name the keys (book ids) they care about, so a publish only
+# touches the streams showing that book. Each subscriber has a bounded queue
+# and publish() never blocks: one that falls QUEUE_MAX events behind is
+# marked lagged and told to reset (reload) instead of being waited for.
+#
+# Events get increasing ids and the last BACKLOG are kept, so a browser
+# reconnecting with Last-Event-ID is sent what it missed, or a reset if
+# that's no longer known. Ids carry a per-broker epoch, so an id from another
+# worker or from before a restart is never mistaken for one of ours.
+#
+# Per worker process: with several workers, a stream hears about changes
+# made through the same worker.
+#
+# Streams served on an event loop (see asgi.py) subscribe with their loop and
+# get an AsyncSubscriber, which waits with an await instead of a thread.
+# Notifier is the same idea without events: a bare "something changed" that
+# threads and event-loop tasks can both wait for.
+
+import asyncio, itertools, secrets, threading
+from collections import deque
+
+QUEUE_MAX = 256
+BACKLOG   = 1024
+
+
+class Subscriber:
+    __slots__ = ('keys', 'events', 'cond', 'lagged', 'closed')
+
+    def __init__(self, keys):
+        self.keys   = keys    # set of keys, or None for everything
+        self.events = deque()
+        self.cond   = threading.Condition(threading.Lock())
+        self.lagged = False
+        self.closed = False
+
+    def put(self, event):
+        with self.cond:
+            if len(self.events) >= QUEUE_MAX:
+                self.lagged = True
+            else:
+                self.events.append(event)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def get(self, timeout):
+        # pending events, [] after `timeout` seconds with none, None once
+        # lagged or closed
+        with self.cond:
+            if not self.events and not (self.lagged or self.closed):
+                self.cond.wait(timeout)
+            if self.lagged or self.closed:
+                return None
+            out = list(self.events)
+            self.events.clear()
+            return out
+
+
+class AsyncSubscriber(Subscriber):
+    # publishers are threads, so they wake the waiting task through its loop
+    __slots__ = ('loop', 'ready')
+
+    def __init__(self, keys, loop):
+        super().__init__(keys)
+        self.loop  = loop
+        self.ready = asyncio.Event()
+
+    def _wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:   # loop already closed
+            pass
+
+    def put(self, event):
+        super().put(event)
+        self._wake()
+
+    def close(self):
+        super().close()
+        self._wake()
+
+    async def wait(self, timeout):
+        # as get(), without blocking the loop
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.ready.clear()
+        return self.get(0)
+
+
+class Broker:
+    def __init__(self, max_subscribers=500):
+        self.max_subscribers = max_subscribers
+        self.by_key   = {}      # { key: {subscriber, ...} }
+        self.wildcard = set()   # subscribers to every key
+        self.count    = 0
+        self.epoch    = secrets.token_hex(4)
+        self.ids      = itertools.count(1)
+        self.last_id  = 0
+        self.backlog  = deque(maxlen=BACKLOG)   # (id, key, name, data)
+        self.closed   = False
+        self.lock     = threading.Lock()
+
+    def event_id(self, n):
+        return f'{self.epoch}-{n}'
+
+    def _parse_id(self, text):
+        # Last-Event-ID -> our event number; -1 if it isn't one of ours
+        epoch, _, n = (text or '').partition('-')
+        return int(n) if epoch == self.epoch and n.isdigit() else -1
+
+    def subscribe(self, keys=None, last_event_id=None, loop=None):
+        # (subscriber, events missed since last_event_id, or None if they
+        # can't be replayed); (None, None) when full or closed. With a loop,
+        # an AsyncSubscriber for a task on that loop.
+        sub = Subscriber(keys) if loop is None else AsyncSubscriber(keys, loop)
+        last_id = None if last_event_id is None else self._parse_id(last_event_id)
+        with self.lock:
+            if self.count >= self.max_subscribers or self.closed:
+                return None, None
+            self.count += 1
+            if keys is None:
+                self.wildcard.add(sub)
+            else:
+                for key in keys:
+                    self.by_key.setdefault(key, set()).add(sub)
+            if last_id is None or last_id == self.last_id:
+                missed = []
+            elif 0 <= last_id < self.last_id and self.backlog[0][0] <= last_id + 1:
+                missed = [e for e in self.backlog
+                          if e[0] > last_id and (keys is None or e[1] in keys)]
+            else:   # older than the backlog, or from before a restart
+                missed = None
+        return sub, missed
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.count -= 1
+            if sub.keys is None:
+                self.wildcard.discard(sub)
+                return
+            for key in sub.keys:
+                subs = self.by_key.get(key)
+                if subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self.by_key[key]
+
+    def publish(self, key, name, data):
+        with self.lock:
+            event = (next(self.ids), key, name, data)
+            self.last_id = event[0]
+            self.backlog.append(event)
+            subs = list(self.by_key.get(key, ())) + list(self.wildcard)
+        for sub in subs:
+            sub.put(event)
+        return event[0]
+
+    def close(self):
+        # shutting down: end every stream and refuse new ones
+        with self.lock:
+            self.closed = True
+            subs = set(self.wildcard).union(*self.by_key.values())
+        for sub in subs:
+            sub.close()
+
+    def listeners(self):
+        return self.count
+
+
+class Notifier:
+    def __init__(self):
+        self.cond    = threading.Condition()
+        self.waiters = set()   # (loop, asyncio.Event) of waiting tasks
+
+    def notify(self):
+        with self.cond:
+            self.cond.notify_all()
+            waiters = list(self.waiters)
+        for loop, ready in waiters:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass
+
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait(timeout)
+
+    async def wait_async(self, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.cond:
+            self.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.cond:
+                self.waiters.discard(waiter)
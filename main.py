@@ -1,6 +1,20 @@
-import csv, os
-from flask import Flask, request, redirect, session
-from datetime import datetime
+import asyncio, csv, io, json, os, secrets, tempfile, threading, time, zlib
+import click
+from urllib.parse import urlencode
+from flask import Flask, request, redirect, session, jsonify
+from markupsafe import Markup, escape
+from datetime import datetime, timedelta
+from search import SearchIndex, Suggester
+from facets import FacetIndex, FACETS, bits_from_ids, select_bits
+from cache import LRUCache
+from storage import open_store, AsyncStore, OK, NOT_FOUND, UNAVAILABLE, ALREADY, ON_SHELF, READY, FORMATS
+from importer import ImportJob, clean_isbn, run_import, start_import
+from snapshot import open_snapshot
+from metrics import METRICS, MetricsMiddleware, Sampler, TimedLock, perf_counter, timed
+from live import Broker, Notifier
+from passwords import Busy, Throttle, check_password, hash_password, needs_rehash
+from scheduler import Scheduler
+from stats import LoanStats
 
 # ── PROXY PREFIX ──────────────────────────────────────────────────────────────
 PREFIX = '/proxy/5050'
@@ -19,51 +33,214 @@ class PrefixMiddleware:
             environ['SCRIPT_NAME'] = self.prefix
         return self.app(environ, start_response)
 
-app.wsgi_app = PrefixMiddleware(app.wsgi_app, PREFIX)
+SAMPLER = Sampler()   # opt-in profiler, see /metrics/profile
+
+app.wsgi_app = MetricsMiddleware(PrefixMiddleware(app.wsgi_app, PREFIX), SAMPLER)
+
+@app.before_request
+def tag_route():
+    # route template (not the raw path) labels the request metrics
+    request.environ['library.route'] = request.url_rule.rule if request.url_rule else 'unmatched'
+
+# background sweeps (holds, overdue loans, outbox); started by the first
+# request, so importing main for the CLI or a script starts no thread
+SCHEDULER = Scheduler()
+
+@app.before_request
+def start_scheduler():
+    if not SCHEDULER.running:
+        SCHEDULER.start()
 
 # ── LOAD BOOKS FROM CSV ───────────────────────────────────────────────────────
 # Reads library_booklist.csv from the same folder as this script.
-# Deduplicates by (title, author) — keeps first occurrence location.
+# Each row is one physical copy; rows are grouped into titles by (title, author).
+# Only used to seed an empty store, and normally through the binary snapshot
+# (see snapshot.py) so the CSV is parsed once, not on every start.
 
-def _load_books():
-    here    = os.path.dirname(os.path.abspath(__file__))
-    csvpath = os.path.join(here, 'library_booklist.csv')
-    seen    = {}
-    bid     = 1
-    with open(csvpath, newline='', encoding='utf-8') as f:
+CSV_PATH = (os.environ.get('LIBRARY_CSV') or
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library_booklist.csv'))
+
+def _parse_csv():
+    seen = {}
+    bid  = 1
+    with open(CSV_PATH, newline='', encoding='utf-8') as f:
         for row in csv.DictReader(f):
             title  = row['title'].strip()
             author = row['author'].strip()
             key    = (title, author)
             if key not in seen:
-                isbn = row['isbn_13'].strip().rstrip('.0') if row['isbn_13'].strip() else ''
-                loc  = row['location_code'].strip()
+                isbn = clean_isbn(row['isbn_13'])
                 seen[key] = {
                     'id': bid, 'title': title, 'author': author,
-                    'isbn': isbn, 'location': loc, 'available': True,
+                    'isbn': isbn, 'copies': [],
                 }
                 bid += 1
-    return list(seen.values()), bid   # books list, next_id
+            seen[key]['copies'].append({'format':   row['format_code'].strip() or 'PB',
+                                        'location': row['location_code'].strip()})
+    return list(seen.values())
 
-BOOKS, _next_book_id = _load_books()
-
-# ── IN-MEMORY STATE ───────────────────────────────────────────────────────────
-USERS         = {}   # { email: {name, password, address, is_staff} }
-LOANS         = []   # [{id, book_id, book_title, user_email, user_name, borrowed_at, returned_at}]
-NEXT_BOOK_ID  = [_next_book_id]
-NEXT_LOAN_ID  = [1]
+def _load_books():
+    snap = open_snapshot(CSV_PATH, _parse_csv)
+    return snap.books() if snap else _parse_csv()
+
+# ── STORAGE ───────────────────────────────────────────────────────────────────
+# All books / loans / users live behind STORE (see storage.py).
+# Set LIBRARY_DB to a file path to share one SQLite catalogue between workers.
+# Without it, LIBRARY_JOURNAL=dir keeps the in-memory store across restarts
+# (see journal.py); compact_journal() snapshots it once the journal since
+# the last snapshot passes JOURNAL_TAIL records, which bounds restart time.
+
+JOURNAL_CHECK = 60
+JOURNAL_TAIL  = 200_000
+
+STORE = open_store(seed=_load_books)   # CSV is only read into an empty store
+
+if getattr(STORE, 'journal', None):
+    @SCHEDULER.every(JOURNAL_CHECK)
+    def compact_journal():
+        if STORE.journal.tail > JOURNAL_TAIL:
+            STORE.compact()
+
+# ── INDEXES ───────────────────────────────────────────────────────────────────
+# Search structures derived from the catalogue. Local edits patch them; if
+# another worker changed the catalogue they are rebuilt on next use.
+#
+# INDEX is a generation: once published it is never changed, so requests
+# search whichever one they picked up without a lock, while an import
+# indexes batch by batch. An edit patches copies of the parts it touches
+# (see the copy() methods) and swaps the new generation in; a rebuild is
+# made off to the side and swapped in the same way. INDEX_LOCK orders the
+# writers only. While one thread rebuilds, the others keep serving the
+# generation before it.
+
+INDEX      = {'version': None, 'search': None, 'suggest': None, 'facets': None}
+INDEX_LOCK = TimedLock('index')
+REBUILDING = threading.Lock()
+
+def catalogue_index():
+    global INDEX
+    idx, version = INDEX, STORE.catalogue_version()
+    if idx['version'] == version:
+        return idx
+    if idx['version'] is None:
+        REBUILDING.acquire()   # nothing to serve yet: wait for the first build
+    elif not REBUILDING.acquire(blocking=False):
+        return idx
+    try:
+        if INDEX['version'] is not None and INDEX['version'] >= version:
+            return INDEX
+        with METRICS.timer('index_build_seconds'):
+            books = STORE.list_books()
+            fresh = {'version': version,
+                     'search':  SearchIndex.build(books),   # title / author / isbn full text
+                     'suggest': Suggester.build(books),     # search box completions
+                     'facets':  FacetIndex.build([b['id'] for b in books], STORE.all_copies())}
+        with INDEX_LOCK:
+            if INDEX['version'] is None or INDEX['version'] < version:
+                INDEX = fresh
+            return INDEX
+    finally:
+        REBUILDING.release()
+
+def _patch(version, parts, change):
+    # change(idx) edits copies of `parts` of the current generation, published
+    # as `version`; skipped unless it's the very next one (a rebuild follows)
+    global INDEX
+    with INDEX_LOCK:
+        if INDEX['version'] != version - 1:
+            return
+        idx = dict(INDEX, version=version)
+        for part in parts:
+            idx[part] = idx[part].copy()
+        change(idx)
+        INDEX = idx
+
+def index_book(book, version):
+    def change(idx):
+        idx['search'].add(book)
+        idx['suggest'].add(book)
+        idx['facets'].update(book['id'], STORE.list_copies(book['id']))
+    _patch(version, ('search', 'suggest', 'facets'), change)
+
+def unindex_book(book, version):
+    def change(idx):
+        idx['search'].remove(book['id'])
+        idx['suggest'].remove(book)
+        idx['facets'].remove(book['id'])
+    _patch(version, ('search', 'suggest', 'facets'), change)
+
+def recopy_book(book_id, version):
+    _patch(version, ('facets',),
+           lambda idx: idx['facets'].update(book_id, STORE.list_copies(book_id)))
+
+def index_batch(added, merged, version):
+    # one bulk import batch: new books, plus ids of books that gained copies
+    def change(idx):
+        for book in added:
+            idx['search'].add(book)
+            idx['suggest'].add(book)
+        for bid in [b['id'] for b in added] + merged:
+            idx['facets'].update(bid, STORE.list_copies(bid))
+    _patch(version, ('search', 'suggest', 'facets'), change)
+    if merged:   # copies added to a title go to its waiting holds first
+        holds_changed()
+
+def reindex_book(old, book, version):
+    def change(idx):
+        idx['search'].update(book)
+        idx['suggest'].remove(old)
+        idx['suggest'].add(book)
+    _patch(version, ('search', 'suggest'), change)
+
+@timed('search_seconds')
+def catalogue_filter(q, avail_only, chosen):
+    # every filter is a bitmap over book ids; see facets.py
+    # returns (index, pool before facets, final bitmap, search scores or None)
+    idx  = catalogue_index()
+    hits = None
+    if q:
+        hits = idx['search'].match(q)
+        pool = bits_from_ids(hits)
+    else:
+        pool = idx['facets'].all
+    if avail_only:
+        pool &= STORE.available_bits()
+    return idx, pool, idx['facets'].filter(pool, chosen), hits
 
 # ── STATE HELPERS ─────────────────────────────────────────────────────────────
 
 def find_book(book_id):
-    return next((b for b in BOOKS if b['id'] == book_id), None)
-
-def active_loan(book_id):
-    return next((l for l in LOANS
-                 if l['book_id'] == book_id and l['returned_at'] is None), None)
+    return STORE.get_book(book_id)
+
+COPIES_MAX   = 50   # copies one form may add
+COPIES_ERROR = f'Copies must be a whole number from 1 to {COPIES_MAX}.'
+
+def parse_copies(form):
+    # "add copies" fields shared by the add and edit forms; None (answered
+    # with COPIES_ERROR) unless the count is from 1 to COPIES_MAX
+    fmt = form.get('format', 'PB')
+    loc = form.get('location', '').strip()
+    try:
+        n = int(form.get('copies', '').strip())
+    except ValueError:
+        return None
+    if not 1 <= n <= COPIES_MAX:
+        return None
+    return [{'format': fmt if fmt in FORMATS else 'PB', 'location': loc}] * n
+
+def format_options(selected='PB'):
+    return ''.join(f'<option value="{code}"{" selected" if code == selected else ""}>'
+                   f'{name}</option>' for code, name in FORMATS.items())
 
 def now():
-    return datetime.now().strftime('%Y-%m-%d %H:%M')
+    return int(time.time())
+
+def fmt_time(ts):
+    # stores keep Unix seconds; pages show local time
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M') if ts else ''
+
+def fmt_day(ts, fmt='%Y-%m-%d'):
+    return datetime.fromtimestamp(ts).strftime(fmt)
 
 # ── HTML HELPERS ──────────────────────────────────────────────────────────────
 
@@ -71,111 +248,115 @@ def p(path=''):
     return PREFIX + path
 
 def pop_flash():
+    # (ok, message) or None; messages are HTML, anything user-supplied in
+    # them already escaped by whoever set it
     msg = session.pop('_flash', None)
     if not msg:
-        return ''
-    kind, text = msg[0], msg[2:]
-    bg     = '#d4edda' if kind == 's' else '#f8d7da'
-    color  = '#155724' if kind == 's' else '#721c24'
-    border = '#c3e6cb' if kind == 's' else '#f5c6cb'
-    return (f'<div style="padding:10px 16px;border-radius:6px;margin-bottom:14px;'
-            f'background:{bg};color:{color};border:1px solid {border};">{text}</div>')
+        return None
+    return msg[0] == 's', Markup(msg[2:])
 
 def set_flash(kind, msg):
     session['_flash'] = kind[0] + ':' + msg
 
+# Pages are Jinja templates (templates/), compiled once at startup and
+# autoescaped: a value goes out escaped unless it is Markup. head.html (nav
+# and flash) and foot.html wrap every page. base() wraps HTML built here in
+# Python; stream_page() sends the head at once, then renders the page's
+# template from its data as it is fetched, STREAM_CHUNK at a time.
+
+STREAM_CHUNK = 16384   # characters of page per write after the head
+
+def template(name):
+    return app.jinja_env.get_template(name)
+
+def page_head(title):
+    # everything the head needs from the session, read before any of the
+    # page goes out (the session cookie is in the headers)
+    return template('head.html').render(
+        title=title, uid=session.get('user_email'), uname=session.get('user_name', ''),
+        staff=session.get('is_staff', False), flash=pop_flash())
+
+@timed('render_seconds', part='page')
 def base(content, title='Library'):
-    uid   = session.get('user_email')
-    uname = session.get('user_name', '')
-    staff = session.get('is_staff', False)
-
-    if uid:
-        staff_links = ''
-        if staff:
-            staff_links = (
-                f'<a href="{p("/books/add")}" style="background:#97c93d;color:#1a3a1c;'
-                f'padding:6px 14px;border-radius:4px;font-weight:600;text-decoration:none;'
-                f'margin-left:1rem;">+ Add Book</a>'
-                f'<a href="{p("/all-loans")}" style="color:white;text-decoration:none;'
-                f'margin-left:1.5rem;opacity:.9;">All Loans</a>'
-            )
-        auth = (
-            f'<a href="{p("/my-loans")}" style="color:white;text-decoration:none;'
-            f'margin-left:1.5rem;opacity:.9;">My Loans</a>'
-            f'{staff_links}'
-            f'<a href="{p("/logout")}" style="color:white;text-decoration:none;'
-            f'margin-left:1.5rem;opacity:.9;">Logout ({uname})</a>'
-        )
-    else:
-        auth = (
-            f'<a href="{p("/login")}" style="color:white;text-decoration:none;'
-            f'margin-left:1.5rem;opacity:.9;">Login</a>'
-            f'<a href="{p("/signup")}" style="background:#97c93d;color:#1a3a1c;'
-            f'padding:6px 14px;border-radius:4px;font-weight:600;text-decoration:none;'
-            f'margin-left:1rem;">Sign Up</a>'
-        )
-
-    role_badge = ''
+    # content: HTML, with anything user-supplied in it escaped
+    return page_head(title) + content + template('foot.html').render()
+
+def stream_page(name, title, build, cache=None):
+    # build() -> the template's context. It runs once the head is out, so
+    # it fetches the page's data but must not touch request or session:
+    # views read those first and hand build() plain values. cache: (LRUCache,
+    # key, stamp) to keep the finished page in.
+    head = page_head(title)
+
+    def chunks():
+        yield head
+        busy, t = 0.0, perf_counter()
+        parts, buf, size = [], [], 0
+        for piece in template(name).generate(build()):
+            buf.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK:
+                chunk, buf, size = ''.join(buf), [], 0
+                if cache:
+                    parts.append(chunk)
+                busy += perf_counter() - t
+                yield chunk
+                t = perf_counter()
+        buf.append(template('foot.html').render())
+        chunk = ''.join(buf)
+        METRICS.observe('render_seconds', busy + perf_counter() - t, part='page')
+        if cache:
+            store, key, stamp = cache
+            store.put(key, stamp, head + ''.join(parts) + chunk)
+        yield chunk
+
+    return app.response_class(chunks(), mimetype='text/html')
+
+app.jinja_env.globals.update(p=p, fmt_time=fmt_time, fmt_day=fmt_day,
+                             FORMATS=FORMATS, READY=READY)
+for _name in app.jinja_env.list_templates():   # compile them all now, not per first request
+    template(_name)
+
+
+# ── CATALOGUE CARDS ───────────────────────────────────────────────────────────
+# Rendered cards are cached per book and viewer role; the stamp is every book
+# field a card shows, so a card re-renders as soon as any of them changes.
+# Anonymous catalogue pages are cached whole, stamped with STORE.change_stamp().
+
+CARDS      = LRUCache('cards', 4096)   # { (book_id, role): card Markup }
+PAGES      = LRUCache('pages', 256)    # { query string: anonymous page html }
+CARD_ROLES = ('anon', 'member', 'borrower', 'holder', 'ready',
+              'staff', 'staff-borrower', 'staff-holder', 'staff-ready')
+
+def card_role(uid, staff, holding, hold=None):
+    # hold: the viewer's active hold on the book, if any
+    if not uid:
+        return 'anon'
+    role = 'member'
+    if holding:
+        role = 'borrower'
+    elif hold:
+        role = 'ready' if hold['status'] == READY else 'holder'
     if staff:
-        role_badge = ('<span style="background:#97c93d;color:#1a3a1c;padding:2px 8px;'
-                      'border-radius:10px;font-size:.75rem;font-weight:700;'
-                      'margin-left:.5rem;">STAFF</span>')
-
-    return f'''<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>{title}</title>
-<style>
-*{{box-sizing:border-box;margin:0;padding:0}}
-body{{font-family:"Segoe UI",sans-serif;background:#f5f5f0;color:#333;font-size:16px}}
-nav{{background:#2c5f2e;color:white;padding:0 2rem;display:flex;align-items:center;
-     justify-content:space-between;min-height:60px;flex-wrap:wrap;gap:.5rem;
-     box-shadow:0 2px 6px rgba(0,0,0,.3)}}
-.brand{{font-size:1.3rem;font-weight:700;display:flex;align-items:center;gap:.4rem;padding:.5rem 0}}
-.brand span{{color:#97c93d}}
-.nav-right{{display:flex;align-items:center;flex-wrap:wrap;gap:.3rem;padding:.5rem 0}}
-.container{{max-width:1200px;margin:2rem auto;padding:0 1.5rem}}
-.card{{background:white;border-radius:8px;box-shadow:0 2px 8px rgba(0,0,0,.08);padding:2rem}}
-.fg{{margin-bottom:1.2rem}}
-.fg label{{display:block;font-weight:600;margin-bottom:5px;font-size:.95rem}}
-.fg input[type=text],.fg input[type=email],.fg input[type=password]{{
-  width:100%;padding:11px 13px;border:1px solid #ddd;border-radius:5px;font-size:1rem}}
-.fg input:focus{{outline:none;border-color:#2c5f2e}}
-.checkbox-row{{display:flex;align-items:center;gap:10px;padding:12px 14px;
-               background:#f8f8f2;border:1px solid #ddd;border-radius:5px;margin-bottom:1.2rem}}
-.checkbox-row input{{width:20px;height:20px;cursor:pointer;accent-color:#2c5f2e;flex-shrink:0}}
-.checkbox-row label{{margin:0;font-size:.95rem;cursor:pointer}}
-.btn{{padding:10px 22px;border:none;border-radius:5px;cursor:pointer;font-size:.95rem;
-      font-weight:600;transition:opacity .2s;text-decoration:none;display:inline-block}}
-.btn:hover{{opacity:.85}}
-.btn-g{{background:#2c5f2e;color:white}}
-.btn-b{{background:#2980b9;color:white}}
-.btn-y{{background:#f0a500;color:white}}
-.btn-r{{background:#c0392b;color:white}}
-.btn-sm{{padding:6px 13px;font-size:.85rem}}
-h1{{font-size:1.7rem;margin-bottom:1.5rem;color:#2c5f2e}}
-a{{color:#2c5f2e}}
-table{{width:100%;border-collapse:collapse}}
-th,td{{padding:11px 14px;text-align:left;border-bottom:1px solid #eee;font-size:.92rem}}
-th{{background:#f8f8f5;font-weight:600;color:#555}}
-tr:hover td{{background:#fafaf7}}
-footer{{text-align:center;padding:1.5rem;margin-top:3rem;color:#888;
-        font-size:.85rem;border-top:1px solid #ddd}}
-</style>
-</head>
-<body>
-<nav>
-  <div class="brand">&#128218; <span>Library</span>{role_badge}</div>
-  <div class="nav-right">{auth}</div>
-</nav>
-<div class="container">
-  <div style="margin-top:1rem">{pop_flash()}</div>
-  {content}
-</div>
-<footer>Library System &copy; 2025 | COMP2850 Mini-Project</footer>
-</body></html>'''
+        return 'staff' if role == 'member' else 'staff-' + role
+    return role
+
+def render_card(b, role):
+    stamp = (b['title'], b['author'], b['location'], b['available'], b['total'])
+    html  = CARDS.get((b['id'], role), stamp)
+    if html is None:
+        html = _card_html(b, role)
+        CARDS.put((b['id'], role), stamp, html)
+    return html
+
+def invalidate_book(book_id):
+    for role in CARD_ROLES:
+        CARDS.drop((book_id, role))
+    PAGES.clear()
+
+@timed('render_seconds', part='card')
+def _card_html(b, role):
+    return Markup(template('card.html').render(b=b, role=role))
 
 
 # ── HOME / CATALOGUE ──────────────────────────────────────────────────────────
@@ -187,110 +368,393 @@ def index():
     uid        = session.get('user_email')
     staff      = session.get('is_staff', False)
 
-    books = BOOKS
-    if q:
-        ql    = q.lower()
-        books = [b for b in books if ql in b['title'].lower() or ql in b['author'].lower()]
-    if avail_only:
-        books = [b for b in books if b['available']]
-
-    # pagination — 24 per page
-    page     = max(1, int(request.args.get('page', 1)))
-    per_page = 24
-    total    = len(books)
-    pages    = max(1, (total + per_page - 1) // per_page)
-    page     = min(page, pages)
-    visible  = books[(page-1)*per_page : page*per_page]
-
-    cards = ''
-    for b in visible:
-        bid  = b['id']
-        loan = active_loan(bid)
-        if b['available']:
-            badge = ('<span style="background:#d4edda;color:#155724;padding:3px 10px;'
-                     'border-radius:20px;font-size:.78rem;font-weight:600;">&#10003; Available</span>')
+    # anonymous pages with no pending flash message are the same for everyone
+    cacheable = not uid and '_flash' not in session
+    if cacheable:
+        page_key   = request.query_string
+        page_stamp = STORE.change_stamp()
+        html       = PAGES.get(page_key, page_stamp)
+        if html is not None:
+            return html
+
+    chosen = {f: [v for v in request.args.getlist(f) if v] for f in FACETS}
+    page   = max(1, request.args.get('page', 1, type=int))   # junk falls back to 1
+    args   = [(k, v) for k, v in request.args.items(multi=True) if k != 'page' and v]
+
+    def build():
+        def menu(facet, label, names=None):
+            picked  = chosen[facet][0] if chosen[facet] else ''
+            options = [(value, (names or {}).get(value, value), counts[facet].get(value, 0),
+                        value == picked)
+                       for value in facets.values(facet)]
+            return facet, label, [o for o in options if o[2] or o[3]]
+
+        idx, pool, bits, hits = catalogue_filter(q, avail_only, chosen)
+        facets = idx['facets']
+        counts = facets.counts(pool, chosen)
+        total  = bits.bit_count()
+
+        # pagination — 24 per page
+        per_page = 24
+        pages    = max(1, (total + per_page - 1) // per_page)
+        current  = min(page, pages)
+        if q:
+            if bits != pool:
+                hits = {bid: s for bid, s in hits.items() if bits >> bid & 1}
+            # only rank as far as the requested page
+            ids = idx['search'].rank(hits, current*per_page)[(current-1)*per_page:]
         else:
-            who   = f' &mdash; {loan["user_name"]}' if loan else ''
-            badge = (f'<span style="background:#f8d7da;color:#721c24;padding:3px 10px;'
-                     f'border-radius:20px;font-size:.78rem;font-weight:600;">'
-                     f'&#10007; On Loan{who}</span>')
-
-        actions = ''
-        if uid:
-            if b['available']:
-                actions += (f'<form action="{p(f"/books/borrow/{bid}")}" method="post" style="display:inline">'
-                            f'<button class="btn btn-g btn-sm">Borrow</button></form> ')
-            elif loan and loan['user_email'] == uid:
-                actions += (f'<form action="{p(f"/books/return/{bid}")}" method="post" style="display:inline">'
-                            f'<button class="btn btn-b btn-sm">Return</button></form> ')
-            if staff:
-                actions += (f'<a href="{p(f"/books/edit/{bid}")}" class="btn btn-y btn-sm">Edit</a> '
-                            f'<form action="{p(f"/books/delete/{bid}")}" method="post" style="display:inline"'
-                            f' onsubmit="return confirm(\'Delete this book?\')">'
-                            f'<button class="btn btn-r btn-sm">Delete</button></form>')
-        else:
-            actions = f'<a href="{p("/login")}" class="btn btn-g btn-sm">Login to Borrow</a>'
-
-        loc = b['location'] or '&mdash;'
-        cards += f'''<div class="card" style="padding:1.1rem;position:relative;">
-          <div style="position:absolute;top:10px;right:10px;">{badge}</div>
-          <h2 style="font-size:1rem;margin-bottom:3px;padding-right:130px;line-height:1.35">{b["title"]}</h2>
-          <p style="color:#555;font-size:.88rem;margin-bottom:6px;">by {b["author"]}</p>
-          <p style="font-size:.8rem;color:#999;margin-bottom:10px;">&#128205; {loc}</p>
-          <div style="display:flex;gap:7px;flex-wrap:wrap;">{actions}</div>
-        </div>'''
-
-    if not cards:
-        cards = '<div class="card" style="text-align:center;padding:3rem;color:#888"><p>No books found.</p></div>'
-
-    grid = (f'<div style="display:grid;grid-template-columns:repeat(auto-fill,minmax(270px,1fr));'
-            f'gap:1rem;">{cards}</div>')
-
-    # pagination links
-    def pg_url(n):
-        parts = [f'page={n}']
-        if q:          parts.append(f'q={q}')
-        if avail_only: parts.append('avail=1')
-        return p('/?' + '&'.join(parts))
-
-    pagination = ''
-    if pages > 1:
-        prev_btn = (f'<a href="{pg_url(page-1)}" class="btn btn-sm" style="background:#eee;color:#333">'
-                    f'&laquo; Prev</a>' if page > 1 else '')
-        next_btn = (f'<a href="{pg_url(page+1)}" class="btn btn-sm" style="background:#eee;color:#333">'
-                    f'Next &raquo;</a>' if page < pages else '')
-        info = f'<span style="line-height:2.2;font-size:.9rem;color:#666">Page {page} / {pages}</span>'
-        pagination = (f'<div style="display:flex;gap:8px;justify-content:center;'
-                      f'align-items:center;margin-top:1.5rem;">{prev_btn}{info}{next_btn}</div>')
-
-    avail_checked = 'checked' if avail_only else ''
-    clear_btn = (f'<a href="{p("/")}" class="btn btn-sm" style="background:#eee;color:#333">Clear</a>'
-                 if (q or avail_only) else '')
-    top = f'''
-    <div style="display:flex;justify-content:space-between;align-items:flex-start;
-                margin-bottom:1.5rem;flex-wrap:wrap;gap:1rem;">
-      <div>
-        <h1 style="margin-bottom:.3rem">&#128214; Book Catalogue</h1>
-        <p style="color:#666;font-size:.9rem">{total} book{"s" if total!=1 else ""} found
-          &nbsp;&middot;&nbsp; Page {page} of {pages}</p>
-      </div>
-      <form action="{p("/")}" method="get"
-            style="display:flex;gap:8px;flex-wrap:wrap;align-items:center;">
-        <input name="q" placeholder="Search title or author..."
-               value="{q}"
-               style="padding:9px 14px;border:1px solid #ddd;border-radius:5px;
-                      width:230px;font-size:.95rem">
-        <label style="display:flex;align-items:center;gap:6px;font-size:.9rem;cursor:pointer;white-space:nowrap">
-          <input type="checkbox" name="avail" value="1" {avail_checked}
-                 style="accent-color:#2c5f2e;width:16px;height:16px">
-          Available only
-        </label>
-        <button type="submit" class="btn btn-g btn-sm">Search</button>
-        {clear_btn}
+            ids = select_bits(bits, (current-1)*per_page, per_page)
+        menus = [menu('fmt', 'Any format', FORMATS), menu('floor', 'Any floor'),
+                 menu('bay', 'Any bay')]
+        found = STORE.get_books(ids)
+        with METRICS.timer('loan_lookup_seconds'):
+            mine  = STORE.user_open_loans(uid) if uid else {}
+            holds = {h['book_id']: h for h in STORE.user_holds(uid)} if uid else {}
+
+        return {
+            'q': q, 'avail_only': avail_only, 'total': total, 'page': current, 'pages': pages,
+            'filtering': q or avail_only or any(chosen.values()),
+            'menus': menus,
+            # rendered as the template reaches them
+            'cards': (render_card(found[bid], card_role(uid, staff, bid in mine, holds.get(bid)))
+                      for bid in ids if bid in found),
+            # pagination links keep every active filter
+            'page_url': lambda n: p('/?' + urlencode([('page', n)] + args)),
+            'live_script': LIVE_SCRIPT,
+        }
+
+    return stream_page('index.html', 'Library', build,
+                       (PAGES, page_key, page_stamp) if cacheable else None)
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    return jsonify({c.name: c.stats() for c in (CARDS, PAGES)})
+
+
+# ── METRICS ───────────────────────────────────────────────────────────────────
+# /metrics is the Prometheus scrape target (see metrics.py). Staff can turn
+# on the sampling profiler at /metrics/profile and download the stacks of
+# slow requests as folded text for flamegraph.pl or speedscope.
+
+METRICS.describe('http_request_duration_seconds', 'Request latency by route, body included.')
+METRICS.describe('search_seconds', 'Catalogue filtering: text search, availability and facets.')
+METRICS.describe('render_seconds', 'HTML rendering: page shell and uncached cards.')
+METRICS.describe('lock_wait_seconds', 'Time spent waiting for a contended store lock.')
+METRICS.describe('index_build_seconds', 'Full rebuilds of the search and facet indexes.')
+METRICS.describe('password_hash_seconds', 'Password hashing and checks, queueing for the pool included.')
+METRICS.describe('logins_total', 'Login attempts by outcome.')
+METRICS.describe('overdue_total', 'Loans flagged overdue by the sweeper.')
+METRICS.describe('notifications_total', 'Outbox messages sent, by kind.')
+METRICS.describe('sse_listeners', 'Open /events streams in this worker.')
+METRICS.describe('journal_commit_seconds', 'Journal group commits: one write and fsync for every queued record.')
+METRICS.describe('journal_records_total', 'Records written to the journal.')
+METRICS.describe('journal_snapshot_seconds', 'Journal compactions: snapshot written, old segments dropped.')
+METRICS.describe('stats_rebuild_seconds', 'Rebuilds of the /stats aggregates from the loan history.')
+METRICS.describe('journal_recovery_seconds', 'Loading the snapshot and replaying the journal at startup.')
+
+@METRICS.gauge
+def cache_metrics():
+    out = []
+    for c in (CARDS, PAGES):
+        st = c.stats()
+        out += [('cache_hits_total',   {'cache': c.name}, st['hits']),
+                ('cache_misses_total', {'cache': c.name}, st['misses']),
+                ('cache_entries',      {'cache': c.name}, st['size'])]
+    return out
+
+@app.route('/metrics')
+def metrics():
+    return app.response_class(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/profile', methods=['GET', 'POST'])
+def profile():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    if request.method == 'POST':
+        action = request.form.get('action')
+        if action == 'start':
+            try:
+                slow = float(request.form.get('slow_ms', '250')) / 1000
+            except ValueError:
+                slow = None
+            SAMPLER.start(slow=slow)
+            set_flash('success', 'Profiler started.')
+        elif action == 'stop':
+            SAMPLER.stop()
+            set_flash('success', 'Profiler stopped.')
+        elif action == 'clear':
+            SAMPLER.clear()
+        return redirect(p('/metrics/profile'))
+
+    state = 'running' if SAMPLER.running else 'stopped'
+    btn   = ('<button name="action" value="stop" class="btn btn-r btn-sm">Stop</button>'
+             if SAMPLER.running else
+             '<button name="action" value="start" class="btn btn-g btn-sm">Start</button>')
+    content = f'''
+    <div style="max-width:560px;margin:0 auto"><div class="card">
+      <h1>Profiler</h1>
+      <p style="color:#666;margin-bottom:1rem;font-size:.95rem">
+        Samples request stacks every {SAMPLER.interval * 1000:.0f}ms and keeps those of requests
+        slower than the threshold. Sampling slows this worker a little; stop it when done.</p>
+      <p>Status: <strong>{state}</strong> &middot; {SAMPLER.slow_requests} slow requests captured</p>
+      <form method="post" action="{p("/metrics/profile")}" style="display:flex;gap:8px;align-items:center">
+        <label style="margin:0">Slow above
+          <input type="text" name="slow_ms" value="{SAMPLER.slow * 1000:.0f}" inputmode="numeric"
+                 style="width:5rem"> ms</label>
+        {btn}
+        <button name="action" value="clear" class="btn btn-sm" style="background:#eee;color:#333">Clear</button>
       </form>
-    </div>'''
+      <p style="margin-top:1rem"><a href="{p("/metrics/profile.folded")}">Download folded stacks</a></p>
+    </div></div>'''
+    return base(content, 'Profiler')
 
-    return base(top + grid + pagination)
+@app.route('/metrics/profile.folded')
+def profile_folded():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    return app.response_class(SAMPLER.dump(), mimetype='text/plain', headers={
+        'Content-Disposition': 'attachment; filename="profile.folded"'})
+
+
+# ── AUTOCOMPLETE ──────────────────────────────────────────────────────────────
+
+@app.route('/api/suggest')
+def suggest():
+    q = request.args.get('q', '').strip()[:64]
+    n = request.args.get('n', 8, type=int)
+    resp = jsonify(q=q, suggestions=[{'text': text, 'kind': kind}
+                                     for kind, text in catalogue_index()['suggest'].complete(q, n)])
+    resp.cache_control.public  = True
+    resp.cache_control.max_age = 60
+    return resp
+
+
+# ── JSON API ──────────────────────────────────────────────────────────────────
+# /api/v1/books and /api/v1/loans for scripts and the mobile client.
+# Keyset pagination: pass back `next_cursor` as ?cursor= to get the next page;
+# ?fields=id,title trims each item; books take the same q / avail / facet
+# filters as the catalogue page. Books come in id order, loans newest first;
+# loan times are Unix seconds.
+
+try:
+    import orjson   # optional; several times faster than json for big pages
+except ImportError:
+    orjson = None
+
+API_LIMIT       = 500
+BOOK_API_FIELDS = ('id', 'title', 'author', 'isbn', 'location', 'total', 'available')
+LOAN_API_FIELDS = ('id', 'book_id', 'copy_id', 'format', 'book_title', 'user_email',
+                   'user_name', 'borrowed_at', 'returned_at', 'due_at', 'overdue_at')
+API_ARGS_ERROR  = 'cursor must be a non-negative integer, limit an integer, fields a list of known fields'
+
+def json_bytes(obj):
+    return orjson.dumps(obj) if orjson else json.dumps(obj, separators=(',', ':')).encode()
+
+def api_json(obj, status=200):
+    return app.response_class(json_bytes(obj), status=status, mimetype='application/json')
+
+def api_page_args(all_fields):
+    # (cursor, limit, fields) from the query string; raises ValueError on junk,
+    # answered with API_ARGS_ERROR rather than the exception's own text
+    cursor = request.args.get('cursor')
+    cursor = int(cursor) if cursor else None
+    if cursor is not None and cursor < 0:
+        raise ValueError(cursor)
+    limit  = max(1, min(API_LIMIT, int(request.args.get('limit', 50))))
+    wanted = request.args.get('fields')
+    fields = all_fields
+    if wanted:
+        fields = tuple(f for f in wanted.split(',') if f in all_fields)
+        if not fields:
+            raise ValueError(wanted)
+    return cursor, limit, fields
+
+@app.route('/api/v1/books')
+def api_books():
+    try:
+        cursor, limit, fields = api_page_args(BOOK_API_FIELDS)
+    except ValueError:
+        return api_json({'error': API_ARGS_ERROR}, 400)
+    q      = request.args.get('q', '').strip()
+    chosen = {f: [v for v in request.args.getlist(f) if v] for f in FACETS}
+    bits   = catalogue_filter(q, request.args.get('avail') == '1', chosen)[2]
+    if cursor is not None:
+        bits = bits >> (cursor + 1) << (cursor + 1)
+    ids   = select_bits(bits, 0, limit + 1)
+    found = STORE.get_books(ids[:limit])
+    items = [{f: found[bid][f] for f in fields} for bid in ids[:limit] if bid in found]
+    return api_json({'items': items,
+                     'next_cursor': ids[limit - 1] if len(ids) > limit else None})
+
+@app.route('/api/v1/loans')
+def api_loans():
+    uid = session.get('user_email')
+    if not uid:
+        return api_json({'error': 'login required'}, 401)
+    try:
+        cursor, limit, fields = api_page_args(LOAN_API_FIELDS)
+    except ValueError:
+        return api_json({'error': API_ARGS_ERROR}, 400)
+    # members only ever see their own loans; staff may pick a user or see all
+    email = (request.args.get('user') or None) if session.get('is_staff') else uid
+    loans = STORE.loans_before(cursor, limit + 1, email)
+    items = [{f: l[f] for f in fields} for l in loans[:limit]]
+    return api_json({'items': items,
+                     'next_cursor': loans[limit - 1]['id'] if len(loans) > limit else None})
+
+
+# ── LIVE UPDATES ──────────────────────────────────────────────────────────────
+# Catalogue pages keep an EventSource open on /events?books=<ids on the page>
+# and patch a card's badge and text in place when that book changes, so
+# other viewers never need to reload. Every change that drops a book's cards
+# goes through book_changed(), which publishes the book's new counts once
+# (see live.py); the fan-out is one small pre-encoded event per listening
+# page.
+#
+# The card buttons (borrow, return, hold) are fetch() calls: the route
+# answers JSON with a message and the acting user's re-rendered card
+# instead of redirecting back to a freshly built page. Plain form posts,
+# without JavaScript, still flash and redirect.
+
+BROKER     = Broker(int(os.environ.get('LIBRARY_SSE_MAX', 500)))   # each stream holds a thread here; asgi.py raises it
+SSE_PING   = 15     # seconds between keep-alive comments
+SSE_RETRY  = 3000   # ms a browser waits before reconnecting
+SSE_KEYS   = 100    # book ids one stream may follow
+LIVE_FIELDS = ('id', 'title', 'author', 'location', 'available', 'total')
+
+def book_changed(book_id):
+    invalidate_book(book_id)
+    book = STORE.get_book(book_id)
+    data = {f: book[f] for f in LIVE_FIELDS} if book else {'id': book_id, 'deleted': True}
+    BROKER.publish(book_id, 'book', json_bytes(data).decode())
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+def action_done(book_id, kind, msg):
+    # a card button's answer: flash + redirect for a form post, JSON for fetch()
+    if not wants_json():
+        set_flash(kind, msg)
+        return redirect(request.referrer or p('/'))
+    uid  = session['user_email']
+    book = STORE.get_book(book_id)
+    card = None
+    if book:
+        hold = next((h for h in STORE.user_holds(uid) if h['book_id'] == book_id), None)
+        card = render_card(book, card_role(uid, session.get('is_staff', False),
+                                           book_id in STORE.user_open_loans(uid), hold))
+    return api_json({'ok': kind == 'success', 'message': msg, 'card': card})
+
+def live_subscribe(loop=None):
+    keys = {int(k) for k in request.args.get('books', '').split(',')[:SSE_KEYS] if k.isdigit()}
+    return BROKER.subscribe(keys or None, request.headers.get('Last-Event-ID'), loop)
+
+def sse_frames(batch):
+    if not batch:
+        return ': ping\n\n'   # also how a closed connection is noticed
+    return ''.join(f'id: {BROKER.event_id(eid)}\nevent: {name}\ndata: {data}\n\n'
+                   for eid, _, name, data in batch)
+
+def sse_end(sub):
+    # the stream's last words: closed means the worker is stopping and the
+    # browser just reconnects; otherwise it fell behind and the page reloads
+    return '' if sub.closed else 'event: reset\ndata: {}\n\n'
+
+def sse_response(stream):
+    return app.response_class(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/events')
+def events():
+    sub, missed = live_subscribe()
+    if sub is None:
+        return api_json({'error': 'live updates unavailable'}, 503)
+
+    def stream():
+        try:
+            yield f'retry: {SSE_RETRY}\n\n'
+            batch = missed
+            while batch is not None:
+                yield sse_frames(batch)
+                batch = sub.get(SSE_PING)
+            yield sse_end(sub)
+        finally:
+            BROKER.unsubscribe(sub)
+
+    return sse_response(stream())
+
+@METRICS.gauge
+def live_metrics():
+    return [('sse_listeners', {}, BROKER.listeners())]
+
+LIVE_SCRIPT = Markup(f"""
+    <div id="toast"></div>
+    <script>
+    (function () {{
+      var cards = {{}};
+      function track(c) {{ cards[c.dataset.book] = c; }}
+      document.querySelectorAll('[data-book]').forEach(track);
+
+      function toast(msg, ok) {{
+        var t = document.getElementById('toast');
+        t.innerHTML = '<div style="padding:10px 16px;border-radius:6px;box-shadow:0 2px 8px rgba(0,0,0,.15);'
+          + (ok ? 'background:#d4edda;color:#155724' : 'background:#f8d7da;color:#721c24') + '">' + msg + '</div>';
+        clearTimeout(toast.t);
+        toast.t = setTimeout(function () {{ t.innerHTML = ''; }}, 4000);
+      }}
+
+      // card buttons: fetch, then swap in the card the server sends back
+      document.addEventListener('submit', function (e) {{
+        var f = e.target, c = f.closest('[data-book]');
+        if (!c || f.hasAttribute('data-plain') || !window.fetch) return;
+        e.preventDefault();
+        fetch(f.action, {{method: 'POST', credentials: 'same-origin',
+                          headers: {{'Accept': 'application/json'}}}})
+          .then(function (r) {{ if (!r.ok) throw r; return r.json(); }})
+          .then(function (d) {{
+            toast(d.message, d.ok);
+            if (d.card) {{
+              var box = document.createElement('div');
+              box.innerHTML = d.card;
+              var fresh = box.firstElementChild;
+              c.replaceWith(fresh);
+              track(fresh);
+            }}
+          }})
+          .catch(function () {{ f.submit(); }});
+      }});
+
+      // other people's borrows and returns
+      var ids = Object.keys(cards);
+      if (!ids.length || !window.EventSource) return;
+      var es = new EventSource('{p("/events")}?books=' + ids.join(','));
+      es.addEventListener('book', function (e) {{
+        var d = JSON.parse(e.data), c = cards[d.id];
+        if (!c) return;
+        if (d.deleted) {{
+          c.style.opacity = .4;
+          c.querySelectorAll('form,.btn').forEach(function (n) {{ n.remove(); }});
+          return;
+        }}
+        var b = c.querySelector('.badge');
+        c.dataset.available = d.available ? 1 : 0;
+        b.className = 'badge ' + (d.available ? 'in' : 'out');
+        b.innerHTML = d.available ? '&#10003; ' + d.available + ' of ' + d.total + ' available'
+                                  : '&#10007; On Loan (0 of ' + d.total + ')';
+        c.querySelector('h2').textContent = d.title;
+        c.querySelector('.author').textContent = 'by ' + d.author;
+        c.querySelector('.loc').textContent = '\\ud83d\\udccd ' + (d.location || '\\u2014');
+      }});
+      es.addEventListener('reset', function () {{ es.close(); location.reload(); }});
+    }})();
+    </script>""")
 
 
 # ── BORROW ────────────────────────────────────────────────────────────────────
@@ -300,25 +764,18 @@ def borrow_book(book_id):
     if 'user_email' not in session:
         set_flash('error', 'Please log in to borrow books.')
         return redirect(p('/login'))
-    book = find_book(book_id)
-    if not book:
-        set_flash('error', 'Book not found.')
-    elif not book['available']:
-        set_flash('error', 'This book is currently on loan.')
-    else:
-        book['available'] = False
-        LOANS.append({
-            'id':          NEXT_LOAN_ID[0],
-            'book_id':     book_id,
-            'book_title':  book['title'],
-            'user_email':  session['user_email'],
-            'user_name':   session['user_name'],
-            'borrowed_at': now(),
-            'returned_at': None,
-        })
-        NEXT_LOAN_ID[0] += 1
-        set_flash('success', f'You have borrowed &ldquo;{book["title"]}&rdquo;!')
-    return redirect(request.referrer or p('/'))
+    outcome, loan = STORE.borrow(book_id, session['user_email'], session['user_name'], now())
+    METRICS.count('borrows_total', outcome=outcome)
+    if outcome == NOT_FOUND:
+        return action_done(book_id, 'error', 'Book not found.')
+    if outcome == UNAVAILABLE:
+        return action_done(book_id, 'error', 'All copies of this book are currently on loan.')
+    if outcome == ALREADY:
+        return action_done(book_id, 'error', 'You already have a copy of this book.')
+    STATS.borrowed(loan, copy_location(book_id, loan['copy_id']))
+    book_changed(book_id)
+    holds_changed()
+    return action_done(book_id, 'success', f'You have borrowed &ldquo;{escape(loan["book_title"])}&rdquo;!')
 
 
 # ── RETURN ────────────────────────────────────────────────────────────────────
@@ -328,90 +785,350 @@ def return_book(book_id):
     if 'user_email' not in session:
         set_flash('error', 'Please log in.')
         return redirect(p('/login'))
-    book = find_book(book_id)
-    loan = active_loan(book_id)
-    if not book or not loan:
-        set_flash('error', 'No active loan found for this book.')
-    elif loan['user_email'] != session['user_email']:
-        set_flash('error', 'You did not borrow this book.')
-    else:
-        book['available']   = True
-        loan['returned_at'] = now()
-        set_flash('success', f'You have returned &ldquo;{book["title"]}&rdquo;. Thank you!')
-    return redirect(request.referrer or p('/'))
+    outcome, loan = STORE.return_loan(book_id, session['user_email'], now())
+    METRICS.count('returns_total', outcome=outcome)
+    if outcome != OK:
+        return action_done(book_id, 'error', 'You do not have this book on loan.')
+    STATS.returned(loan)
+    book_changed(book_id)
+    holds_changed()
+    return action_done(book_id, 'success',
+                       f'You have returned &ldquo;{escape(loan["book_title"])}&rdquo;. Thank you!')
+
+
+# ── HOLDS ─────────────────────────────────────────────────────────────────────
+# A member can queue for a title with no copy on the shelf. Returned copies
+# go to the head of the queue and are kept aside for the pickup window (see
+# storage.py); uncollected ones lapse on the next sweep, every HOLD_SWEEP
+# seconds on the background scheduler.
+#
+# /api/v1/holds is the cheap way to watch a queue: the caller's holds and
+# their positions, plus a token. With ?since=<token>&wait=N it long-polls,
+# answering as soon as anything changes or after N seconds (at most
+# HOLD_WAIT). Changes in this worker wake it at once; other workers' changes
+# are noticed on the next recheck.
+
+HOLD_SWEEP   = 30
+HOLD_WAIT    = 30
+HOLD_RECHECK = 2
+HOLD_EVENTS  = Notifier()
+
+def holds_changed():
+    HOLD_EVENTS.notify()
+
+@SCHEDULER.every(HOLD_SWEEP)
+def sweep_holds():
+    touched = STORE.expire_holds(now())
+    for book_id in set(touched):
+        book_changed(book_id)
+    if touched:
+        holds_changed()
+
+@app.route('/books/hold/<int:book_id>', methods=['POST'])
+def place_hold(book_id):
+    if 'user_email' not in session:
+        set_flash('error', 'Please log in to place holds.')
+        return redirect(p('/login'))
+    outcome, hold = STORE.place_hold(book_id, session['user_email'], session['user_name'], now())
+    METRICS.count('holds_total', outcome=outcome)
+    if outcome == NOT_FOUND:
+        return action_done(book_id, 'error', 'Book not found.')
+    if outcome == ON_SHELF:
+        return action_done(book_id, 'error', 'A copy is on the shelf &mdash; you can borrow it now.')
+    if outcome == ALREADY:
+        return action_done(book_id, 'error', 'You already have this book on loan or on hold.')
+    book_changed(book_id)
+    holds_changed()
+    return action_done(book_id, 'success', f'Hold placed on &ldquo;{escape(hold["book_title"])}&rdquo;. '
+                                           f'You are number {hold["position"]} in the queue.')
+
+@app.route('/books/hold/<int:book_id>/cancel', methods=['POST'])
+def cancel_hold(book_id):
+    if 'user_email' not in session:
+        set_flash('error', 'Please log in.')
+        return redirect(p('/login'))
+    outcome, hold = STORE.cancel_hold(book_id, session['user_email'], now())
+    if outcome != OK:
+        return action_done(book_id, 'error', 'You do not have a hold on this book.')
+    book_changed(book_id)
+    holds_changed()
+    return action_done(book_id, 'success',
+                       f'Your hold on &ldquo;{escape(hold["book_title"])}&rdquo; was cancelled.')
+
+HOLD_API_FIELDS = ('book_id', 'book_title', 'status', 'position', 'placed_at', 'expires_at')
+
+def hold_state(email):
+    items = [{f: h[f] for f in HOLD_API_FIELDS} for h in STORE.user_holds(email)]
+    return items, format(zlib.crc32(json_bytes(items)), '08x')
+
+@app.route('/api/v1/holds')
+def api_holds():
+    uid = session.get('user_email')
+    if not uid:
+        return api_json({'error': 'login required'}, 401)
+    since, end = holds_poll_args()
+    items, token = hold_state(uid)
+    while since == token and time.monotonic() < end:
+        HOLD_EVENTS.wait(max(0, min(HOLD_RECHECK, end - time.monotonic())))
+        items, token = hold_state(uid)
+    return api_json({'items': items, 'token': token})
+
+def holds_poll_args():
+    # (token the caller has, monotonic time to give up waiting)
+    wait = max(0, min(HOLD_WAIT, request.args.get('wait', 0, type=int)))
+    return request.args.get('since'), time.monotonic() + wait
+
+
+# ── OVERDUE ───────────────────────────────────────────────────────────────────
+# Loans fall due LOAN_PERIOD after borrowing (see storage.py). The scheduler
+# flags newly overdue ones every OVERDUE_SWEEP seconds, which also queues a
+# reminder for each in the store's outbox, and drain_outbox() hands queued
+# messages to notify(). Messages are claimed before they're sent, so a crash
+# mid-send drops them rather than sending twice. There's no mail server
+# here: notify() logs, and is the place to plug one in.
+
+OVERDUE_SWEEP = 60
+OUTBOX_SWEEP  = 30
+OUTBOX_BATCH  = 100
+
+@SCHEDULER.every(OVERDUE_SWEEP)
+def sweep_overdue():
+    loans = STORE.mark_overdue(now())
+    if loans:
+        METRICS.count('overdue_total', len(loans))
+
+@SCHEDULER.every(OUTBOX_SWEEP)
+def drain_outbox():
+    while True:
+        batch = STORE.claim_outbox(OUTBOX_BATCH, now())
+        for msg in batch:
+            notify(msg)
+        if len(batch) < OUTBOX_BATCH:
+            return
+
+def notify(msg):
+    data = json.loads(msg['payload'])
+    if msg['kind'] == 'overdue':
+        app.logger.info('reminder to %s: "%s" was due back %s',
+                        msg['user_email'], data['book_title'], fmt_time(data['due_at']))
+    METRICS.count('notifications_total', kind=msg['kind'])
 
 
 # ── MY LOANS ──────────────────────────────────────────────────────────────────
+# Both loan views page newest first with a loan-id cursor (?before=), so a page
+# costs the same however long the history gets.
+
+LOANS_PAGE = 25
+
+def loans_cursor():
+    before = request.args.get('before', '')
+    return int(before) if before.isdigit() else None
+
+def loans_page(before, **filters):
+    # (loans on this page, cursor for the next page or None)
+    loans = STORE.loans_before(before, LOANS_PAGE + 1, **filters)
+    more  = loans[LOANS_PAGE - 1]['id'] if len(loans) > LOANS_PAGE else None
+    return loans[:LOANS_PAGE], more
+
+def loans_pager(path, before, more, args):
+    # loans_pager.html's links; args: the page's query without before=
+    return {'newest_url': p(path + '?' + urlencode(args)) if before else None,
+            'older_url':  p(path + '?' + urlencode(args + [('before', more)])) if more else None}
+
+def pager_args():
+    return [(k, v) for k, v in request.args.items(multi=True) if k != 'before' and v]
+
+def day_stamp(text, days=0):
+    # local midnight of the day `text` names (YYYY-MM-DD), plus `days`, as a
+    # unix time; None for junk or a day outside what datetime can reach
+    try:
+        day = datetime.strptime(text, '%Y-%m-%d') + timedelta(days=days)
+        return int(day.timestamp())
+    except (ValueError, OverflowError, OSError):
+        return None
+
+BAD_DAYS = 'That date cannot be used, so its end of the range was left open.'
+
+def loan_filters():
+    # the staff filter form (?status=&user=&from=&to=) as loans_before()
+    # kwargs; a date that cannot be used leaves its end of the range open
+    status = request.args.get('status', '')
+    return {
+        'email':  request.args.get('user', '').strip().lower() or None,
+        'status': status if status in ('open', 'overdue', 'returned') else None,
+        'since':  day_stamp(request.args.get('from', '')),
+        # `to` is inclusive, so stop before the following day
+        'until':  day_stamp(request.args.get('to', ''), days=1),
+    }
 
 @app.route('/my-loans')
 def my_loans():
     if 'user_email' not in session:
         set_flash('error', 'Please log in.')
         return redirect(p('/login'))
-    email = session['user_email']
-    my    = [l for l in LOANS if l['user_email'] == email]
-
-    rows = ''
-    for l in reversed(my):
-        if l['returned_at']:
-            status  = f'&#10003; Returned<br><small style="color:#888">{l["returned_at"]}</small>'
-            ret_btn = ''
-        else:
-            status  = '<span style="color:#c0392b;font-weight:600">On Loan</span>'
-            ret_btn = (f'<form action="{p(f"/books/return/{l[chr(98)+chr(111)+chr(111)+chr(107)+chr(95)+chr(105)+chr(100)]}")}"'
-                       f' method="post" style="display:inline">'
-                       f'<button class="btn btn-b btn-sm">Return</button></form>')
-        rows += (f'<tr><td>{l["book_title"]}</td>'
-                 f'<td>{l["borrowed_at"]}</td>'
-                 f'<td>{status}</td>'
-                 f'<td>{ret_btn}</td></tr>')
-
-    if not rows:
-        rows = '<tr><td colspan="4" style="text-align:center;color:#888;padding:2rem">No borrowing history yet.</td></tr>'
+    email, before, args = session['user_email'], loans_cursor(), pager_args()
 
-    content = f'''
-    <h1>&#128196; My Loans</h1>
-    <div class="card" style="padding:0;overflow:hidden">
-      <table>
-        <thead><tr><th>Book</th><th>Borrowed</th><th>Status</th><th>Action</th></tr></thead>
-        <tbody>{rows}</tbody>
-      </table>
-    </div>
-    <p style="margin-top:1rem"><a href="{p("/")}">&#8592; Back to catalogue</a></p>'''
-    return base(content, 'My Loans')
+    def build():
+        # holds are refreshed by long-polling /api/v1/holds (see my_loans.html)
+        holds, token = hold_state(email)
+        loans, more  = loans_page(before, email=email)
+        return {'holds': holds, 'token': token, 'hold_wait': HOLD_WAIT, 'loans': loans,
+                **loans_pager('/my-loans', before, more, args)}
+
+    return stream_page('my_loans.html', 'My Loans', build)
 
 
 # ── ALL LOANS (staff only) ────────────────────────────────────────────────────
 
+LOAN_STATUSES = (('', 'Any status'), ('open', 'On loan'), ('overdue', 'Overdue'),
+                 ('returned', 'Returned'))
+
 @app.route('/all-loans')
 def all_loans():
     if not session.get('is_staff'):
         set_flash('error', 'Staff access required.')
         return redirect(p('/'))
-    rows = ''
-    for l in reversed(LOANS):
-        status = (f'Returned {l["returned_at"]}' if l['returned_at']
-                  else '<span style="color:#c0392b;font-weight:600">On Loan</span>')
-        rows += (f'<tr><td>{l["book_title"]}</td>'
-                 f'<td>{l["user_name"]}<br><small style="color:#888">{l["user_email"]}</small></td>'
-                 f'<td>{l["borrowed_at"]}</td>'
-                 f'<td>{status}</td></tr>')
-    if not rows:
-        rows = '<tr><td colspan="4" style="text-align:center;color:#888;padding:2rem">No loans recorded yet.</td></tr>'
+    filters  = loan_filters()
+    before   = loans_cursor()
+    args     = pager_args()
+    filtered = bool(request.args)
+    if ((request.args.get('from') and filters['since'] is None)
+            or (request.args.get('to') and filters['until'] is None)):
+        set_flash('error', BAD_DAYS)
+    context  = {
+        'statuses': LOAN_STATUSES,
+        'status':   filters['status'] or '',
+        'borrower': filters['email'] or '',
+        'day_from': request.args.get('from', '') if filters['since'] else '',
+        'day_to':   request.args.get('to', '') if filters['until'] else '',
+        'filtered': filtered,
+        'export_url': lambda fmt: p('/all-loans/export?' + urlencode(args + [('format', fmt)])),
+    }
+
+    def build():
+        loans, more = loans_page(before, **filters)
+        return {**context, 'loans': loans, **loans_pager('/all-loans', before, more, args)}
+
+    return stream_page('all_loans.html', 'All Loans', build)
+
+
+# ── EXPORTS (staff only) ──────────────────────────────────────────────────────
+# CSV or JSONL (?format=jsonl), streamed in chunks straight from a store
+# snapshot, so memory stays flat however many rows go out. The catalogue
+# export is one row per copy with the columns of library_booklist.csv.
+
+EXPORT_TYPES   = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+LOAN_COLUMNS   = [(f, f) for f in LOAN_API_FIELDS]
+LOAN_TIMES     = ('borrowed_at', 'returned_at', 'due_at', 'overdue_at')
+COPY_COLUMNS   = [('title', 'title'), ('author', 'author'), ('isbn_13', 'isbn'),
+                  ('format_code', 'format'), ('location_code', 'location'),
+                  ('book_id', 'book_id'), ('copy_id', 'copy_id'), ('available', 'available')]
+EXPORT_CHUNK   = 500   # rows per chunk written to the socket
+
+def _csv_chunks(rows, columns):
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    out.writerow([head for head, _ in columns])
+    for n, row in enumerate(rows, 1):
+        out.writerow([row[key] for _, key in columns])
+        if n % EXPORT_CHUNK == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+def _jsonl_chunks(rows, columns):
+    lines = []
+    for row in rows:
+        lines.append(json_bytes({head: row[key] for head, key in columns}))
+        if len(lines) == EXPORT_CHUNK:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+def export_response(name, rows, columns):
+    fmt    = request.args.get('format', 'csv')
+    fmt    = fmt if fmt in EXPORT_TYPES else 'csv'
+    chunks = (_jsonl_chunks if fmt == 'jsonl' else _csv_chunks)(rows, columns)
+    stamp  = datetime.now().strftime('%Y%m%d-%H%M')
+    # no Content-Length, so the server sends it chunked
+    return app.response_class(chunks, mimetype=EXPORT_TYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{name}-{stamp}.{fmt}"',
+        'X-Accel-Buffering':   'no',
+    })
+
+@app.route('/all-loans/export')
+def export_loans():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    loans = ({**l, **{k: fmt_time(l[k]) for k in LOAN_TIMES}}
+             for l in STORE.iter_loans(**loan_filters()))
+    return export_response('loans', loans, LOAN_COLUMNS)
 
-    content = f'''
-    <h1>&#128203; All Loan Records</h1>
-    <div class="card" style="padding:0;overflow:hidden">
-      <table>
-        <thead><tr><th>Book</th><th>Borrower</th><th>Borrowed</th><th>Status</th></tr></thead>
-        <tbody>{rows}</tbody>
-      </table>
-    </div>
-    <p style="margin-top:1rem"><a href="{p("/")}">&#8592; Back to catalogue</a></p>'''
-    return base(content, 'All Loans')
+@app.route('/books/export')
+def export_books():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    return export_response('catalogue', STORE.iter_copies(), COPY_COLUMNS)
+
+
+# ── STATS (staff only) ────────────────────────────────────────────────────────
+# Loan analytics from running aggregates (see stats.py). borrow_book and
+# return_book keep them current, so the page costs the same however long
+# the history is. The first view builds them from history. With a shared
+# store they are rebuilt every STATS_REBUILD seconds to take in other
+# workers' loans.
+
+STATS_DAYS    = 30
+STATS_REBUILD = 300
+
+def loan_history():
+    return STORE.iter_loans(), {c['id']: c['location'] for c in STORE.all_copies()}
+
+STATS = LoanStats(loan_history)
+
+if os.environ.get('LIBRARY_DB'):
+    @SCHEDULER.every(STATS_REBUILD)
+    def rebuild_stats():
+        if STATS.agg is not None:   # only once someone has looked
+            STATS.rebuild()
+
+def copy_location(book_id, copy_id):
+    for c in STORE.list_copies(book_id):
+        if c['id'] == copy_id:
+            return c['location']
+    return ''
+
+@app.route('/stats')
+def stats():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+
+    def build():
+        # the first view builds the aggregates, after the head has gone out
+        s = STATS.view(STATS_DAYS)
+        return {'s': s, 'peak': max(n for _, n in s['days']) or 1}
+
+    return stream_page('stats.html', 'Stats', build)
 
 
 # ── SIGN UP ───────────────────────────────────────────────────────────────────
+# Passwords are stored hashed (passwords.py). Hashing is deliberately slow,
+# so signups and logins are throttled before any hashing happens: per client
+# address, and for logins per account too.
+
+SIGNUP_BY_IP     = Throttle(rate=1 / 6, burst=10)
+LOGIN_BY_IP      = Throttle(rate=2, burst=30)
+LOGIN_BY_ACCOUNT = Throttle(rate=1 / 30, burst=5)
+
+BUSY = 'The server is busy, please try again in a moment.'
+
+def too_many(wait):
+    return f'Too many attempts, please try again in {max(1, round(wait))} seconds.'
 
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -424,13 +1141,24 @@ def signup():
         if not all([name, email, password, address]):
             set_flash('error', 'All fields are required.')
             return redirect(p('/signup'))
-        if email in USERS:
+        wait = SIGNUP_BY_IP.take(request.remote_addr)
+        if wait:
+            set_flash('error', too_many(wait))
+            return redirect(p('/signup'))
+        if STORE.get_user(email):   # before hashing, which is the expensive part
+            set_flash('error', 'Email already registered.')
+            return redirect(p('/signup'))
+        try:
+            hashed = hash_password(password)
+        except Busy:
+            set_flash('error', BUSY)
+            return redirect(p('/signup'))
+        if not STORE.add_user(email, {'name': name, 'password': hashed,
+                                      'address': address, 'is_staff': is_staff}):
             set_flash('error', 'Email already registered.')
             return redirect(p('/signup'))
-        USERS[email] = {'name': name, 'password': password,
-                        'address': address, 'is_staff': is_staff}
         role = 'Staff account' if is_staff else 'Account'
-        set_flash('success', f'{role} created for {name}! Please log in.')
+        set_flash('success', f'{role} created for {escape(name)}! Please log in.')
         return redirect(p('/login'))
 
     content = f'''
@@ -467,12 +1195,30 @@ def login():
     if request.method == 'POST':
         email    = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '')
-        user     = USERS.get(email)
-        if user and user['password'] == password:
+        wait     = LOGIN_BY_IP.take(request.remote_addr) or LOGIN_BY_ACCOUNT.take(email)
+        if wait:
+            METRICS.count('logins_total', outcome='throttled')
+            set_flash('error', too_many(wait))
+            return redirect(p('/login'))
+        user = STORE.get_user(email)
+        try:
+            ok = check_password(password, user['password'] if user else None)
+        except Busy:
+            METRICS.count('logins_total', outcome='busy')
+            set_flash('error', BUSY)
+            return redirect(p('/login'))
+        if ok and needs_rehash(user['password']):   # plaintext, or older parameters
+            try:
+                STORE.set_password(email, hash_password(password))
+            except Busy:
+                pass   # the next login will try again
+        METRICS.count('logins_total', outcome='ok' if ok else 'failed')
+        if ok:
+            LOGIN_BY_ACCOUNT.reset(email)
             session['user_email'] = email
             session['user_name']  = user['name']
             session['is_staff']   = user['is_staff']
-            set_flash('success', f'Welcome back, {user["name"]}!')
+            set_flash('success', f'Welcome back, {escape(user["name"])}!')
             return redirect(p('/'))
         set_flash('error', 'Invalid email or password.')
         return redirect(p('/login'))
@@ -513,17 +1259,18 @@ def add_book():
     if request.method == 'POST':
         title    = request.form.get('title', '').strip()
         author   = request.form.get('author', '').strip()
-        isbn     = request.form.get('isbn', '').strip()
-        location = request.form.get('location', '').strip()
+        isbn     = clean_isbn(request.form.get('isbn'))   # as imports store it, so they match
+        copies   = parse_copies(request.form)
         if not title or not author:
             set_flash('error', 'Title and author are required.')
             return redirect(p('/books/add'))
-        BOOKS.append({
-            'id': NEXT_BOOK_ID[0], 'title': title, 'author': author,
-            'isbn': isbn, 'location': location, 'available': True,
-        })
-        NEXT_BOOK_ID[0] += 1
-        set_flash('success', f'Book &ldquo;{title}&rdquo; added successfully!')
+        if copies is None:
+            set_flash('error', COPIES_ERROR)
+            return redirect(p('/books/add'))
+        book, version = STORE.add_book({'title': title, 'author': author, 'isbn': isbn}, copies)
+        index_book(book, version)
+        book_changed(book['id'])
+        set_flash('success', f'Book &ldquo;{escape(title)}&rdquo; added successfully!')
         return redirect(p('/'))
 
     content = f'''
@@ -537,8 +1284,15 @@ def add_book():
           <input type="text" name="author" placeholder="e.g. Matt Haig" required></div>
         <div class="fg"><label>ISBN</label>
           <input type="text" name="isbn" placeholder="e.g. 9780525559474"></div>
-        <div class="fg"><label>Shelf Location</label>
-          <input type="text" name="location" placeholder="e.g. F1-B03-S05"></div>
+        <div style="display:flex;gap:1rem">
+          <div class="fg" style="flex:1"><label>Format</label>
+            <select name="format" style="width:100%;padding:11px 13px;border:1px solid #ddd;border-radius:5px;font-size:1rem">
+              {format_options()}</select></div>
+          <div class="fg" style="flex:2"><label>Shelf Location</label>
+            <input type="text" name="location" placeholder="e.g. F1-B03-S05"></div>
+          <div class="fg" style="flex:1"><label>Copies</label>
+            <input type="text" name="copies" value="1" inputmode="numeric"></div>
+        </div>
         <div style="display:flex;gap:1rem;margin-top:.5rem">
           <button type="submit" class="btn btn-g">Add Book</button>
           <a href="{p("/")}" style="line-height:2.4;color:#666;text-decoration:none">Cancel</a>
@@ -565,26 +1319,61 @@ def edit_book(book_id):
         if not title or not author:
             set_flash('error', 'Title and author are required.')
             return redirect(p(f'/books/edit/{book_id}'))
-        book['title']    = title
-        book['author']   = author
-        book['isbn']     = request.form.get('isbn', '').strip()
-        book['location'] = request.form.get('location', '').strip()
-        set_flash('success', f'Book &ldquo;{title}&rdquo; updated!')
+        # 0 or blank adds none
+        add = (parse_copies(request.form)
+               if request.form.get('copies', '').strip() not in ('', '0') else [])
+        if add is None:
+            set_flash('error', COPIES_ERROR)
+            return redirect(p(f'/books/edit/{book_id}'))
+        new, version = STORE.update_book(book_id, {
+            'title':  title,
+            'author': author,
+            'isbn':   clean_isbn(request.form.get('isbn')),
+        })
+        if new:
+            reindex_book(book, new, version)
+        moves = {}
+        for copy in STORE.list_copies(book_id):
+            loc = request.form.get(f'loc_{copy["id"]}')
+            if loc is not None and loc.strip() != copy['location']:
+                moves[copy['id']] = loc.strip()
+        if moves or add:
+            _, version = STORE.update_copies(book_id, now(), moves, add)
+            recopy_book(book_id, version)
+            holds_changed()   # added copies go to waiting holds first
+        book_changed(book_id)
+        set_flash('success', f'Book &ldquo;{escape(title)}&rdquo; updated!')
         return redirect(p('/'))
 
+    copy_rows = ''.join(
+        f'<tr><td>{FORMATS.get(c["format"], c["format"])}</td>'
+        f'<td style="width:60%"><input type="text" name="loc_{c["id"]}" value="{escape(c["location"])}"'
+        f' style="width:100%;padding:6px 9px;border:1px solid #ddd;border-radius:4px"></td>'
+        f'<td>{"On shelf" if c["available"] else "On loan"}</td></tr>'
+        for c in STORE.list_copies(book_id))
+
     content = f'''
     <div style="max-width:560px;margin:0 auto"><div class="card">
       <h1>Edit Book</h1>
       <p style="color:#666;margin-bottom:1.5rem;font-size:.95rem">Update the details for this book</p>
       <form method="post" action="{p(f'/books/edit/{book_id}')}">
         <div class="fg"><label>Title *</label>
-          <input type="text" name="title" value="{book['title']}" required></div>
+          <input type="text" name="title" value="{escape(book['title'])}" required></div>
         <div class="fg"><label>Author *</label>
-          <input type="text" name="author" value="{book['author']}" required></div>
+          <input type="text" name="author" value="{escape(book['author'])}" required></div>
         <div class="fg"><label>ISBN</label>
-          <input type="text" name="isbn" value="{book.get('isbn','') or ''}"></div>
-        <div class="fg"><label>Shelf Location</label>
-          <input type="text" name="location" value="{book.get('location','') or ''}"></div>
+          <input type="text" name="isbn" value="{escape(book.get('isbn','') or '')}"></div>
+        <div class="fg"><label>Copies ({book['available']} of {book['total']} on the shelf)</label>
+          <table style="margin-bottom:.6rem">{copy_rows}</table></div>
+        <div style="display:flex;gap:1rem">
+          <div class="fg" style="flex:1"><label>Add copies</label>
+            <input type="text" name="copies" value="0" inputmode="numeric"></div>
+          <div class="fg" style="flex:1"><label>Format</label>
+            <select name="format" style="width:100%;padding:11px 13px;border:1px solid #ddd;border-radius:5px;font-size:1rem">
+              {format_options()}</select></div>
+          <div class="fg" style="flex:2"><label>Shelf Location</label>
+            <input type="text" name="location" placeholder="e.g. F1-B03-S05"></div>
+        </div>
         <div style="display:flex;gap:1rem">
           <button type="submit" class="btn btn-g">Save Changes</button>
           <a href="{p("/")}" style="line-height:2.4;color:#666;text-decoration:none">Cancel</a>
@@ -601,15 +1390,193 @@ def delete_book(book_id):
     if not session.get('is_staff'):
         set_flash('error', 'Staff access required.')
         return redirect(p('/'))
-    book = find_book(book_id)
+    book, version = STORE.delete_book(book_id)
     if book:
-        BOOKS.remove(book)
-        set_flash('success', f'Book &ldquo;{book["title"]}&rdquo; deleted.')
+        unindex_book(book, version)
+        book_changed(book_id)
+        holds_changed()
+        set_flash('success', f'Book &ldquo;{escape(book["title"])}&rdquo; deleted.')
     return redirect(p('/'))
 
 
+# ── BULK IMPORT (staff only) ──────────────────────────────────────────────────
+# The upload is spooled to a temp file and imported by a background thread
+# (see importer.py); the job page refreshes itself until it's done.
+
+IMPORTS      = {}   # { job_id: ImportJob }, newest last
+IMPORTS_KEEP = 20
+
+@app.route('/books/import', methods=['GET', 'POST'])
+def import_books():
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            set_flash('error', 'Choose a CSV file to import.')
+            return redirect(p('/books/import'))
+        fd, path = tempfile.mkstemp(suffix='.csv', prefix='import-')
+        os.close(fd)
+        upload.save(path)   # copied in chunks, never read into memory
+        job_id = secrets.token_hex(6)
+        IMPORTS[job_id] = start_import(STORE, path, ImportJob(upload.filename),
+                                       on_batch=index_batch, cleanup=lambda: os.remove(path))
+        while len(IMPORTS) > IMPORTS_KEEP:
+            del IMPORTS[next(iter(IMPORTS))]
+        return redirect(p(f'/books/import/{job_id}'))
+
+    recent = ''.join(
+        f'<li><a href="{p(f"/books/import/{jid}")}">{escape(job.name)}</a> &mdash; '
+        f'{"done" if job.finished else "running"}, {job.copies} copies</li>'
+        for jid, job in reversed(IMPORTS.items()))
+    content = f'''
+    <div style="max-width:560px;margin:0 auto"><div class="card">
+      <h1>Import Books</h1>
+      <p style="color:#666;margin-bottom:1.5rem;font-size:.95rem">
+        CSV with one row per copy and the columns of library_booklist.csv:
+        <code>title, author, isbn_13, format_code, location_code</code>.
+        Titles already in the catalogue (same ISBN, or same title and author) get the new copies.</p>
+      <form method="post" action="{p("/books/import")}" enctype="multipart/form-data">
+        <div class="fg"><label>CSV file *</label>
+          <input type="file" name="file" accept=".csv,text/csv" required></div>
+        <div style="display:flex;gap:1rem;margin-top:.5rem">
+          <button type="submit" class="btn btn-g">Import</button>
+          <a href="{p("/")}" style="line-height:2.4;color:#666;text-decoration:none">Cancel</a>
+        </div>
+      </form>
+      {f'<h3 style="margin-top:1.5rem">Recent imports</h3><ul>{recent}</ul>' if recent else ''}
+    </div></div>'''
+    return base(content, 'Import Books')
+
+@app.route('/books/import/<job_id>')
+def import_status(job_id):
+    if not session.get('is_staff'):
+        set_flash('error', 'Staff access required.')
+        return redirect(p('/'))
+    job = IMPORTS.get(job_id)
+    if not job:
+        set_flash('error', 'Import not found.')
+        return redirect(p('/books/import'))
+    st = job.status()
+    if st['failed']:
+        state = f'<p style="color:#c0392b">Stopped: {escape(st["failed"])} (batches before this were saved)</p>'
+    elif st['done']:
+        state = f'<p style="color:#2c5f2e;font-weight:600">Finished in {st["seconds"]}s.</p>'
+    else:
+        state = f'<p>Running&hellip; {st["seconds"]}s</p>'
+    errors = ''.join(f'<li>line {line}: {escape(msg)}</li>' for line, msg in st['errors'])
+    if st['rejected'] > len(st['errors']):
+        errors += f'<li>&hellip; and {st["rejected"] - len(st["errors"])} more</li>'
+    content = f'''
+    <div style="max-width:560px;margin:0 auto"><div class="card">
+      <h1>Import: {escape(st["name"])}</h1>
+      {state}
+      <table>
+        <tr><td>Rows read</td><td>{st["rows"]}</td></tr>
+        <tr><td>Copies added</td><td>{st["copies"]}</td></tr>
+        <tr><td>New books</td><td>{st["added"]}</td></tr>
+        <tr><td>Existing books topped up</td><td>{st["merged"]}</td></tr>
+        <tr><td>Rows rejected</td><td>{st["rejected"]}</td></tr>
+      </table>
+      {f'<h3 style="margin-top:1rem">Rejected rows</h3><ul>{errors}</ul>' if errors else ''}
+      <p style="margin-top:1rem"><a href="{p("/books/import")}">&#8592; Import another file</a></p>
+    </div></div>'''
+    if not st['done']:
+        content = '<meta http-equiv="refresh" content="2">' + content
+    return base(content, 'Import Books')
+
+@app.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_books_command(path):
+    """Bulk-import a catalogue CSV into LIBRARY_DB (or LIBRARY_JOURNAL)."""
+    if not (os.environ.get('LIBRARY_DB') or os.environ.get('LIBRARY_JOURNAL')):
+        raise click.ClickException('the in-memory store is lost when this command exits: '
+                                   'set LIBRARY_DB or LIBRARY_JOURNAL')
+    job = ImportJob(os.path.basename(path))
+
+    def progress(added, merged, version):
+        click.echo(f'{job.rows} rows, {job.copies} copies, {job.added} new books, '
+                   f'{job.merged} topped up, {job.rejected} rejected')
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        run_import(STORE, f, job, on_batch=progress)
+    for line, msg in job.errors:
+        click.echo(f'line {line}: {msg}', err=True)
+    if job.failed:
+        raise click.ClickException(job.failed)
+    click.echo(f'Done in {job.status()["seconds"]}s.')
+
+
+# ── ASYNC SERVING ─────────────────────────────────────────────────────────────
+# Under asgi.py (the production entry point) the read-heavy routes below run
+# as coroutines on the event loop; every other route stays a plain view on
+# the bridge's thread pool. They share the views' code. Store work goes
+# through ASTORE (see storage.py) on its reader threads, so neither a slow
+# search nor a lock the store is holding stalls the loop, and waiting (an SSE
+# stream, the holds long-poll) is an await, so idle connections cost no thread.
+
+ASTORE      = AsyncStore(STORE)
+ASYNC_VIEWS = {}   # { endpoint: coroutine function }
+
+def async_view(endpoint):
+    def add(fn):
+        ASYNC_VIEWS[endpoint] = fn
+        return fn
+    return add
+
+@async_view('index')
+async def index_async():
+    return await ASTORE.run(index)
+
+@async_view('suggest')
+async def suggest_async():
+    return await ASTORE.run(suggest)
+
+@async_view('api_books')
+async def api_books_async():
+    return await ASTORE.run(api_books)
+
+@async_view('api_holds')
+async def api_holds_async():
+    uid = session.get('user_email')
+    if not uid:
+        return api_json({'error': 'login required'}, 401)
+    since, end = holds_poll_args()
+    items, token = await ASTORE.run(hold_state, uid)
+    while since == token and time.monotonic() < end:
+        await HOLD_EVENTS.wait_async(max(0, min(HOLD_RECHECK, end - time.monotonic())))
+        items, token = await ASTORE.run(hold_state, uid)
+    return api_json({'items': items, 'token': token})
+
+@async_view('events')
+async def events_async():
+    sub, missed = live_subscribe(asyncio.get_running_loop())
+    if sub is None:
+        return api_json({'error': 'live updates unavailable'}, 503)
+
+    async def stream():
+        try:
+            yield f'retry: {SSE_RETRY}\n\n'
+            batch = missed
+            while batch is not None:
+                yield sse_frames(batch)
+                batch = await sub.wait(SSE_PING)
+            yield sse_end(sub)
+        finally:
+            BROKER.unsubscribe(sub)
+
+    return sse_response(stream())
+
+
 # ── MAIN ──────────────────────────────────────────────────────────────────────
+# Development server: one process, a thread per request. LIBRARY_DEBUG=1
+# turns on the reloader and the in-browser debugger (never in production;
+# see asgi.py for serving).
 
 if __name__ == '__main__':
-    print(f'Loaded {len(BOOKS)} books from library_booklist.csv')
-    app.run(debug=True, port=5050)
\ No newline at end of file
+    print(f'Loaded {STORE.count_books()} books')
+    if getattr(STORE, 'journal', None):
+        r = STORE.journal.recovered
+        print(f'Journal: {r["records"]} records replayed in {r["seconds"]:.2f}s')
+    app.run(debug=os.environ.get('LIBRARY_DEBUG') == '1', port=5050, threaded=True)
\ No newline at end of file
@@ -0,0 +1,299 @@
+# ── METRICS ───────────────────────────────────────────────────────────────────
+# Process-local counters and latency histograms, served at /metrics in the
+# Prometheus text format. Recording is a bisect and two additions under a
+# lock, cheap enough to leave on for every request.
+#
+#   METRICS.observe('search_seconds', dt)          # histogram
+#   with METRICS.timer('render_seconds'): ...      # same, timed
+#   METRICS.count('borrows_total', outcome='ok')   # counter
+#   @timed('search_seconds')                       # histogram per call
+#
+# Names get the `library_` prefix on output. Each worker process keeps its
+# own numbers; Prometheus adds them up across targets.
+#
+# Sampler is the opt-in profiler: while it runs, a thread samples the stacks
+# of in-flight requests and keeps the samples of requests that turn out slow,
+# in the folded format flamegraph.pl and speedscope read.
+
+import functools, sys, threading, time
+from bisect import bisect_left
+from collections import Counter
+
+PREFIX  = 'library_'
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+perf_counter = time.perf_counter
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)   # last one is +Inf
+        self.sum     = 0.0
+        self.lock    = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum       += value
+
+    def lines(self, name, labels):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        out, running = [], 0
+        for bound, n in zip(self.buckets + ('+Inf',), counts):
+            running += n
+            out.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {running}')
+        out.append(f'{name}_sum{_labels(labels)} {total:.6f}')
+        out.append(f'{name}_count{_labels(labels)} {running}')
+        return out
+
+
+class _Timer:
+    __slots__ = ('hist', 'start')
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.hists    = {}   # { (name, labels): Histogram }
+        self.counters = {}   # { (name, labels): value }
+        self.gauges   = []   # callables returning [(name, labels, value)] at scrape time
+        self.help     = {}
+        self.lock     = threading.Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def histogram(self, name, **labels):
+        key  = (name, tuple(sorted(labels.items())))
+        hist = self.hists.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.hists.setdefault(key, Histogram())
+        return hist
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def timer(self, name, **labels):
+        return _Timer(self.histogram(name, **labels))
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, fn):
+        # fn() -> [(name, {labels}, value)], read on every scrape
+        self.gauges.append(fn)
+        return fn
+
+    def render(self):
+        families = {}   # { name: (type, [lines]) }
+        with self.lock:
+            hists    = list(self.hists.items())
+            counters = list(self.counters.items())
+        for (name, labels), hist in sorted(hists):
+            families.setdefault(name, ('histogram', []))[1].extend(
+                hist.lines(PREFIX + name, labels))
+        for (name, labels), value in sorted(counters):
+            families.setdefault(name, ('counter', []))[1].append(
+                f'{PREFIX}{name}{_labels(labels)} {value}')
+        for fn in self.gauges:
+            for name, labels, value in fn():
+                kind = 'counter' if name.endswith('_total') else 'gauge'
+                families.setdefault(name, (kind, []))[1].append(
+                    f'{PREFIX}{name}{_labels(tuple(sorted(labels.items())))} {value}')
+        out = []
+        for name, (kind, lines) in families.items():
+            if name in self.help:
+                out.append(f'# HELP {PREFIX}{name} {self.help[name]}')
+            out.append(f'# TYPE {PREFIX}{name} {kind}')
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    esc = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+
+METRICS = Metrics()
+
+
+def timed(name, **labels):
+    # decorator: every call of fn goes into histogram `name`
+    def wrap(fn):
+        hist = METRICS.histogram(name, **labels)
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(perf_counter() - start)
+        return inner
+    return wrap
+
+
+class TimedLock:
+    # a Lock that records how long contended acquisitions waited
+    __slots__ = ('lock', 'hist')
+
+    def __init__(self, name):
+        self.lock = threading.Lock()
+        self.hist = METRICS.histogram('lock_wait_seconds', lock=name)
+
+    def __enter__(self):
+        if not self.lock.acquire(False):
+            start = perf_counter()
+            self.lock.acquire()
+            self.hist.observe(perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+        return False
+
+
+# ── WSGI ──
+
+def observe_request(environ, status, elapsed):
+    # one finished request; the app puts the matched rule in environ['library.route']
+    METRICS.observe('http_request_duration_seconds', elapsed,
+                    route=environ.get('library.route', 'unmatched'),
+                    method=environ.get('REQUEST_METHOD', ''), status=status)
+
+
+class MetricsMiddleware:
+    # times every request, streamed bodies included, by route template;
+    # the app puts the matched rule in environ['library.route']
+    def __init__(self, wsgi_app, sampler=None):
+        self.app     = wsgi_app
+        self.sampler = sampler
+
+    def __call__(self, environ, start_response):
+        start  = perf_counter()
+        status = ['000']
+        ident  = threading.get_ident()
+        if self.sampler:
+            self.sampler.begin(ident)
+
+        def capture(code, headers, exc_info=None):
+            status[0] = code.split(' ', 1)[0]
+            return start_response(code, headers, exc_info)
+
+        def done():
+            elapsed = perf_counter() - start
+            observe_request(environ, status[0], elapsed)
+            if self.sampler:
+                self.sampler.end(ident, environ.get('library.route', 'unmatched'), elapsed)
+
+        try:
+            body = self.app(environ, capture)
+        except BaseException:
+            status[0] = '500'
+            done()
+            raise
+        return _Closing(body, done)
+
+
+class _Closing:
+    # the response body, calling done() once the server has finished with it
+    def __init__(self, body, done):
+        self.body, self.done = body, done
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.done()
+
+
+# ── PROFILER ──
+
+class Sampler:
+    def __init__(self, interval=0.005, slow=0.25):
+        self.interval = interval   # seconds between samples
+        self.slow     = slow       # requests at least this long keep their samples
+        self.running  = False
+        self.active   = {}         # { thread ident: Counter(folded stack) }
+        self.folded   = Counter()  # kept samples, 'route;frame;frame...' -> count
+        self.slow_requests = 0
+        self.lock     = threading.Lock()
+
+    def start(self, interval=None, slow=None):
+        with self.lock:
+            self.interval = interval or self.interval
+            self.slow     = slow if slow is not None else self.slow
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self._run, name='sampler', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def clear(self):
+        with self.lock:
+            self.folded.clear()
+            self.slow_requests = 0
+
+    def begin(self, ident):
+        if self.running:
+            with self.lock:
+                self.active[ident] = Counter()
+
+    def end(self, ident, route, elapsed):
+        with self.lock:
+            stacks = self.active.pop(ident, None)
+            if stacks is None or elapsed < self.slow:
+                return
+            self.slow_requests += 1
+            for stack, n in stacks.items():
+                self.folded[f'{route};{stack}'] += n
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+        with self.lock:
+            self.active.clear()
+
+    def dump(self):
+        with self.lock:
+            return ''.join(f'{stack} {n}\n' for stack, n in self.folded.most_common())
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
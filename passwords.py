@@ -0,0 +1,134 @@
+# ── PASSWORDS ─────────────────────────────────────────────────────────────────
+# Slow hashing for stored passwords, and the throttles in front of it.
+#
+# Hashes are scrypt, stored as  scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>.
+# The work factor comes from LIBRARY_SCRYPT_N (default 2**14, about 16 MB and
+# some tens of ms per hash). Passwords stored before hashing existed, and
+# hashes made with other parameters, still verify; needs_rehash() tells the
+# login route to store a fresh hash while it has the plaintext in hand.
+#
+# Hashing runs in a small thread pool (hashlib releases the GIL while it
+# works), so at most HASH_WORKERS hashes burn CPU at once whatever the number
+# of request threads, and at most HASH_QUEUE more wait for a worker. Beyond
+# that hash_password() / check_password() raise Busy at once instead of
+# piling up.
+#
+# Throttle is a token bucket per key (an email, an IP), kept in memory per
+# worker process: `burst` attempts straight away, then one every 1/rate
+# seconds. Login checks it before doing any hashing, so refused attempts are
+# nearly free.
+
+import base64, hashlib, hmac, os, secrets, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import METRICS, perf_counter
+
+SCRYPT_N     = int(os.environ.get('LIBRARY_SCRYPT_N', 1 << 14))
+SCRYPT_R     = 8
+SCRYPT_P     = 1
+HASH_WORKERS = int(os.environ.get('LIBRARY_HASH_WORKERS', max(1, (os.cpu_count() or 1) // 2)))
+HASH_QUEUE   = 4 * HASH_WORKERS
+
+
+class Busy(Exception):
+    pass
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + (1 << 20), dklen=32)
+
+
+def _hash(password):
+    salt = secrets.token_bytes(16)
+    key  = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}'
+
+
+def _verify(password, stored):
+    if not stored.startswith('scrypt$'):   # stored before hashing: plaintext
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, n, r, p, salt, key = stored.split('$')
+        want = base64.b64decode(key)
+        got  = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(got, want)
+
+
+def needs_rehash(stored):
+    return not stored.startswith(f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$')
+
+
+# ── worker pool ──
+
+_pool  = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='hash')
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+# verified when the account doesn't exist, so a miss costs what a hit does
+_DUMMY = None
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        METRICS.count('password_hash_rejected_total')
+        raise Busy()
+    start = perf_counter()
+    try:
+        return _pool.submit(fn, *args).result()
+    finally:
+        _slots.release()
+        METRICS.observe('password_hash_seconds', perf_counter() - start)
+
+
+def hash_password(password):
+    return _run(_hash, password)
+
+
+def check_password(password, stored):
+    # stored None (no such account) still does one full hash
+    global _DUMMY
+    if stored is None:
+        if _DUMMY is None:
+            _DUMMY = hash_password(secrets.token_hex(8))
+        _run(_verify, password, _DUMMY)
+        return False
+    return _run(_verify, password, stored)
+
+
+# ── throttling ──
+
+class Throttle:
+    def __init__(self, rate, burst, max_keys=100_000):
+        self.rate     = rate       # tokens per second
+        self.burst    = burst
+        self.max_keys = max_keys   # least recently used keys are forgotten past this
+        self.buckets  = OrderedDict()   # { key: [tokens, last refill] }
+        self.lock     = threading.Lock()
+
+    def take(self, key):
+        # 0 if allowed, else seconds until the next attempt would be
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def reset(self, key):
+        with self.lock:
+            self.buckets.pop(key, None)
@@ -0,0 +1,63 @@
+# ── SCHEDULER ─────────────────────────────────────────────────────────────────
+# Periodic background jobs (hold expiry, overdue loans, the outbox) on one
+# daemon thread per worker process. Jobs sit in a min-heap keyed by their
+# next run, so the thread sleeps exactly until the earliest one is due.
+#
+#   @SCHEDULER.every(60)
+#   def sweep_overdue(): ...
+#
+#   SCHEDULER.start()
+#
+# Jobs are short store sweeps that are safe to run in several workers at
+# once (each store write is one transaction). A job that raises is logged
+# and simply runs again at its next slot.
+
+import heapq, itertools, logging, threading, time
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs    = []   # heap of (next run, seq, every, fn); monotonic seconds
+        self.seq     = itertools.count()
+        self.lock    = threading.Lock()
+        self.wake    = threading.Event()
+        self.running = False
+
+    def every(self, seconds):
+        # decorator: run fn every `seconds`, the first time one period from now
+        def add(fn):
+            with self.lock:
+                heapq.heappush(self.jobs, (time.monotonic() + seconds, next(self.seq), seconds, fn))
+            self.wake.set()
+            return fn
+        return add
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self._run, name='scheduler', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def _run(self):
+        while self.running:
+            self.wake.clear()   # before looking, so a job added meanwhile wakes us
+            with self.lock:
+                due = self.jobs[0][0] if self.jobs else None
+            if due is None or due > time.monotonic():
+                self.wake.wait(None if due is None else due - time.monotonic())
+                continue
+            with self.lock:
+                at, seq, seconds, fn = heapq.heappop(self.jobs)
+            try:
+                fn()
+            except Exception:
+                log.exception('scheduled job %s failed', getattr(fn, '__name__', fn))
+            with self.lock:   # from the slot, not the finish, unless it overran
+                heapq.heappush(self.jobs, (max(at + seconds, time.monotonic()), seq, seconds, fn))
@@ -0,0 +1,241 @@
+# ── CATALOGUE SEARCH ──────────────────────────────────────────────────────────
+# Inverted index over book title, author and ISBN.
+# Built once from BOOKS and patched by add / edit / delete, so a search
+# request never rescans the catalogue. A published index is never changed:
+# edits patch a copy() (posting lists are shared until one changes) and the
+# app swaps it in, so searches read theirs without a lock.
+
+import heapq, re, unicodedata
+from bisect import bisect_left, insort
+
+TITLE, AUTHOR, ISBN = 1, 2, 4
+
+# score for one query term hitting one field — title beats author beats isbn,
+# and an exact token beats a prefix of a longer one
+_EXACT  = {TITLE: 6, AUTHOR: 4, ISBN: 3}
+_PREFIX = {TITLE: 3, AUTHOR: 2, ISBN: 1}
+
+_TOKEN_RE  = re.compile(r'[0-9a-z]+')
+MIN_PREFIX = 2   # shorter terms only match whole tokens
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+def _book_fields(book):
+    return ((TITLE, book['title']), (AUTHOR, book['author']), (ISBN, book.get('isbn')))
+
+def _term_score(mask, exact):
+    table = _EXACT if exact else _PREFIX
+    return max(table[f] for f in (TITLE, AUTHOR, ISBN) if mask & f)
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}   # { token: {book_id: field_mask} }
+        self.docs     = {}   # { book_id: {token: field_mask} }
+        self.vocab    = []   # sorted tokens, for prefix lookups
+        self.owned    = None # tokens whose posting list is this copy's own; None: all
+
+    @classmethod
+    def build(cls, books):
+        idx = cls()
+        for book in books:
+            idx._insert(book)
+        idx.vocab = sorted(idx.postings)
+        return idx
+
+    # ── maintenance ──
+
+    def copy(self):
+        # a new index to patch, sharing posting lists with this one until they change
+        new = SearchIndex()
+        new.postings = dict(self.postings)
+        new.docs     = dict(self.docs)
+        new.vocab    = list(self.vocab)
+        new.owned    = set()
+        return new
+
+    def _plist(self, tok):
+        plist = self.postings[tok]
+        if self.owned is not None and tok not in self.owned:
+            plist = self.postings[tok] = dict(plist)
+            self.owned.add(tok)
+        return plist
+
+    def _insert(self, book):
+        terms = {}
+        for field, text in _book_fields(book):
+            for tok in tokenize(text):
+                terms[tok] = terms.get(tok, 0) | field
+        bid = book['id']
+        self.docs[bid] = terms
+        new = []
+        for tok, mask in terms.items():
+            if tok in self.postings:
+                plist = self._plist(tok)
+            else:
+                plist = self.postings[tok] = {}
+                new.append(tok)
+                if self.owned is not None:
+                    self.owned.add(tok)
+            plist[bid] = mask
+        return new
+
+    def add(self, book):
+        for tok in self._insert(book):
+            insort(self.vocab, tok)
+
+    def remove(self, book_id):
+        terms = self.docs.pop(book_id, None)
+        if not terms:
+            return
+        for tok in terms:
+            plist = self._plist(tok)
+            del plist[book_id]
+            if not plist:
+                del self.postings[tok]
+                del self.vocab[bisect_left(self.vocab, tok)]
+
+    def update(self, book):
+        self.remove(book['id'])
+        self.add(book)
+
+    # ── querying ──
+
+    def _expand(self, term):
+        # tokens equal to or starting with term, as (token, is_exact)
+        if term in self.postings:
+            yield term, True
+        if len(term) < MIN_PREFIX:
+            return
+        i = bisect_left(self.vocab, term)
+        if i < len(self.vocab) and self.vocab[i] == term:
+            i += 1
+        while i < len(self.vocab) and self.vocab[i].startswith(term):
+            yield self.vocab[i], False
+            i += 1
+
+    def _postings_size(self, term):
+        return sum(len(self.postings[t]) for t, _ in self._expand(term))
+
+    def _doc_score(self, terms, term):
+        best = 0
+        mask = terms.get(term)
+        if mask:
+            best = _term_score(mask, True)
+        if len(term) >= MIN_PREFIX:
+            for tok, mask in terms.items():
+                if tok != term and tok.startswith(term):
+                    best = max(best, _term_score(mask, False))
+        return best
+
+    def match(self, query):
+        # { book_id: score } for books matching every query term
+        terms = sorted(set(tokenize(query)), key=self._postings_size)
+        if not terms:
+            return {}
+        # seed from the rarest term, then check the rest per candidate
+        scores = {}
+        for tok, exact in self._expand(terms[0]):
+            for bid, mask in self.postings[tok].items():
+                s = _term_score(mask, exact)
+                if s > scores.get(bid, 0):
+                    scores[bid] = s
+        for term in terms[1:]:
+            if not scores:
+                break
+            kept = {}
+            for bid, s in scores.items():
+                ts = self._doc_score(self.docs[bid], term)
+                if ts:
+                    kept[bid] = s + ts
+            scores = kept
+        return scores
+
+    def rank(self, scores, k):
+        # top k book ids, best first; ties keep catalogue order
+        return [bid for bid, _ in
+                heapq.nsmallest(k, scores.items(), key=lambda kv: (-kv[1], kv[0]))]
+
+
+# ── AUTOCOMPLETE ──────────────────────────────────────────────────────────────
+# Sorted array of normalized title / author keys for the search box.
+# Every word boundary gets its own key, so "potter" completes
+# "Harry Potter and ..." as well as phrases that start with it.
+
+MAX_SUGGEST = 10
+
+class Suggester:
+    def __init__(self):
+        self.keys   = []   # sorted [(key, kind, text)]
+        self.counts = {}   # { (kind, text): number of books using it }
+
+    @classmethod
+    def build(cls, books):
+        sug = cls()
+        for book in books:
+            for kind, text in (('title', book['title']), ('author', book['author'])):
+                if sug._ref(kind, text) == 1:
+                    sug.keys.extend(_suggest_keys(kind, text))
+        sug.keys.sort()
+        return sug
+
+    def _ref(self, kind, text, delta=1):
+        n = self.counts.get((kind, text), 0) + delta
+        if n:
+            self.counts[(kind, text)] = n
+        else:
+            self.counts.pop((kind, text), None)
+        return n
+
+    def copy(self):
+        new = Suggester()
+        new.keys   = list(self.keys)
+        new.counts = dict(self.counts)
+        return new
+
+    def add(self, book):
+        for kind, text in (('title', book['title']), ('author', book['author'])):
+            if self._ref(kind, text) == 1:
+                for key in _suggest_keys(kind, text):
+                    insort(self.keys, key)
+
+    def remove(self, book):
+        for kind, text in (('title', book['title']), ('author', book['author'])):
+            if (kind, text) in self.counts and self._ref(kind, text, -1) == 0:
+                for key in _suggest_keys(kind, text):
+                    i = bisect_left(self.keys, key)
+                    if i < len(self.keys) and self.keys[i] == key:
+                        del self.keys[i]
+
+    def complete(self, prefix, n=MAX_SUGGEST):
+        # up to n (kind, text) pairs, whole-phrase matches first
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+        n     = max(1, min(n, MAX_SUGGEST))
+        i     = bisect_left(self.keys, (prefix,))
+        lead  = []
+        inner = []
+        seen  = set()
+        # bounded scan: stop once n phrase-start hits or a few pages of keys are seen
+        while i < len(self.keys) and len(lead) < n and len(seen) < n * 8:
+            key, kind, text = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            if (kind, text) not in seen:
+                seen.add((kind, text))
+                full = ' '.join(tokenize(text))
+                (lead if full == key else inner).append((kind, text))
+            i += 1
+        return (lead + inner)[:n]
+
+
+def _suggest_keys(kind, text):
+    words = tokenize(text)
+    return [(' '.join(words[i:]), kind, text) for i in range(len(words))]
@@ -0,0 +1,139 @@
+# ── CATALOGUE SNAPSHOT ────────────────────────────────────────────────────────
+# library_booklist.csv parsed and grouped into titles once, then kept as a
+# compact binary file beside it (library_booklist.snap). Worker starts, debug
+# reloads and test imports decode that file instead of re-running the CSV
+# parse, ISBN cleaning and grouping, about twice as fast for the loader.
+#
+# The file is mmap'd read-only only to slice it without copies. The seed
+# decodes every record into the store's own objects in one pass, so nothing
+# stays shared between workers and each still holds the whole catalogue.
+#
+# Layout, little endian:
+#   header   MAGIC, csv size, csv mtime_ns, csv sha256, books, copies, strings
+#   offsets  uint32[strings + 1]  — string n is blob[offsets[n]:offsets[n+1]]
+#   books    uint32[books * 3]    — title, author, isbn        (string numbers)
+#   copies   uint32[copies * 3]   — book number, format, location
+#   blob     UTF-8 text; repeated strings (authors, formats) are stored once
+#
+# It is rebuilt when the CSV's size or mtime changes and its hash no longer
+# matches. If the snapshot can't be written the CSV is simply parsed.
+
+import hashlib, mmap, os, struct
+from array import array
+
+MAGIC  = b'LIBSNAP1'
+HEADER = struct.Struct('<8sQq32sIII')
+
+
+def _csv_stat(csv_path):
+    st = os.stat(csv_path)
+    return st.st_size, st.st_mtime_ns
+
+def _csv_hash(csv_path):
+    h = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def write_snapshot(path, books, size, mtime, digest):
+    # books as from the CSV loader: [{title, author, isbn, copies: [{format, location}]}]
+    strings = {}   # { text: number }
+    def sid(text):
+        n = strings.get(text)
+        if n is None:
+            n = strings[text] = len(strings)
+        return n
+
+    book_cols, copy_cols = array('I'), array('I')
+    for i, b in enumerate(books):
+        book_cols.extend((sid(b['title']), sid(b['author']), sid(b['isbn'])))
+        for c in b['copies']:
+            copy_cols.extend((i, sid(c['format']), sid(c['location'])))
+
+    blob, offsets = bytearray(), array('I', [0])
+    for text in strings:   # insertion order is number order
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, size, mtime, digest,
+                            len(books), len(copy_cols) // 3, len(strings)))
+        for a in (offsets, book_cols, copy_cols):
+            a.tofile(f)
+        f.write(blob)
+    os.replace(tmp, path)   # atomic, so workers starting together can't see half a file
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.csv_size, self.csv_mtime, self.csv_hash,
+         self.n_books, self.n_copies, self.n_strings) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError('not a catalogue snapshot')
+        self.view = memoryview(self.mm)
+        start     = HEADER.size
+        sections  = []
+        for count in (self.n_strings + 1, self.n_books * 3, self.n_copies * 3):
+            end = start + count * 4
+            sections.append(self.view[start:end].cast('I'))
+            start = end
+        self.offsets, self.book_cols, self.copy_cols = sections
+        self.blob = start
+        if self.blob + self.offsets[-1] != len(self.mm):
+            raise ValueError('truncated catalogue snapshot')
+
+    def __len__(self):
+        return self.n_books
+
+    def text(self, n):
+        return self.mm[self.blob + self.offsets[n]:self.blob + self.offsets[n + 1]].decode('utf-8')
+
+    def books(self):
+        # seed records, ids from 1 in CSV order; copies are stored grouped by book
+        b, cols = self.book_cols, self.copy_cols
+        c = 0
+        for i in range(self.n_books):
+            copies = []
+            while c < self.n_copies and cols[c * 3] == i:
+                copies.append({'format': self.text(cols[c * 3 + 1]),
+                               'location': self.text(cols[c * 3 + 2])})
+                c += 1
+            yield {'id': i + 1, 'title': self.text(b[i * 3]), 'author': self.text(b[i * 3 + 1]),
+                   'isbn': self.text(b[i * 3 + 2]), 'copies': copies}
+
+    def close(self):
+        for v in (self.offsets, self.book_cols, self.copy_cols, self.view):
+            v.release()
+        self.mm.close()
+
+
+def open_snapshot(csv_path, parse):
+    # Snapshot for csv_path, rebuilding it with parse() if the CSV changed;
+    # None if there's no usable snapshot and none could be written
+    path = os.path.splitext(csv_path)[0] + '.snap'
+    size, mtime = _csv_stat(csv_path)
+    digest = None
+    try:
+        snap = Snapshot(path)
+        if (snap.csv_size, snap.csv_mtime) == (size, mtime):
+            return snap
+        digest = _csv_hash(csv_path)
+        same   = snap.csv_hash == digest
+        snap.close()
+        if same:   # touched, not changed: just restamp the header
+            with open(path, 'r+b') as f:
+                f.write(HEADER.pack(MAGIC, size, mtime, digest,
+                                    snap.n_books, snap.n_copies, snap.n_strings))
+            return Snapshot(path)
+    except (OSError, ValueError, struct.error):
+        pass
+    try:
+        write_snapshot(path, parse(), size, mtime, digest or _csv_hash(csv_path))
+        return Snapshot(path)
+    except OSError:
+        return None
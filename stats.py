@@ -0,0 +1,253 @@
+# ── LOAN STATS ────────────────────────────────────────────────────────────────
+# Running aggregates behind the staff /stats page. Every borrow and return
+# adjusts them in place, so each widget reads a few ready numbers instead of
+# walking the loan history:
+#
+#   top      — most borrowed titles: a count per book plus the TOP_K leaders,
+#              kept sorted (ties to the lower book id). Counts only grow, so
+#              a book can only climb, and one insertion step per borrow
+#              keeps the leaders exactly right.
+#   days     — loans made per local day, one bucket a day
+#   floors   — loans per floor ("F1" of F1-B09-S05), ever and out now
+#   members  — open loans per member; its size is the active borrowers
+#
+#   STATS.borrowed(loan, location)   # after a borrow, with the copy's location
+#   STATS.returned(loan)
+#   STATS.view(DAYS)                 # built from history on first use
+#   STATS.rebuild()                  # from history again
+#
+# Rebuilding makes one pass over history(); with NumPy installed the counting
+# is vectorised. Borrows and returns that race a rebuild are queued and
+# applied after it, matched by loan id: a borrow counts if the pass didn't
+# see its id, a return if its loan is among those the pass found open. So
+# each is counted exactly once whichever side of the pass it fell on.
+#
+# Per worker process: with a shared SQLite store another worker's loans are
+# seen at the next rebuild (main.py schedules one).
+
+import heapq, threading, time
+from collections import Counter
+from operator import itemgetter
+from facets import floor_of
+from metrics import METRICS, perf_counter
+
+try:
+    import numpy   # optional; vectorised counting for rebuilds
+except ImportError:
+    numpy = None
+
+TOP_K  = 10
+DAY    = 86400
+OFFSET = time.localtime().tm_gmtoff   # days are local; a DST change shifts them by an hour
+
+
+def day_of(ts):
+    return (ts + OFFSET) // DAY
+
+
+class _Aggregates:
+    def __init__(self):
+        self.counts  = {}   # { book_id: loans ever }
+        self.titles  = {}   # { book_id: title as last borrowed }
+        self.top     = []   # [[count, book_id], ...] the TOP_K most borrowed, most first
+        self.days    = {}   # { day number: loans made }
+        self.floors  = {}   # { floor: loans ever }
+        self.out     = {}   # { floor: loans out now }
+        self.open    = {}   # { loan_id: (floor, email) } for loans out now
+        self.members = {}   # { email: loans out now }
+        self.total   = 0
+        self.seen    = 0    # highest loan id the rebuild counted
+
+    def borrow(self, loan_id, book_id, title, floor, email, at):
+        if loan_id <= self.seen:
+            return
+        self.total += 1
+        self.titles[book_id] = title
+        n = self.counts[book_id] = self.counts.get(book_id, 0) + 1
+        self._climb(book_id, n)
+        day = day_of(at)
+        self.days[day] = self.days.get(day, 0) + 1
+        if floor:
+            self.floors[floor] = self.floors.get(floor, 0) + 1
+            self.out[floor] = self.out.get(floor, 0) + 1
+        self.members[email] = self.members.get(email, 0) + 1
+        self.open[loan_id] = (floor, email)
+
+    def give_back(self, loan_id):
+        entry = self.open.pop(loan_id, None)
+        if not entry:
+            return
+        floor, email = entry
+        if floor:
+            self.out[floor] -= 1
+        self.members[email] -= 1
+        if not self.members[email]:
+            del self.members[email]
+
+    def _climb(self, book_id, n):
+        top = self.top
+        for i, entry in enumerate(top):
+            if entry[1] == book_id:
+                entry[0] = n
+                break
+        else:
+            if len(top) < TOP_K:
+                top.append([n, book_id])
+            elif _rank(n, book_id) > _rank(*top[-1]):
+                top[-1] = [n, book_id]
+            else:
+                return
+            i = len(top) - 1
+        while i and _rank(*top[i - 1]) < _rank(*top[i]):
+            top[i - 1], top[i] = top[i], top[i - 1]
+            i -= 1
+
+
+class LoanStats:
+    def __init__(self, history):
+        self.history  = history   # () -> (loans, {copy_id: location}); loans as the stores return them
+        self.agg      = None      # None until first built
+        self.pending  = None      # events queued while a rebuild runs
+        self.built_at = None
+        self.lock     = threading.Lock()
+        self.building = threading.RLock()
+
+    def borrowed(self, loan, location):
+        self._event(('borrow', loan['id'], loan['book_id'], loan['book_title'],
+                     floor_of(location), loan['user_email'], loan['borrowed_at']))
+
+    def returned(self, loan):
+        self._event(('return', loan['id']))
+
+    def _event(self, event):
+        # before the first build there's nothing to update: the build counts it
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(event)
+            elif self.agg:
+                _apply(self.agg, event)
+
+    def rebuild(self):
+        with self.building:
+            with self.lock:
+                self.pending = []
+            start = perf_counter()
+            try:
+                loans, locations = self.history()
+                agg = (_count_numpy if numpy else _count)(_columns(loans), locations)
+            except BaseException:
+                with self.lock:
+                    self.pending = None
+                raise
+            with self.lock:
+                for event in self.pending:
+                    _apply(agg, event)
+                self.agg, self.pending, self.built_at = agg, None, time.time()
+            METRICS.observe('stats_rebuild_seconds', perf_counter() - start)
+
+    def view(self, days=30):
+        # everything the page shows; O(TOP_K + days + floors)
+        if self.agg is None:
+            with self.building:
+                if self.agg is None:
+                    self.rebuild()
+        today = day_of(int(time.time()))
+        with self.lock:
+            agg = self.agg
+            return {
+                'top':      [(agg.titles[bid], n) for n, bid in agg.top],
+                'days':     [((today - i) * DAY - OFFSET, agg.days.get(today - i, 0))
+                             for i in range(days - 1, -1, -1)],
+                'floors':   sorted(((f, n, agg.out.get(f, 0)) for f, n in agg.floors.items()),
+                                   key=itemgetter(1), reverse=True),
+                'total':    agg.total,
+                'out':      len(agg.open),
+                'active':   len(agg.members),
+                'built_at': self.built_at,
+            }
+
+
+def _rank(n, book_id):
+    return n, -book_id
+
+def _apply(agg, event):
+    if event[0] == 'borrow':
+        agg.borrow(*event[1:])
+    else:
+        agg.give_back(event[1])
+
+
+# ── rebuilding ──
+
+def _columns(loans):
+    # one pass over history: per-loan columns, plus the loans still out
+    cols = {'book': [], 'copy': [], 'at': [], 'titles': {}, 'open': [], 'seen': 0}
+    book, copy, at, titles, out = (cols[k] for k in ('book', 'copy', 'at', 'titles', 'open'))
+    seen = 0
+    for l in loans:
+        book.append(l['book_id'])
+        copy.append(l['copy_id'])
+        at.append(l['borrowed_at'])
+        if l['book_id'] not in titles or l['id'] > titles[l['book_id']][0]:
+            titles[l['book_id']] = (l['id'], l['book_title'])
+        if l['returned_at'] is None:
+            out.append((l['id'], l['copy_id'], l['user_email']))
+        if l['id'] > seen:
+            seen = l['id']
+    cols['seen'] = seen
+    return cols
+
+
+def _finish(agg, cols, floor_by_copy):
+    # the parts both counting paths share: titles, open loans, members
+    agg.titles = {bid: title for bid, (_, title) in cols['titles'].items()}
+    agg.total  = len(cols['book'])
+    agg.seen   = cols['seen']
+    for loan_id, cid, email in cols['open']:
+        floor = floor_by_copy.get(cid)
+        agg.open[loan_id] = (floor, email)
+        if floor:
+            agg.out[floor] = agg.out.get(floor, 0) + 1
+        agg.members[email] = agg.members.get(email, 0) + 1
+    agg.top = [[n, bid] for bid, n in
+               heapq.nlargest(TOP_K, agg.counts.items(), key=lambda e: _rank(e[1], e[0]))]
+    return agg
+
+
+def _count(cols, locations):
+    agg = _Aggregates()
+    floor_by_copy = {cid: floor_of(loc) for cid, loc in locations.items()}
+    agg.counts = dict(Counter(cols['book']))
+    agg.days   = dict(Counter((t + OFFSET) // DAY for t in cols['at']))
+    floors = Counter(map(floor_by_copy.get, cols['copy']))
+    floors.pop(None, None)
+    agg.floors = dict(floors)
+    return _finish(agg, cols, floor_by_copy)
+
+
+def _count_numpy(cols, locations):
+    agg = _Aggregates()
+    if not cols['book']:
+        return _finish(agg, cols, {})
+    floor_by_copy = {cid: floor_of(loc) for cid, loc in locations.items()}
+    books = numpy.fromiter(cols['book'], numpy.int64, len(cols['book']))
+    per_book = numpy.bincount(books)
+    hit = numpy.flatnonzero(per_book)
+    agg.counts = dict(zip(hit.tolist(), per_book[hit].tolist()))
+
+    days, per_day = numpy.unique((numpy.fromiter(cols['at'], numpy.int64, len(cols['at'])) + OFFSET)
+                                 // DAY, return_counts=True)
+    agg.days = dict(zip(days.tolist(), per_day.tolist()))
+
+    # copy id -> floor number, -1 for copies gone or without a floor
+    names = sorted({f for f in floor_by_copy.values() if f})
+    index = {f: i for i, f in enumerate(names)}
+    copies = numpy.fromiter(cols['copy'], numpy.int64, len(cols['copy']))
+    lookup = numpy.full(max(int(copies.max()), max(floor_by_copy, default=0)) + 1, -1, numpy.int64)
+    for cid, floor in floor_by_copy.items():
+        if floor:
+            lookup[cid] = index[floor]
+    floors = lookup[copies]
+    per_floor = numpy.bincount(floors[floors >= 0], minlength=len(names))
+    agg.floors = {names[i]: int(n) for i, n in enumerate(per_floor.tolist()) if n}
+    return _finish(agg, cols, floor_by_copy)
@@ -0,0 +1,1492 @@
+# ── STORAGE ───────────────────────────────────────────────────────────────────
+# Every route reads and writes books, loans and users through one of these.
+#
+#   MemoryStore  — plain lists / dicts, lost on restart (the original setup)
+#   SQLiteStore  — one shared database file in WAL mode, so several worker
+#                  processes see the same catalogue and it survives restarts
+#
+# A book is a title; the physical copies (format + shelf) hang off it and
+# the book carries running counters so nothing has to count copies:
+#   book  {id, title, author, isbn, location, total, available}
+#   copy  {id, book_id, format, location, available}
+#   loan  {id, book_id, copy_id, format, book_title, user_email, user_name,
+#          borrowed_at, returned_at, due_at, overdue_at}
+#   user  {name, password, address, is_staff}   (password hashed, see passwords.py)
+#   hold  {id, book_id, book_title, user_email, user_name, placed_at, status,
+#          copy_id, expires_at}
+# Loan times are integer Unix seconds; formatting them is up to the caller.
+# `location` on a book is its first copy's shelf, for display.
+#
+# available_bits() is a bitmap (see facets.py) of the books with at least one
+# copy on the shelf, kept up to date as borrows and returns cross zero.
+# change_stamp() moves on every write of any kind; render caches use it.
+#
+# borrow() and return_loan() are atomic check-and-set operations: a copy can
+# never end up with two open loans, however many requests race for it, and
+# a user holds at most one copy of a title at a time.
+# They return (outcome, record) where outcome is one of the constants below.
+#
+# loans_before() pages loan history newest first by loan id. Loans are
+# stamped in id order, so a borrowed_at range is a seek, not a scan.
+# iter_loans() / iter_copies() are generators for exports: they read one
+# snapshot in batches and never hold the whole result.
+#
+# Holds queue users for a title with no copy on the shelf, first come first
+# served. A returned copy goes to the head of the queue instead of the shelf:
+# the hold turns `ready`, keeps that copy aside for HOLD_PICKUP seconds, and
+# borrow() hands it over. expire_holds() lapses uncollected ones (a heap in
+# memory, a partial index in SQLite, so it only looks at what is due) and
+# passes their copies on the same way.
+#
+# A loan is due LOAN_PERIOD after it's borrowed. mark_overdue() flags open
+# loans whose due time has passed (overdue_at) and queues a reminder for each
+# in the outbox; it pops them off a min-heap by due time in memory, or an
+# index of unflagged open loans by due time in SQLite, so it never walks the
+# history. claim_outbox() hands queued messages to whoever sends them, once.
+#
+# import_batch() is the bulk import write (see importer.py): each incoming
+# title is matched to an existing book by ISBN, then by title + author
+# ignoring case, and its copies are added there; unmatched titles become new
+# books. One batch is one catalogue version.
+#
+# With LIBRARY_JOURNAL set, the in-memory store keeps a write-ahead journal
+# in that directory (see journal.py): every write logs the records it
+# changed before it returns, and a restart loads the latest snapshot plus
+# the journal since, instead of reseeding.
+#
+# AsyncStore wraps either store for code running on an event loop (see
+# asgi.py): every method becomes awaitable. A single in-memory call never
+# waits on I/O, so it runs inline; SQLite calls go to a small pool of reader
+# threads (each with its own connection), so the loop never blocks on the
+# database. run(fn) sends a whole view to that pool for either store.
+
+import asyncio, contextvars, functools, heapq, itertools, json, os, sqlite3, sys, threading
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, insort
+from collections import deque
+from operator import attrgetter
+from facets import bits_from_ids, select_bits
+from journal import Journal
+from metrics import METRICS, TimedLock, perf_counter
+
+OK, NOT_FOUND, UNAVAILABLE, ALREADY = 'ok', 'not_found', 'unavailable', 'already'
+ON_SHELF = 'on_shelf'   # place_hold(): a copy is free, just borrow it
+
+# hold statuses; only the first two are active
+WAITING, READY, COLLECTED, CANCELLED, EXPIRED = (
+    'waiting', 'ready', 'collected', 'cancelled', 'expired')
+HOLD_PICKUP = 3 * 86400   # seconds a copy is kept aside for a ready hold
+LOAN_PERIOD = 21 * 86400  # seconds from borrowing to due
+
+BOOK_FIELDS  = ('title', 'author', 'isbn')
+EXPORT_BATCH = 500
+FORMATS     = {'PB': 'Paperback', 'LP': 'Large print', 'ACD': 'Audiobook (CD)',
+               'ADIG': 'Audiobook (digital)', 'EBK': 'eBook'}
+
+
+def open_store(seed=None):
+    # LIBRARY_DB=path/to/library.db selects SQLite, otherwise memory.
+    # seed() returns the starting catalogue and is only called if the store is empty.
+    path    = os.environ.get('LIBRARY_DB')
+    journal = os.environ.get('LIBRARY_JOURNAL')
+    store   = SQLiteStore(path) if path else MemoryStore(Journal(journal) if journal else None)
+    if seed is not None:
+        store.seed(seed)
+    return store
+
+
+# ── IN-MEMORY ─────────────────────────────────────────────────────────────────
+
+BOOK_LOCK_STRIPES = 64   # per-book locks, shared by book_id % stripes
+
+# Records are slotted: each one is a fixed row of pointers instead of a dict
+# with its own hash table, which is most of the memory once there are
+# millions of loans. Repeated strings (titles, names, format codes) are
+# interned, so every loan of a book points at one title. Records still read
+# like dicts — rec['title'], dict(rec) — so nothing outside this section
+# needs to know.
+
+class _Record:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for key, value in zip(self.__slots__, values):
+            setattr(self, key, value)
+
+    def keys(self):
+        return self.__slots__
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+class _Book(_Record):
+    __slots__ = ('id', 'title', 'author', 'isbn', 'location', 'total', 'available')
+
+class _Copy(_Record):
+    __slots__ = ('id', 'book_id', 'format', 'location', 'available')
+
+class _Loan(_Record):
+    __slots__ = ('id', 'book_id', 'copy_id', 'format', 'book_title', 'user_email',
+                 'user_name', 'borrowed_at', 'returned_at', 'due_at', 'overdue_at')
+
+class _Message(_Record):
+    __slots__ = ('id', 'kind', 'user_email', 'payload', 'created_at', 'sent_at')
+
+class _Hold(_Record):
+    __slots__ = ('id', 'book_id', 'book_title', 'user_email', 'user_name', 'placed_at',
+                 'status', 'copy_id', 'expires_at')
+
+_intern = sys.intern
+
+# journal records (see journal.py): books and copies carry only what isn't
+# derived; counts, availability and shelf location are rebuilt on restore
+def _book_rec(book):
+    return ['B', book.id, book.title, book.author, book.isbn]
+
+def _copy_rec(copy):
+    return ['C', copy.id, copy.book_id, copy.format, copy.location]
+
+def _rec(kind, record):
+    return [kind, *(getattr(record, k) for k in record.__slots__)]
+
+def _durable(method):
+    # a journalled write returns once its records are on disk; the wait is
+    # after the method has let go of its locks
+    @functools.wraps(method)
+    def inner(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if self.journal:
+            self.journal.wait()
+        return result
+    return inner
+
+class MemoryStore:
+    def __init__(self, journal=None):
+        self.books        = []   # catalogue order
+        self.users        = {}   # { email: user }
+        self.loans        = []   # oldest first
+        self.book_by_id   = {}   # { book_id: book }
+        self.copies       = {}   # { copy_id: copy }
+        self.book_copies  = {}   # { book_id: [copy_id, ...] }  — shelf order
+        self.by_isbn      = {}   # { isbn: book }           — import matching
+        self.by_title     = {}   # { (title, author): book }  casefolded
+        self.free         = {}   # { book_id: [copy_id, ...] }  — stack of copies on the shelf
+        self.user_open    = {}   # { email: {book_id: loan} }
+        self.user_loans   = {}   # { email: [loan, ...] }  — oldest first
+        self.open_loans   = []   # open loans in id order
+        self.due          = []   # heap of (due_at, loan_id, loan), open and not yet overdue
+        self.overdue      = []   # open and flagged overdue, in id order
+        self.outbox       = deque()   # queued messages, oldest first
+        self.message_ids  = itertools.count(1)
+        self.queues       = {}   # { book_id: deque of waiting holds }  — oldest first
+        self.user_hold    = {}   # { email: {book_id: hold} }  — waiting or ready
+        self.pickups      = []   # heap of (expires_at, hold_id, hold) for ready holds
+        self.next_hold_id = 1
+        self.hold_lock    = threading.Lock()   # hold ids + the pickup heap
+        self.next_book_id = 1
+        self.copy_ids     = itertools.count(1)
+        self.next_loan_id = 1
+        self.loan_lock    = TimedLock('loans')   # loan ids + history, so both stay in id order
+        self.version      = 0    # bumped on every catalogue change
+        self.lock         = TimedLock('catalogue')   # catalogue add / edit / delete
+        self.book_locks   = [TimedLock('book') for _ in range(BOOK_LOCK_STRIPES)]
+        self.avail_bits   = 0                    # books with a copy on the shelf
+        self.bits_lock    = threading.Lock()
+        self.changes      = 0
+        self.journal      = journal
+        self.restored     = False   # state came from the journal
+        if journal:
+            self._restore(journal.recover(), journal.highs)
+            journal.start()
+
+    def seed(self, load):
+        if self.books or self.restored:
+            return
+        for b in load():
+            book = self._new_book(b['id'], b)
+            self._add_copies(book, b['copies'])
+            self.books.append(book)
+            self.book_by_id[book['id']] = book
+            self._index(book)
+            self.next_book_id = max(self.next_book_id, book['id'] + 1)
+        if self.journal:   # the seed is never logged, so snapshot it
+            self.compact()
+
+    def _log(self, *records):
+        if self.journal:
+            self.journal.append(*records)
+
+    def book_lock(self, book_id):
+        return self.book_locks[book_id % BOOK_LOCK_STRIPES]
+
+    def _touch(self):
+        with self.bits_lock:
+            self.changes += 1
+
+    def change_stamp(self):
+        return self.changes
+
+    def _mark(self, book_id, available):
+        with self.bits_lock:
+            if available:
+                self.avail_bits |= 1 << book_id
+            else:
+                self.avail_bits &= ~(1 << book_id)
+
+    # books
+
+    def _new_book(self, book_id, fields):
+        book = _Book(book_id, _intern(fields.get('title', '')), _intern(fields.get('author', '')),
+                     fields.get('isbn', ''), '', 0, 0)
+        self.book_copies[book_id] = []
+        self.free[book_id]        = []
+        return book
+
+    def _index(self, book):
+        if book['isbn']:
+            self.by_isbn.setdefault(book['isbn'], book)
+        self.by_title.setdefault(_title_key(book), book)
+
+    def _unindex(self, book):
+        if self.by_isbn.get(book['isbn']) is book:
+            del self.by_isbn[book['isbn']]
+        if self.by_title.get(_title_key(book)) is book:
+            del self.by_title[_title_key(book)]
+
+    def catalogue_version(self):
+        return self.version
+
+    def available_bits(self):
+        return self.avail_bits
+
+    def count_books(self, avail_only=False):
+        if avail_only:
+            return self.avail_bits.bit_count()
+        return len(self.books)
+
+    def list_books(self, offset=0, limit=None, avail_only=False):
+        if avail_only:
+            return [dict(self.book_by_id[bid])
+                    for bid in select_bits(self.avail_bits, offset, limit)]
+        end = None if limit is None else offset + limit
+        return [dict(b) for b in self.books[offset:end]]
+
+    def get_book(self, book_id):
+        book = self.book_by_id.get(book_id)
+        return dict(book) if book else None
+
+    def get_books(self, book_ids):
+        return {bid: dict(self.book_by_id[bid]) for bid in book_ids if bid in self.book_by_id}
+
+    @_durable
+    def add_book(self, fields, copies):
+        with self.lock:
+            book = self._new_book(self.next_book_id, fields)
+            self.next_book_id += 1
+            new = self._add_copies(book, copies)
+            self.books.append(book)
+            self.book_by_id[book['id']] = book
+            self._index(book)
+            self._log(_book_rec(book), *map(_copy_rec, new))
+            self.version += 1
+            self._touch()
+            return dict(book), self.version
+
+    @_durable
+    def import_batch(self, titles, at, pickup=HOLD_PICKUP):
+        # titles [{title, author, isbn, copies}]; (new books, ids topped up, version)
+        added, merged, records = [], [], []
+        with self.lock:
+            for t in titles:
+                book = (t['isbn'] and self.by_isbn.get(t['isbn'])) or self.by_title.get(_title_key(t))
+                if book:
+                    with self.book_lock(book['id']):
+                        records += map(_copy_rec, self._add_copies(book, t['copies'], at, pickup))
+                    merged.append(book['id'])
+                    continue
+                book = self._new_book(self.next_book_id, t)
+                self.next_book_id += 1
+                new = self._add_copies(book, t['copies'])
+                self.books.append(book)
+                self.book_by_id[book['id']] = book
+                self._index(book)
+                records += [_book_rec(book), *map(_copy_rec, new)]
+                added.append(dict(book))
+            if titles:
+                self._log(*records)
+                self.version += 1
+                self._touch()
+            return added, list(dict.fromkeys(merged)), self.version
+
+    @_durable
+    def update_book(self, book_id, fields):
+        with self.lock, self.book_lock(book_id):
+            book = self.book_by_id.get(book_id)
+            if not book:
+                return None, self.version
+            self._unindex(book)
+            for k in BOOK_FIELDS:
+                if k in fields:
+                    book[k] = _intern(fields[k])
+            self._index(book)
+            self._log(_book_rec(book))
+            self.version += 1
+            self._touch()
+            return dict(book), self.version
+
+    @_durable
+    def delete_book(self, book_id):
+        with self.lock, self.book_lock(book_id):
+            book = self.book_by_id.pop(book_id, None)
+            if not book:
+                return None, self.version
+            self.books.remove(book)
+            self._unindex(book)
+            self._mark(book_id, False)
+            records = [['-B', book_id]]
+            for cid in self.book_copies.pop(book_id):
+                del self.copies[cid]
+                records.append(['-C', cid])
+            del self.free[book_id]
+            self.queues.pop(book_id, None)
+            for holds in self.user_hold.values():
+                hold = holds.pop(book_id, None)
+                if hold:
+                    hold['status'] = CANCELLED
+                    records.append(_rec('H', hold))
+            self._log(*records)
+            self.version += 1
+            self._touch()
+            return dict(book), self.version
+
+    # copies
+
+    def _add_copies(self, book, copies, at=None, pickup=HOLD_PICKUP):
+        # returns the new copies. Like a returned one, a new copy goes to the
+        # first waiting hold if any (ready from `at`), else the shelf. Caller
+        # holds the book lock if the book is already listed.
+        new = []
+        for c in copies:
+            copy = _Copy(next(self.copy_ids), book['id'], _intern(c['format']),
+                         _intern(c['location']), False)
+            new.append(copy)
+            self.copies[copy['id']] = copy
+            self.book_copies[book['id']].append(copy['id'])
+            book['total'] += 1
+            if not book['location']:
+                book['location'] = copy['location']
+            if self.queues.get(book['id']):
+                self._hand_back(book['id'], copy, at, pickup)
+                continue
+            copy['available'] = True
+            self.free[book['id']].append(copy['id'])
+            book['available'] += 1
+        if book['available']:
+            self._mark(book['id'], True)
+        return new
+
+    def all_copies(self):
+        # snapshot the values first: an import may be adding copies meanwhile
+        return [dict(c) for c in list(self.copies.values())]
+
+    def list_copies(self, book_id):
+        return [dict(self.copies[cid]) for cid in self.book_copies.get(book_id, [])]
+
+    def iter_copies(self):
+        # every copy with its title's fields, in catalogue order
+        for book in list(self.books):
+            for cid in list(self.book_copies.get(book['id'], ())):
+                copy = self.copies.get(cid)
+                if copy:
+                    yield _export_row(book, copy)
+
+    @_durable
+    def update_copies(self, book_id, at, moves=None, add=(), pickup=HOLD_PICKUP):
+        # moves {copy_id: location}; add [{format, location}]
+        with self.lock, self.book_lock(book_id):
+            book = self.book_by_id.get(book_id)
+            if not book:
+                return None, self.version
+            shelf, records = self.book_copies[book_id], []
+            for cid, location in (moves or {}).items():
+                if cid in shelf:
+                    self.copies[cid]['location'] = location
+                    records.append(_copy_rec(self.copies[cid]))
+            if shelf:
+                book['location'] = self.copies[shelf[0]]['location']
+            records += map(_copy_rec, self._add_copies(book, add, at, pickup))
+            self._log(*records)
+            self.version += 1
+            self._touch()
+            return dict(book), self.version
+
+    # loans
+
+    def user_open_loans(self, email):
+        return {bid: dict(l) for bid, l in self.user_open.get(email, {}).items()}
+
+    @_durable
+    def borrow(self, book_id, email, name, at, period=LOAN_PERIOD):
+        with self.book_lock(book_id):
+            book = self.book_by_id.get(book_id)
+            if not book:
+                return NOT_FOUND, None
+            held = self.user_open.setdefault(email, {})
+            if book_id in held:
+                return ALREADY, dict(held[book_id])
+            hold = self.user_hold.get(email, {}).get(book_id)
+            if hold and hold['status'] == READY:   # the copy kept aside for them
+                copy = self.copies[hold['copy_id']]
+            else:
+                free = self.free[book_id]
+                if not free:
+                    return UNAVAILABLE, dict(book)
+                copy = self.copies[free.pop()]
+                copy['available']  = False
+                book['available'] -= 1
+                if not book['available']:
+                    self._mark(book_id, False)
+                if hold:   # still queued, but a copy turned up on the shelf
+                    self.queues[book_id].remove(hold)
+            if hold:
+                hold['status'] = COLLECTED
+                del self.user_hold[email][book_id]
+            loan = _Loan(None, book_id, copy['id'], copy['format'], book['title'],
+                         _intern(email), _intern(name), at, None, at + period, None)
+            held[book_id] = loan
+            with self.loan_lock:
+                loan['id'] = self.next_loan_id
+                self.next_loan_id += 1
+                self.loans.append(loan)
+                self.user_loans.setdefault(email, []).append(loan)
+                self.open_loans.append(loan)
+                heapq.heappush(self.due, (loan['due_at'], loan['id'], loan))
+                self._log(_rec('L', loan), *([_rec('H', hold)] if hold else ()))
+        self._touch()
+        return OK, dict(loan)
+
+    @_durable
+    def return_loan(self, book_id, email, at, pickup=HOLD_PICKUP):
+        with self.book_lock(book_id):
+            loan = self.user_open.get(email, {}).pop(book_id, None)
+            if not loan:
+                return NOT_FOUND, None
+            loan['returned_at'] = at
+            with self.loan_lock:   # its heap entry is skipped when it comes up
+                _drop(self.open_loans, loan)
+                if loan['overdue_at']:
+                    _drop(self.overdue, loan)
+                self._log(_rec('L', loan))
+            copy = self.copies.get(loan['copy_id'])
+            if copy:   # gone if the book was deleted while out
+                self._hand_back(book_id, copy, at, pickup)
+            self._touch()
+            return OK, dict(loan)
+
+    def _hand_back(self, book_id, copy, at, pickup):
+        # a copy coming back: to the first waiting hold if any, else the shelf.
+        # Caller holds the book lock.
+        queue = self.queues.get(book_id)
+        if queue:
+            hold = queue.popleft()
+            hold['status'], hold['copy_id'], hold['expires_at'] = READY, copy['id'], at + pickup
+            with self.hold_lock:
+                heapq.heappush(self.pickups, (hold['expires_at'], hold['id'], hold))
+            self._log(_rec('H', hold))
+            return
+        copy['available'] = True
+        self.free[book_id].append(copy['id'])
+        book = self.book_by_id[book_id]
+        book['available'] += 1
+        if book['available'] == 1:
+            self._mark(book_id, True)
+
+    # holds
+
+    @_durable
+    def place_hold(self, book_id, email, name, at):
+        with self.book_lock(book_id):
+            book = self.book_by_id.get(book_id)
+            if not book:
+                return NOT_FOUND, None
+            mine = self.user_hold.get(email, {}).get(book_id)
+            if mine:
+                return ALREADY, self._hold_view(mine)
+            if book_id in self.user_open.get(email, {}):
+                return ALREADY, None
+            if self.free[book_id]:
+                return ON_SHELF, dict(book)
+            with self.hold_lock:
+                hold_id = self.next_hold_id
+                self.next_hold_id += 1
+            hold = _Hold(hold_id, book_id, book['title'], _intern(email), _intern(name),
+                         at, WAITING, None, None)
+            self.queues.setdefault(book_id, deque()).append(hold)
+            self.user_hold.setdefault(email, {})[book_id] = hold
+            self._log(_rec('H', hold))
+            self._touch()
+            return OK, self._hold_view(hold)
+
+    @_durable
+    def cancel_hold(self, book_id, email, at, pickup=HOLD_PICKUP):
+        with self.book_lock(book_id):
+            hold = self.user_hold.get(email, {}).pop(book_id, None)
+            if not hold:
+                return NOT_FOUND, None
+            self._end_hold(hold, CANCELLED, at, pickup)
+            self._touch()
+            return OK, dict(hold)
+
+    def _end_hold(self, hold, status, at, pickup):
+        was, hold['status'] = hold['status'], status
+        self._log(_rec('H', hold))
+        if was == WAITING:
+            self.queues[hold['book_id']].remove(hold)
+        elif was == READY:
+            copy = self.copies.get(hold['copy_id'])
+            if copy:
+                self._hand_back(hold['book_id'], copy, at, pickup)
+
+    @_durable
+    def expire_holds(self, at, pickup=HOLD_PICKUP):
+        # lapse ready holds not collected by `at`; ids of the books involved
+        if not self.pickups or self.pickups[0][0] > at:
+            return []
+        due = []
+        with self.hold_lock:
+            while self.pickups and self.pickups[0][0] <= at:
+                due.append(heapq.heappop(self.pickups)[2])
+        touched = []
+        for hold in due:
+            with self.book_lock(hold['book_id']):
+                if hold['status'] != READY:   # collected or cancelled meanwhile
+                    continue
+                del self.user_hold[hold['user_email']][hold['book_id']]
+                self._end_hold(hold, EXPIRED, at, pickup)
+                touched.append(hold['book_id'])
+        if touched:
+            self._touch()
+        return touched
+
+    def user_holds(self, email):
+        # active holds, oldest first, with their place in the queue (0 once ready)
+        holds = sorted(self.user_hold.get(email, {}).values(), key=_loan_id)
+        return [self._hold_view(h) for h in holds]
+
+    def _hold_view(self, hold):
+        view = dict(hold)
+        view['position'] = 0
+        if hold['status'] == WAITING:
+            try:
+                view['position'] = self.queues[hold['book_id']].index(hold) + 1
+            except (KeyError, ValueError):   # left the queue since
+                pass
+        return view
+
+    def loans_before(self, before=None, limit=50, email=None, status=None,
+                     since=None, until=None):
+        # newest first, ids < before; status is 'open', 'overdue' or 'returned'
+        # and since <= borrowed_at < until. Every list walked is in id order,
+        # so the bounds are bisects and only the page itself is walked.
+        if status in ('open', 'overdue'):
+            with self.loan_lock:   # both lists change under it
+                if email is None:
+                    loans = self.open_loans if status == 'open' else self.overdue
+                else:   # a member's few open loans
+                    loans = sorted(self.user_open.get(email, {}).values(), key=_loan_id)
+                    if status == 'overdue':
+                        loans = [l for l in loans if l['overdue_at']]
+                return _loans_page(loans, before, limit, since, until)
+        loans = self.loans if email is None else self.user_loans.get(email, [])
+        return _loans_page(loans, before, limit, since, until, status == 'returned')
+
+    def iter_loans(self, batch=EXPORT_BATCH, **filters):
+        # loans_before() page by page; loans made once the export has started
+        # are left out (a return during it can still show up)
+        before = self.next_loan_id
+        while True:
+            page = self.loans_before(before, batch, **filters)
+            yield from page
+            if len(page) < batch:
+                return
+            before = page[-1]['id']
+
+    def all_loans_newest(self):
+        return [dict(l) for l in reversed(self.loans)]
+
+    @_durable
+    def mark_overdue(self, at):
+        # flag open loans due by `at` and queue a reminder for each; returns them
+        if not self.due or self.due[0][0] > at:
+            return []
+        out = []
+        with self.loan_lock:
+            while self.due and self.due[0][0] <= at:
+                loan = heapq.heappop(self.due)[2]
+                if loan['returned_at'] is not None:
+                    continue
+                loan['overdue_at'] = at
+                insort(self.overdue, loan, key=_loan_id)
+                msg = _Message(next(self.message_ids), *_overdue_message(loan), at, None)
+                self.outbox.append(msg)
+                self._log(_rec('L', loan), _rec('M', msg))
+                out.append(dict(loan))
+        if out:
+            self._touch()
+        return out
+
+    @_durable
+    def claim_outbox(self, limit, at):
+        # up to `limit` queued messages, oldest first, marked sent
+        out = []
+        with self.loan_lock:
+            while self.outbox and len(out) < limit:
+                msg = self.outbox.popleft()
+                msg['sent_at'] = at
+                self._log(_rec('M', msg))
+                out.append(dict(msg))
+        return out
+
+    # users
+
+    def get_user(self, email):
+        user = self.users.get(email)
+        return dict(user) if user else None
+
+    @_durable
+    def add_user(self, email, user):
+        # setdefault is one atomic step: of two signups racing for an email
+        # exactly one gets it, the other sees the winner's record
+        user = dict(user)
+        if self.users.setdefault(email, user) is not user:
+            return False
+        self._log(['U', email, dict(user)])
+        return True
+
+    @_durable
+    def set_password(self, email, password):
+        user = self.users.get(email)
+        if user:
+            user['password'] = password
+            self._log(['U', email, dict(user)])
+
+    # journal
+
+    def _restore(self, tables, highs):
+        # rebuild from the journal's live records: availability, counts,
+        # queues and heaps all follow from books, copies, loans and holds
+        if not any(tables.values()):
+            return
+        books, copies, loans, holds = tables['B'], tables['C'], tables['L'], tables['H']
+        for bid in sorted(books):
+            _, bid, title, author, isbn = books[bid]
+            book = self._new_book(bid, {'title': title, 'author': author, 'isbn': isbn})
+            self.books.append(book)
+            self.book_by_id[bid] = book
+            self._index(book)
+        taken = set()   # copies out on loan or kept aside for a hold
+        for lid in sorted(loans):
+            (_, lid, bid, cid, fmt, title, email, name,
+             borrowed, returned, due, overdue) = loans[lid]
+            loan = _Loan(lid, bid, cid, _intern(fmt), _intern(title), _intern(email),
+                         _intern(name), borrowed, returned, due, overdue)
+            self.loans.append(loan)
+            self.user_loans.setdefault(email, []).append(loan)
+            if returned is None:
+                self.user_open.setdefault(email, {})[bid] = loan
+                self.open_loans.append(loan)
+                taken.add(cid)
+                if overdue is None:
+                    self.due.append((due, lid, loan))
+                else:
+                    self.overdue.append(loan)
+        heapq.heapify(self.due)
+        for hid in sorted(holds):
+            hold = _Hold(*holds[hid][1:])
+            if hold['status'] not in (WAITING, READY) or hold['book_id'] not in self.book_by_id:
+                continue
+            self.user_hold.setdefault(hold['user_email'], {})[hold['book_id']] = hold
+            if hold['status'] == WAITING:
+                self.queues.setdefault(hold['book_id'], deque()).append(hold)
+            else:
+                self.pickups.append((hold['expires_at'], hid, hold))
+                taken.add(hold['copy_id'])
+        heapq.heapify(self.pickups)
+        for cid in sorted(copies):
+            _, cid, bid, fmt, location = copies[cid]
+            book = self.book_by_id.get(bid)
+            if not book:
+                continue
+            copy = _Copy(cid, bid, _intern(fmt), _intern(location), cid not in taken)
+            self.copies[cid] = copy
+            self.book_copies[bid].append(cid)
+            book['total'] += 1
+            if copy['available']:
+                self.free[bid].append(cid)
+                book['available'] += 1
+            if not book['location']:
+                book['location'] = copy['location']
+        self.avail_bits = bits_from_ids(b['id'] for b in self.books if b['available'])
+        for mid in sorted(tables['M']):
+            msg = _Message(*tables['M'][mid][1:])
+            if msg['sent_at'] is None:
+                self.outbox.append(msg)
+        self.users = {email: rec[2] for email, rec in tables['U'].items()}
+        self.next_book_id = highs.get('B', 0) + 1
+        self.copy_ids     = itertools.count(highs.get('C', 0) + 1)
+        self.next_loan_id = highs.get('L', 0) + 1
+        self.next_hold_id = highs.get('H', 0) + 1
+        self.message_ids  = itertools.count(highs.get('M', 0) + 1)
+        self.restored     = True
+
+    def _records(self):
+        # every live record, for a snapshot; read while writes go on
+        for book in list(self.books):
+            yield _book_rec(book)
+        for copy in list(self.copies.values()):
+            yield _copy_rec(copy)
+        for loan in list(self.loans):
+            yield _rec('L', loan)
+        for holds in list(self.user_hold.values()):
+            for hold in list(holds.values()):
+                yield _rec('H', hold)
+        for msg in list(self.outbox):
+            yield _rec('M', msg)
+        for email, user in list(self.users.items()):
+            yield ['U', email, dict(user)]
+
+    def compact(self):
+        # snapshot the store and drop the journal the snapshot covers
+        number, seq = self.journal.rotate()
+        self.journal.snapshot(number, seq, self._records())
+
+
+def _export_row(book, copy):
+    return {'book_id': book['id'], 'copy_id': copy['id'], 'title': book['title'],
+            'author': book['author'], 'isbn': book['isbn'], 'format': copy['format'],
+            'location': copy['location'], 'available': bool(copy['available'])}
+
+def _overdue_message(loan):
+    # (kind, user_email, payload) for the outbox
+    return 'overdue', loan['user_email'], json.dumps({
+        'loan_id': loan['id'], 'book_id': loan['book_id'], 'book_title': loan['book_title'],
+        'user_name': loan['user_name'], 'due_at': loan['due_at']})
+
+def _title_key(book):
+    return book['title'].casefold(), book['author'].casefold()
+
+_loan_id     = attrgetter('id')
+_borrowed_at = attrgetter('borrowed_at')
+
+def _drop(loans, loan):
+    # from an id-ordered list
+    i = bisect_left(loans, loan['id'], key=_loan_id)
+    if i < len(loans) and loans[i] is loan:
+        del loans[i]
+
+def _loans_page(loans, before, limit, since, until, returned=False):
+    # MemoryStore.loans_before over an id-ordered list
+    lo, hi = 0, len(loans)
+    if before is not None:
+        hi = bisect_left(loans, before, 0, hi, key=_loan_id)
+    if until:
+        hi = bisect_left(loans, until, 0, hi, key=_borrowed_at)
+    if since:
+        lo = bisect_left(loans, since, 0, hi, key=_borrowed_at)
+    out = []
+    for i in range(hi - 1, lo - 1, -1):
+        if len(out) >= limit:
+            break
+        loan = loans[i]
+        if returned and not loan['returned_at']:
+            continue
+        out.append(dict(loan))
+    return out
+
+
+# ── SQLITE ────────────────────────────────────────────────────────────────────
+
+LOANS_TABLE = '''CREATE TABLE IF NOT EXISTS loans (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id     INTEGER NOT NULL,
+    copy_id     INTEGER NOT NULL,
+    format      TEXT    NOT NULL,
+    book_title  TEXT    NOT NULL,
+    user_email  TEXT    NOT NULL,
+    user_name   TEXT    NOT NULL,
+    borrowed_at INTEGER NOT NULL,   -- Unix seconds
+    returned_at INTEGER,
+    due_at      INTEGER,
+    overdue_at  INTEGER             -- when mark_overdue() flagged it
+);'''
+
+# after the migrations, as older loans tables have no due columns yet
+LOAN_DUE_INDEXES = '''
+CREATE INDEX IF NOT EXISTS loans_due ON loans (due_at)
+    WHERE returned_at IS NULL AND overdue_at IS NULL;
+CREATE INDEX IF NOT EXISTS loans_overdue ON loans (id)
+    WHERE returned_at IS NULL AND overdue_at IS NOT NULL;
+'''
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS books (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    title     TEXT    NOT NULL,
+    author    TEXT    NOT NULL,
+    isbn      TEXT    NOT NULL DEFAULT '',
+    location  TEXT    NOT NULL DEFAULT '',
+    total     INTEGER NOT NULL DEFAULT 0,
+    available INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS books_available ON books (id) WHERE available > 0;
+CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn) WHERE isbn != '';
+CREATE INDEX IF NOT EXISTS books_title ON books (title COLLATE NOCASE, author COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS copies (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id   INTEGER NOT NULL,
+    format    TEXT    NOT NULL,
+    location  TEXT    NOT NULL DEFAULT '',
+    available INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS copies_book ON copies (book_id, id);
+CREATE INDEX IF NOT EXISTS copies_free ON copies (book_id) WHERE available = 1;
+
+CREATE TABLE IF NOT EXISTS users (
+    email    TEXT PRIMARY KEY,
+    name     TEXT    NOT NULL,
+    password TEXT    NOT NULL,
+    address  TEXT    NOT NULL,
+    is_staff INTEGER NOT NULL DEFAULT 0
+);
+
+{LOANS_TABLE}
+CREATE INDEX IF NOT EXISTS loans_user ON loans (user_email, id);
+CREATE INDEX IF NOT EXISTS loans_borrowed ON loans (borrowed_at);
+CREATE INDEX IF NOT EXISTS loans_open ON loans (user_email, id) WHERE returned_at IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS loans_open_copy ON loans (copy_id) WHERE returned_at IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS loans_open_user ON loans (user_email, book_id) WHERE returned_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS holds (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id    INTEGER NOT NULL,
+    book_title TEXT    NOT NULL,
+    user_email TEXT    NOT NULL,
+    user_name  TEXT    NOT NULL,
+    placed_at  INTEGER NOT NULL,
+    status     TEXT    NOT NULL DEFAULT 'waiting',
+    copy_id    INTEGER,            -- the copy kept aside once ready
+    expires_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS holds_queue ON holds (book_id, id) WHERE status = 'waiting';
+CREATE INDEX IF NOT EXISTS holds_pickup ON holds (expires_at) WHERE status = 'ready';
+CREATE UNIQUE INDEX IF NOT EXISTS holds_active ON holds (user_email, book_id)
+    WHERE status IN ('waiting', 'ready');
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind       TEXT    NOT NULL,
+    user_email TEXT    NOT NULL,
+    payload    TEXT    NOT NULL,   -- JSON
+    created_at INTEGER NOT NULL,
+    sent_at    INTEGER
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (id) WHERE sent_at IS NULL;
+
+-- books whose shelf count crossed zero, so each worker can patch its
+-- availability bitmap instead of re-reading every book
+CREATE TABLE IF NOT EXISTS avail_changes (
+    seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id   INTEGER NOT NULL,
+    available INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('catalogue', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('changes', 0);
+'''
+
+_BOOK_COLS = 'id, title, author, isbn, location, total, available'
+_COPY_COLS = 'id, book_id, format, location, available'
+_LOAN_COLS = ('id, book_id, copy_id, format, book_title, user_email, user_name, '
+              'borrowed_at, returned_at, due_at, overdue_at')
+_HOLD_COLS = ('id, book_id, book_title, user_email, user_name, placed_at, status, '
+              'copy_id, expires_at')
+_ACTIVE    = "status IN ('waiting', 'ready')"
+_POSITION  = ("CASE status WHEN 'waiting' THEN (SELECT COUNT(*) FROM holds q "
+              "WHERE q.book_id = h.book_id AND q.status = 'waiting' AND q.id <= h.id) "
+              "ELSE 0 END AS position")
+_IN_CHUNK  = 500   # stay well under SQLite's bound-parameter limit
+AVAIL_KEEP = 10000 # avail_changes rows kept for workers catching up
+
+def _copy_row(row):
+    copy = dict(row)
+    copy['available'] = bool(copy['available'])
+    return copy
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), _IN_CHUNK):
+        part = ids[i:i + _IN_CHUNK]
+        yield part, ','.join('?' * len(part))
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path  = path
+        self.local = threading.local()   # one connection per thread
+        self.avail = {'seq': None, 'bits': 0}
+        self.avail_lock = threading.Lock()
+        self.conn().executescript(SCHEMA)
+        rebuilt = self._migrate_times()
+        if rebuilt:
+            self.conn().executescript(SCHEMA)   # indexes went with the old table
+        self._migrate_due(rebuilt)
+        self.conn().executescript(LOAN_DUE_INDEXES)
+
+    # connections
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                             check_same_thread=False, cached_statements=256)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA busy_timeout=30000')
+        return db
+
+    def conn(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self._connect()
+        return db
+
+    def _snapshot(self, sql, args=(), batch=EXPORT_BATCH):
+        # rows of one SELECT on a private connection inside a read
+        # transaction, so the export sees one state of the database
+        # however long the client takes to download it
+        db = self._connect()
+        try:
+            db.execute('BEGIN')
+            cur = db.execute(sql, args)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    return
+                for r in rows:
+                    yield dict(r)
+        finally:
+            db.close()
+
+    def tx(self):
+        return _Transaction(self.conn())
+
+    def _migrate_times(self):
+        # databases from before integer loan times stored local
+        # 'YYYY-MM-DD HH:MM' text; rebuild the table with Unix seconds
+        with self.tx() as db:
+            kind = db.execute("SELECT type FROM pragma_table_info('loans') "
+                              "WHERE name = 'borrowed_at'").fetchone()
+            if kind[0] != 'TEXT':
+                return False
+            db.execute('ALTER TABLE loans RENAME TO loans_text')
+            db.execute(LOANS_TABLE)
+            db.execute(
+                "INSERT INTO loans (id, book_id, copy_id, format, book_title, user_email, "
+                "user_name, borrowed_at, returned_at) "
+                "SELECT id, book_id, copy_id, format, book_title, user_email, "
+                "user_name, CAST(strftime('%s', borrowed_at, 'utc') AS INTEGER), "
+                "CAST(strftime('%s', returned_at, 'utc') AS INTEGER) FROM loans_text")
+            db.execute('DROP TABLE loans_text')
+            return True
+
+    def _migrate_due(self, rebuilt):
+        # loans from before due dates fall due LOAN_PERIOD after borrowing
+        with self.tx() as db:
+            cols = {r[1] for r in db.execute("SELECT * FROM pragma_table_info('loans')")}
+            if 'due_at' in cols and not rebuilt:
+                return
+            if 'due_at' not in cols:
+                db.execute('ALTER TABLE loans ADD COLUMN due_at INTEGER')
+                db.execute('ALTER TABLE loans ADD COLUMN overdue_at INTEGER')
+            db.execute('UPDATE loans SET due_at = borrowed_at + ? WHERE due_at IS NULL',
+                       (LOAN_PERIOD,))
+
+    def seed(self, load):
+        with self.tx() as db:
+            if db.execute('SELECT 1 FROM books LIMIT 1').fetchone():
+                return
+            for b in load():
+                db.execute('INSERT INTO books (id, title, author, isbn) VALUES (?, ?, ?, ?)',
+                           (b['id'], b['title'], b['author'], b['isbn']))
+                self._add_copies(db, b['id'], b['copies'], log=False)
+
+    def _bump(self, db):
+        self._touch(db)
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'catalogue'")
+        return db.execute("SELECT value FROM meta WHERE key = 'catalogue'").fetchone()[0]
+
+    def _touch(self, db):
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'changes'")
+
+    def change_stamp(self):
+        return self.conn().execute(
+            "SELECT value FROM meta WHERE key = 'changes'").fetchone()[0]
+
+    def _log_avail(self, db, book_id, available):
+        seq = db.execute('INSERT INTO avail_changes (book_id, available) VALUES (?, ?)',
+                         (book_id, int(available))).lastrowid
+        if seq % 1000 == 0:
+            db.execute('DELETE FROM avail_changes WHERE seq <= ?', (seq - AVAIL_KEEP,))
+
+    def _book(self, db, book_id):
+        row = db.execute(f'SELECT {_BOOK_COLS} FROM books WHERE id = ?', (book_id,)).fetchone()
+        return dict(row) if row else None
+
+    # books
+
+    def catalogue_version(self):
+        return self.conn().execute(
+            "SELECT value FROM meta WHERE key = 'catalogue'").fetchone()[0]
+
+    def available_bits(self):
+        # replay avail_changes since our last look; rebuild if we fell off the end
+        with self.avail_lock:
+            db   = self.conn()
+            seen = self.avail['seq']
+            db.execute('BEGIN')
+            try:
+                first = db.execute('SELECT MIN(seq) FROM avail_changes').fetchone()[0]
+                if seen is None or (first is not None and first > seen + 1):
+                    self.avail['bits'] = bits_from_ids(
+                        r[0] for r in db.execute('SELECT id FROM books WHERE available > 0'))
+                    self.avail['seq'] = db.execute(
+                        "SELECT COALESCE(MAX(seq), 0) FROM avail_changes").fetchone()[0]
+                else:
+                    bits = self.avail['bits']
+                    for seq, bid, available in db.execute(
+                            'SELECT seq, book_id, available FROM avail_changes '
+                            'WHERE seq > ? ORDER BY seq', (seen,)):
+                        bits = bits | (1 << bid) if available else bits & ~(1 << bid)
+                        self.avail['seq'] = seq
+                    self.avail['bits'] = bits
+            finally:
+                db.execute('COMMIT')
+            return self.avail['bits']
+
+    def count_books(self, avail_only=False):
+        sql = 'SELECT COUNT(*) FROM books' + (' WHERE available > 0' if avail_only else '')
+        return self.conn().execute(sql).fetchone()[0]
+
+    def list_books(self, offset=0, limit=None, avail_only=False):
+        sql = (f'SELECT {_BOOK_COLS} FROM books'
+               + (' WHERE available > 0' if avail_only else '')
+               + ' ORDER BY id LIMIT ? OFFSET ?')
+        rows = self.conn().execute(sql, (-1 if limit is None else limit, offset))
+        return [dict(r) for r in rows]
+
+    def get_book(self, book_id):
+        return self._book(self.conn(), book_id)
+
+    def get_books(self, book_ids):
+        out = {}
+        for part, marks in _chunks(book_ids):
+            for r in self.conn().execute(
+                    f'SELECT {_BOOK_COLS} FROM books WHERE id IN ({marks})', part):
+                out[r['id']] = dict(r)
+        return out
+
+    def add_book(self, fields, copies):
+        with self.tx() as db:
+            cur = db.execute('INSERT INTO books (title, author, isbn) VALUES (?, ?, ?)',
+                             [fields.get(k, '') for k in BOOK_FIELDS])
+            self._add_copies(db, cur.lastrowid, copies)
+            return self._book(db, cur.lastrowid), self._bump(db)
+
+    def import_batch(self, titles, at, pickup=HOLD_PICKUP):
+        added, merged = [], []
+        with self.tx() as db:
+            for t in titles:
+                row = None
+                if t['isbn']:
+                    row = db.execute("SELECT id FROM books WHERE isbn = ? AND isbn != '' LIMIT 1",
+                                     (t['isbn'],)).fetchone()
+                if not row:
+                    row = db.execute('SELECT id FROM books WHERE title = ? COLLATE NOCASE '
+                                     'AND author = ? COLLATE NOCASE LIMIT 1',
+                                     (t['title'], t['author'])).fetchone()
+                if row:
+                    self._add_copies(db, row[0], t['copies'], at, pickup)
+                    merged.append(row[0])
+                    continue
+                cur = db.execute('INSERT INTO books (title, author, isbn) VALUES (?, ?, ?)',
+                                 [t[k] for k in BOOK_FIELDS])
+                self._add_copies(db, cur.lastrowid, t['copies'])
+                added.append(self._book(db, cur.lastrowid))
+            version = self._bump(db) if titles else self.catalogue_version()
+        return added, list(dict.fromkeys(merged)), version
+
+    def update_book(self, book_id, fields):
+        keys = [k for k in BOOK_FIELDS if k in fields]
+        with self.tx() as db:
+            cur = db.execute(
+                f'UPDATE books SET {", ".join(k + " = ?" for k in keys)} WHERE id = ?',
+                [fields[k] for k in keys] + [book_id])
+            if not cur.rowcount:
+                return None, self.catalogue_version()
+            return self._book(db, book_id), self._bump(db)
+
+    def delete_book(self, book_id):
+        with self.tx() as db:
+            book = self._book(db, book_id)
+            if not book:
+                return None, self.catalogue_version()
+            db.execute('DELETE FROM copies WHERE book_id = ?', (book_id,))
+            db.execute('DELETE FROM books WHERE id = ?', (book_id,))
+            db.execute(f"UPDATE holds SET status = 'cancelled' WHERE book_id = ? AND {_ACTIVE}",
+                       (book_id,))
+            if book['available']:
+                self._log_avail(db, book_id, False)
+            return book, self._bump(db)
+
+    # copies
+
+    def _add_copies(self, db, book_id, copies, at=None, pickup=HOLD_PICKUP, log=True):
+        # like a returned copy, a new one goes to the first waiting hold if
+        # any (ready from `at`), else the shelf
+        if not copies:
+            return
+        db.executemany('INSERT INTO copies (book_id, format, location) VALUES (?, ?, ?)',
+                       [(book_id, c['format'], c['location']) for c in copies])
+        kept = 0
+        if at is not None:
+            new = db.execute('SELECT id FROM copies WHERE book_id = ? ORDER BY id DESC LIMIT ?',
+                             (book_id, len(copies))).fetchall()
+            for (copy_id,) in reversed(new):
+                if not self._promote(db, book_id, copy_id, at, pickup):
+                    break
+                db.execute('UPDATE copies SET available = 0 WHERE id = ?', (copy_id,))
+                kept += 1
+        shelved = len(copies) - kept
+        after = db.execute(
+            "UPDATE books SET total = total + ?1, available = available + ?2, "
+            "location = CASE WHEN location = '' THEN ?3 ELSE location END WHERE id = ?4 "
+            "RETURNING available", (len(copies), shelved, copies[0]['location'], book_id)).fetchall()
+        if log and shelved and after and after[0][0] == shelved:
+            self._log_avail(db, book_id, True)
+
+    def all_copies(self):
+        return [_copy_row(r) for r in self.conn().execute(f'SELECT {_COPY_COLS} FROM copies')]
+
+    def list_copies(self, book_id):
+        return [_copy_row(r) for r in self.conn().execute(
+            f'SELECT {_COPY_COLS} FROM copies WHERE book_id = ? ORDER BY id', (book_id,))]
+
+    def iter_copies(self):
+        for row in self._snapshot(
+                'SELECT b.id AS book_id, c.id AS copy_id, b.title, b.author, b.isbn, '
+                'c.format, c.location, c.available FROM books b '
+                'JOIN copies c ON c.book_id = b.id ORDER BY b.id, c.id'):
+            row['available'] = bool(row['available'])
+            yield row
+
+    def update_copies(self, book_id, at, moves=None, add=(), pickup=HOLD_PICKUP):
+        # moves {copy_id: location}; add [{format, location}]
+        with self.tx() as db:
+            if not self._book(db, book_id):
+                return None, self.catalogue_version()
+            db.executemany('UPDATE copies SET location = ? WHERE id = ? AND book_id = ?',
+                           [(loc, cid, book_id) for cid, loc in (moves or {}).items()])
+            db.execute(
+                'UPDATE books SET location = COALESCE((SELECT location FROM copies '
+                'WHERE book_id = ?1 ORDER BY id LIMIT 1), location) WHERE id = ?1', (book_id,))
+            self._add_copies(db, book_id, list(add), at, pickup)
+            return self._book(db, book_id), self._bump(db)
+
+    # loans
+
+    def user_open_loans(self, email):
+        return {r['book_id']: dict(r) for r in self.conn().execute(
+            f'SELECT {_LOAN_COLS} FROM loans WHERE user_email = ? AND returned_at IS NULL',
+            (email,))}
+
+    def borrow(self, book_id, email, name, at, period=LOAN_PERIOD):
+        # conditional update claims one free copy; the unique open-loan
+        # indexes are the backstop
+        with self.tx() as db:
+            row = db.execute(
+                f'SELECT {_LOAN_COLS} FROM loans '
+                f'WHERE user_email = ? AND book_id = ? AND returned_at IS NULL',
+                (email, book_id)).fetchone()
+            if row:
+                return ALREADY, dict(row)
+            hold = db.execute(
+                f'SELECT id, status, copy_id FROM holds '
+                f'WHERE user_email = ? AND book_id = ? AND {_ACTIVE}', (email, book_id)).fetchone()
+            if hold and hold['status'] == READY:   # the copy kept aside for them
+                claimed = db.execute('SELECT id, format FROM copies WHERE id = ?',
+                                     (hold['copy_id'],)).fetchall()
+            else:
+                claimed = db.execute(
+                    'UPDATE copies SET available = 0 WHERE id = '
+                    '(SELECT id FROM copies WHERE book_id = ? AND available = 1 LIMIT 1) '
+                    'AND available = 1 RETURNING id, format', (book_id,)).fetchall()
+                if not claimed:
+                    book = self._book(db, book_id)
+                    return (UNAVAILABLE, book) if book else (NOT_FOUND, None)
+                left = db.execute('UPDATE books SET available = available - 1 WHERE id = ? '
+                                  'RETURNING available', (book_id,)).fetchall()
+                if left and left[0][0] == 0:
+                    self._log_avail(db, book_id, False)
+            if hold:
+                db.execute("UPDATE holds SET status = 'collected' WHERE id = ?", (hold['id'],))
+            cur = db.execute(
+                'INSERT INTO loans (book_id, copy_id, format, book_title, user_email, '
+                'user_name, borrowed_at, due_at) '
+                'SELECT id, ?, ?, title, ?, ?, ?, ? FROM books WHERE id = ?',
+                (claimed[0]['id'], claimed[0]['format'], email, name, at, at + period, book_id))
+            self._touch(db)
+            return OK, dict(db.execute(f'SELECT {_LOAN_COLS} FROM loans WHERE id = ?',
+                                       (cur.lastrowid,)).fetchone())
+
+    def return_loan(self, book_id, email, at, pickup=HOLD_PICKUP):
+        with self.tx() as db:
+            row = db.execute(
+                f'SELECT {_LOAN_COLS} FROM loans '
+                f'WHERE user_email = ? AND book_id = ? AND returned_at IS NULL',
+                (email, book_id)).fetchone()
+            if not row:
+                return NOT_FOUND, None
+            loan = dict(row)
+            db.execute('UPDATE loans SET returned_at = ? WHERE id = ?', (at, loan['id']))
+            self._hand_back(db, book_id, loan['copy_id'], at, pickup)
+            self._touch(db)
+            loan['returned_at'] = at
+            return OK, loan
+
+    def _hand_back(self, db, book_id, copy_id, at, pickup):
+        # a copy coming back: to the first waiting hold if any, else the shelf
+        if not db.execute('SELECT 1 FROM copies WHERE id = ?', (copy_id,)).fetchone():
+            return   # gone if the book was deleted while out
+        if self._promote(db, book_id, copy_id, at, pickup):
+            return
+        db.execute('UPDATE copies SET available = 1 WHERE id = ?', (copy_id,))
+        now_free = db.execute('UPDATE books SET available = available + 1 WHERE id = ? '
+                              'RETURNING available', (book_id,)).fetchall()
+        if now_free and now_free[0][0] == 1:
+            self._log_avail(db, book_id, True)
+
+    def _promote(self, db, book_id, copy_id, at, pickup):
+        # keep copy_id aside for the book's first waiting hold; False if none
+        return db.execute(
+            "UPDATE holds SET status = 'ready', copy_id = ?, expires_at = ? WHERE id = "
+            "(SELECT id FROM holds WHERE book_id = ? AND status = 'waiting' ORDER BY id LIMIT 1)",
+            (copy_id, at + pickup, book_id)).rowcount > 0
+
+    # holds
+
+    def place_hold(self, book_id, email, name, at):
+        with self.tx() as db:
+            book = self._book(db, book_id)
+            if not book:
+                return NOT_FOUND, None
+            mine = db.execute(f'SELECT id FROM holds WHERE user_email = ? AND book_id = ? '
+                              f'AND {_ACTIVE}', (email, book_id)).fetchone()
+            if mine:
+                return ALREADY, self._hold_view(db, mine[0])
+            if db.execute('SELECT 1 FROM loans WHERE user_email = ? AND book_id = ? '
+                          'AND returned_at IS NULL', (email, book_id)).fetchone():
+                return ALREADY, None
+            if book['available']:
+                return ON_SHELF, book
+            cur = db.execute('INSERT INTO holds (book_id, book_title, user_email, user_name, '
+                             'placed_at) VALUES (?, ?, ?, ?, ?)',
+                             (book_id, book['title'], email, name, at))
+            self._touch(db)
+            return OK, self._hold_view(db, cur.lastrowid)
+
+    def cancel_hold(self, book_id, email, at, pickup=HOLD_PICKUP):
+        with self.tx() as db:
+            row = db.execute(f'SELECT {_HOLD_COLS} FROM holds WHERE user_email = ? '
+                             f'AND book_id = ? AND {_ACTIVE}', (email, book_id)).fetchone()
+            if not row:
+                return NOT_FOUND, None
+            hold = dict(row)
+            db.execute("UPDATE holds SET status = 'cancelled' WHERE id = ?", (hold['id'],))
+            if hold['status'] == READY:
+                self._hand_back(db, book_id, hold['copy_id'], at, pickup)
+            self._touch(db)
+            hold['status'] = CANCELLED
+            return OK, hold
+
+    def expire_holds(self, at, pickup=HOLD_PICKUP):
+        # lapse ready holds not collected by `at`; ids of the books involved.
+        # Checked outside a write transaction first, as it's usually nothing.
+        sql = "SELECT id, book_id, copy_id FROM holds WHERE status = 'ready' AND expires_at <= ?"
+        if not self.conn().execute(sql + ' LIMIT 1', (at,)).fetchone():
+            return []
+        with self.tx() as db:
+            due = db.execute(sql + ' ORDER BY expires_at', (at,)).fetchall()
+            for hold in due:
+                db.execute("UPDATE holds SET status = 'expired' WHERE id = ?", (hold['id'],))
+                self._hand_back(db, hold['book_id'], hold['copy_id'], at, pickup)
+            if due:
+                self._touch(db)
+        return [hold['book_id'] for hold in due]
+
+    def user_holds(self, email):
+        return [dict(r) for r in self.conn().execute(
+            f'SELECT {_HOLD_COLS}, {_POSITION} FROM holds h '
+            f'WHERE user_email = ? AND {_ACTIVE} ORDER BY id', (email,))]
+
+    def _hold_view(self, db, hold_id):
+        return dict(db.execute(f'SELECT {_HOLD_COLS}, {_POSITION} FROM holds h WHERE id = ?',
+                               (hold_id,)).fetchone())
+
+    def all_loans_newest(self):
+        return [dict(r) for r in self.conn().execute(
+            f'SELECT {_LOAN_COLS} FROM loans ORDER BY id DESC')]
+
+    def mark_overdue(self, at):
+        # through loans_due; checked outside a write transaction first
+        if not self.conn().execute(
+                'SELECT 1 FROM loans WHERE returned_at IS NULL AND overdue_at IS NULL '
+                'AND due_at <= ? LIMIT 1', (at,)).fetchone():
+            return []
+        with self.tx() as db:
+            loans = [dict(r) for r in db.execute(
+                f'UPDATE loans SET overdue_at = ? WHERE returned_at IS NULL '
+                f'AND overdue_at IS NULL AND due_at <= ? RETURNING {_LOAN_COLS}', (at, at))]
+            db.executemany(
+                'INSERT INTO outbox (kind, user_email, payload, created_at) VALUES (?, ?, ?, ?)',
+                [(*_overdue_message(l), at) for l in loans])
+            if loans:
+                self._touch(db)
+        return loans
+
+    def claim_outbox(self, limit, at):
+        with self.tx() as db:
+            return sorted((dict(r) for r in db.execute(
+                'UPDATE outbox SET sent_at = ? WHERE id IN (SELECT id FROM outbox '
+                'WHERE sent_at IS NULL ORDER BY id LIMIT ?) '
+                'RETURNING id, kind, user_email, payload, created_at, sent_at', (at, limit))),
+                key=lambda m: m['id'])
+
+    def loans_before(self, before=None, limit=50, email=None, status=None,
+                     since=None, until=None):
+        db = self.conn()
+        where, args = self._loan_filter(db, before, email, status, since, until)
+        return [dict(r) for r in db.execute(
+            f'SELECT {_LOAN_COLS} FROM loans WHERE {where} ORDER BY id DESC LIMIT ?',
+            args + [limit])]
+
+    def iter_loans(self, batch=EXPORT_BATCH, email=None, status=None, since=None, until=None):
+        where, args = self._loan_filter(self.conn(), None, email, status, since, until)
+        return self._snapshot(f'SELECT {_LOAN_COLS} FROM loans WHERE {where} ORDER BY id DESC',
+                              args, batch)
+
+    def _loan_filter(self, db, before, email, status, since, until):
+        hi = before if before is not None else 2**63 - 1
+        lo = 0
+        # turn the date range into an id range through loans_borrowed
+        if until:
+            row = db.execute('SELECT id FROM loans WHERE borrowed_at >= ? '
+                             'ORDER BY borrowed_at LIMIT 1', (until,)).fetchone()
+            if row:
+                hi = min(hi, row[0])
+        if since:
+            row = db.execute('SELECT id FROM loans WHERE borrowed_at >= ? '
+                             'ORDER BY borrowed_at LIMIT 1', (since,)).fetchone()
+            lo = row[0] if row else hi
+        where, args = ['id < ?', 'id >= ?'], [hi, lo]
+        if email is not None:
+            where.append('user_email = ?')
+            args.append(email)
+        if status == 'open':
+            where.append('returned_at IS NULL')
+        elif status == 'overdue':
+            where.append('returned_at IS NULL AND overdue_at IS NOT NULL')
+        elif status == 'returned':
+            where.append('returned_at IS NOT NULL')
+        return ' AND '.join(where), args
+
+    # users
+
+    def get_user(self, email):
+        row = self.conn().execute(
+            'SELECT name, password, address, is_staff FROM users WHERE email = ?',
+            (email,)).fetchone()
+        if not row:
+            return None
+        user = dict(row)
+        user['is_staff'] = bool(user['is_staff'])
+        return user
+
+    def add_user(self, email, user):
+        with self.tx() as db:
+            cur = db.execute(
+                'INSERT OR IGNORE INTO users (email, name, password, address, is_staff) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (email, user['name'], user['password'], user['address'], int(user['is_staff'])))
+            return cur.rowcount == 1
+
+    def set_password(self, email, password):
+        with self.tx() as db:
+            db.execute('UPDATE users SET password = ? WHERE email = ?', (password, email))
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE … COMMIT, or ROLLBACK on error; nests as a no-op.
+    # BEGIN IMMEDIATE waits for the database write lock, so time it.
+    wait = METRICS.histogram('lock_wait_seconds', lock='sqlite_write')
+
+    def __init__(self, db):
+        self.db    = db
+        self.outer = not db.in_transaction
+
+    def __enter__(self):
+        if self.outer:
+            start = perf_counter()
+            self.db.execute('BEGIN IMMEDIATE')
+            self.wait.observe(perf_counter() - start)
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.outer:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+# ── async access ──
+
+class AsyncStore:
+    def __init__(self, store, threads=None):
+        self.store  = store
+        self.inline = isinstance(store, MemoryStore)   # its methods never wait on I/O
+        self.pool   = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='store')
+
+    async def run(self, fn, *args, **kwargs):
+        # fn(*args) on the pool: a view's worth of work (searching, rendering,
+        # waiting on a lock) never holds up the loop, whatever the store.
+        # Several store calls in one fn are one trip. The caller's context
+        # (Flask's request) goes along.
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, call)
+
+    def __getattr__(self, name):
+        # a single store call: inline for memory, on the pool for SQLite
+        method = getattr(self.store, name)
+        async def call(*args, **kwargs):
+            if self.inline:
+                return method(*args, **kwargs)
+            return await self.run(method, *args, **kwargs)
+        return call
+
+    def close(self):
+        self.pool.shutdown()
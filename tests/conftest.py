@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the app under test keeps everything in memory
+for var in ('LIBRARY_DB', 'LIBRARY_JOURNAL'):
+    os.environ.pop(var, None)
+
+
+@pytest.fixture(scope='session')
+def main():
+    import main
+    main.app.config['TESTING'] = True
+    return main
+
+
+@pytest.fixture
+def staff(main):
+    client = main.app.test_client()
+    with client.session_transaction() as s:
+        s['user_email'], s['user_name'], s['is_staff'] = 'staff@test', 'Staff', True
+    return client
+
+
+@pytest.fixture
+def member(main):
+    client = main.app.test_client()
+    with client.session_transaction() as s:
+        s['user_email'], s['user_name'] = 'member@test', 'Member'
+    return client
+
+
+def catalogue():
+    # two titles: book 1 with a single copy, book 2 with two
+    return [
+        {'id': 1, 'title': 'Solo', 'author': 'A. Author', 'isbn': '9780000000001',
+         'copies': [{'format': 'PB', 'location': 'F1'}]},
+        {'id': 2, 'title': 'Pair', 'author': 'B. Author', 'isbn': '9780000000002',
+         'copies': [{'format': 'PB', 'location': 'F2'}, {'format': 'HB', 'location': 'F2'}]},
+    ]
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    # a small seeded store of either kind
+    from storage import MemoryStore, SQLiteStore
+    store = MemoryStore() if request.param == 'memory' else SQLiteStore(str(tmp_path / 'lib.db'))
+    store.seed(catalogue)
+    return store
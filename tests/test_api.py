@@ -0,0 +1,91 @@
+import pytest
+
+from storage import OK
+
+
+def walk(client, main, path, limit):
+    # every item, following next_cursor from the first page
+    items, cursor = [], None
+    while True:
+        url = f'{path}?limit={limit}' + (f'&cursor={cursor}' if cursor is not None else '')
+        body = client.get(main.p(url)).get_json()
+        assert len(body['items']) <= limit
+        items += body['items']
+        cursor = body['next_cursor']
+        if cursor is None:
+            return items
+
+
+def test_book_pages_cover_the_catalogue_once(member, main):
+    ids = [b['id'] for b in walk(member, main, '/api/v1/books', 37)]
+    assert ids == sorted(ids)
+    assert ids == [b['id'] for b in main.STORE.list_books()]
+
+
+def test_book_cursor_starts_after_the_given_id(member, main):
+    first = main.STORE.list_books(limit=3)
+    body = member.get(main.p(f'/api/v1/books?limit=2&cursor={first[0]["id"]}')).get_json()
+    assert [b['id'] for b in body['items']] == [b['id'] for b in first[1:3]]
+    assert body['next_cursor'] == first[2]['id']
+
+
+def test_book_fields_pick_columns(member, main):
+    body = member.get(main.p('/api/v1/books?limit=1&fields=title,nope')).get_json()
+    assert list(body['items'][0]) == ['title']
+
+
+@pytest.mark.parametrize('query', ['cursor=-1', 'cursor=-5', 'cursor=x', 'cursor=1.5',
+                                   'limit=x', 'fields=nope', 'fields=,'])
+def test_bad_paging_arguments_are_a_400(member, main, query):
+    for path in ('/api/v1/books', '/api/v1/loans'):
+        resp = member.get(main.p(f'{path}?{query}'))
+        assert resp.status_code == 400
+        assert resp.get_json() == {'error': main.API_ARGS_ERROR}
+
+
+def test_limit_is_clamped(member, main):
+    assert len(member.get(main.p('/api/v1/books?limit=0')).get_json()['items']) == 1
+    body = member.get(main.p(f'/api/v1/books?limit={main.API_LIMIT * 10}')).get_json()
+    assert len(body['items']) == min(main.API_LIMIT, main.STORE.count_books())
+
+
+def test_loan_pages_are_newest_first_and_only_the_members(member, main):
+    taken = 0
+    for book in main.STORE.list_books(avail_only=True, limit=12):
+        taken += main.STORE.borrow(book['id'], 'member@test', 'Member', main.now())[0] == OK
+        main.STORE.borrow(book['id'], 'other@test', 'Other', main.now())
+    loans = walk(member, main, '/api/v1/loans', 5)
+    assert len(loans) == taken
+    assert {l['user_email'] for l in loans} == {'member@test'}
+    ids = [l['id'] for l in loans]
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_loans_need_a_login(main):
+    assert main.app.test_client().get(main.p('/api/v1/loans')).status_code == 401
+
+
+def test_loans_page_cursor_junk_starts_from_the_newest(staff, main):
+    assert staff.get(main.p('/all-loans?before=abc')).status_code == 200
+    assert staff.get(main.p('/all-loans?before=-3')).status_code == 200
+
+
+def test_store_loan_pages_chain_without_gaps(store):
+    # loans_before(), under both the API and the loan views, for both stores
+    for n in range(2):   # both of book 2's copies
+        store.borrow(2, f'u{n}@test', 'U', 1000 + n)
+    store.return_loan(2, 'u0@test', 1100)
+    store.borrow(1, 'u0@test', 'U', 1200)
+    want = [l['id'] for l in store.loans_before(None, 100)]
+    assert len(want) == 3 and want == sorted(want, reverse=True)
+    got, before = [], None
+    while True:
+        page = store.loans_before(before, 1)
+        if not page:
+            break
+        got.append(page[0]['id'])
+        before = page[0]['id']
+    assert got == want
+    assert [l['user_email'] for l in store.loans_before(None, 10, status='open')] == ['u0@test', 'u1@test']
+    assert [l['user_email'] for l in store.loans_before(None, 10, status='returned')] == ['u0@test']
+    assert [l['id'] for l in store.loans_before(None, 10, since=1001, until=1200)] == want[1:2]
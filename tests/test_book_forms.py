@@ -0,0 +1,30 @@
+import pytest
+
+
+def add(staff, main, copies, title):
+    return staff.post(main.p('/books/add'), data={
+        'title': title, 'author': 'Form Test', 'isbn': '', 'format': 'PB',
+        'location': 'F9', 'copies': copies})
+
+
+@pytest.mark.parametrize('copies', ['abc', '', '0', '-2', '1.5', '51'])
+def test_add_rejects_a_bad_copy_count(staff, main, copies):
+    before = main.STORE.count_books()
+    add(staff, main, copies, f'Bad copies {copies!r}')
+    assert main.STORE.count_books() == before
+    with staff.session_transaction() as s:
+        assert s['_flash'] == 'e:' + main.COPIES_ERROR
+
+
+def test_add_takes_a_good_copy_count(staff, main):
+    add(staff, main, ' 3 ', 'Three copies')
+    book = main.STORE.list_books(main.STORE.count_books() - 1)[0]
+    assert (book['title'], book['total'], book['available']) == ('Three copies', 3, 3)
+
+
+def test_edit_rejects_a_bad_copy_count_before_saving(staff, main):
+    book = main.STORE.list_books(limit=1)[0]
+    staff.post(main.p(f'/books/edit/{book["id"]}'), data={
+        'title': 'Renamed', 'author': book['author'], 'isbn': book['isbn'], 'copies': 'lots'})
+    after = main.STORE.get_book(book['id'])
+    assert (after['title'], after['total']) == (book['title'], book['total'])
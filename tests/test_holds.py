@@ -0,0 +1,57 @@
+from storage import HOLD_PICKUP, OK, ON_SHELF, READY, UNAVAILABLE, WAITING
+
+T = 1_700_000_000
+
+
+def status(store, email):
+    return [(h['book_id'], h['status'], h['position']) for h in store.user_holds(email)]
+
+
+def test_hold_refused_while_a_copy_is_on_the_shelf(store):
+    assert store.place_hold(1, 'b@test', 'B', T)[0] == ON_SHELF
+
+
+def test_return_goes_to_the_first_waiting_hold(store):
+    assert store.borrow(1, 'a@test', 'A', T)[0] == OK
+    assert store.place_hold(1, 'b@test', 'B', T + 1)[0] == OK
+    assert store.place_hold(1, 'c@test', 'C', T + 2)[0] == OK
+    assert status(store, 'c@test') == [(1, WAITING, 2)]
+
+    store.return_loan(1, 'a@test', T + 10)
+    assert status(store, 'b@test') == [(1, READY, 0)]
+    assert store.user_holds('b@test')[0]['expires_at'] == T + 10 + HOLD_PICKUP
+    assert status(store, 'c@test') == [(1, WAITING, 1)]
+    # kept aside: not back on the shelf, and only the holder may take it
+    assert store.get_book(1)['available'] == 0
+    assert store.borrow(1, 'd@test', 'D', T + 11)[0] == UNAVAILABLE
+    assert store.borrow(1, 'b@test', 'B', T + 12)[0] == OK
+    assert status(store, 'b@test') == []
+
+
+def test_added_copies_go_to_waiting_holds_first(store):
+    store.borrow(1, 'a@test', 'A', T)
+    store.place_hold(1, 'b@test', 'B', T + 1)
+    store.place_hold(1, 'c@test', 'C', T + 2)
+
+    store.update_copies(1, T + 5, add=[{'format': 'PB', 'location': 'F1'}])
+    assert status(store, 'b@test') == [(1, READY, 0)]
+    assert status(store, 'c@test') == [(1, WAITING, 1)]
+    assert store.get_book(1)['available'] == 0
+
+    # two more: one for the last in the queue, one for the shelf
+    store.update_copies(1, T + 6, add=[{'format': 'PB', 'location': 'F1'}] * 2)
+    assert status(store, 'c@test') == [(1, READY, 0)]
+    book = store.get_book(1)
+    assert (book['total'], book['available']) == (4, 1)
+    assert [b['id'] for b in store.list_books(avail_only=True)] == [1, 2]
+
+
+def test_imported_copies_go_to_waiting_holds_first(store):
+    store.borrow(1, 'a@test', 'A', T)
+    store.place_hold(1, 'b@test', 'B', T + 1)
+    added, merged, _ = store.import_batch([
+        {'title': 'Solo', 'author': 'A. Author', 'isbn': '9780000000001',
+         'copies': [{'format': 'PB', 'location': 'F1'}]}], T + 5)
+    assert (added, merged) == ([], [1])
+    assert status(store, 'b@test') == [(1, READY, 0)]
+    assert store.get_book(1)['available'] == 0
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from conftest import catalogue
+from journal import Journal, JournalError, _numbered
+from storage import MemoryStore, OK
+
+T = 1_700_000_000
+
+
+def open_journaled(path):
+    store = MemoryStore(Journal(str(path)))
+    store.seed(catalogue)
+    return store
+
+
+def crash(store):
+    # everything acknowledged is on disk; drop the process's hold on the
+    # directory without a clean shutdown
+    store.journal.wait(store.journal.seq)
+    store.journal.lockfile.close()
+
+
+def state(store):
+    emails = ('a@test', 'b@test', 'c@test')
+    return {
+        'books':  store.list_books(),
+        'copies': sorted(store.all_copies(), key=lambda c: c['id']),
+        'loans':  store.loans_before(None, 1000),
+        'open':   store.loans_before(None, 1000, status='open'),
+        'late':   store.loans_before(None, 1000, status='overdue'),
+        'holds':  [store.user_holds(e) for e in emails],
+        'users':  [store.get_user(e) for e in emails],
+        'outbox': [dict(m) for m in store.outbox],
+        'avail':  store.available_bits(),
+    }
+
+
+def work(store, at=T):
+    store.add_user('a@test', {'name': 'A', 'password': 'x'})
+    assert store.borrow(1, 'a@test', 'A', at, 100)[0] == OK
+    assert store.borrow(2, 'b@test', 'B', at + 1)[0] == OK
+    store.place_hold(1, 'c@test', 'C', at + 2)
+    store.mark_overdue(at + 150)
+    store.return_loan(1, 'a@test', at + 160)   # to c@test's hold
+    store.update_copies(2, at + 170, add=[{'format': 'HB', 'location': 'F3'}])
+    store.add_book({'title': 'New', 'author': 'N. Author', 'isbn': ''},
+                   [{'format': 'PB', 'location': 'F4'}])
+
+
+def test_restart_replays_the_journal(tmp_path):
+    store = open_journaled(tmp_path)
+    work(store)
+    want = state(store)
+    crash(store)
+
+    again = MemoryStore(Journal(str(tmp_path)))
+    assert again.restored
+    assert state(again) == want
+    # ids carry on from the journal, never reused
+    status, loan = again.borrow(3, 'b@test', 'B', T + 500)
+    assert status == OK and loan['id'] > max(l['id'] for l in want['loans'])
+
+
+def test_restart_from_a_snapshot_plus_the_tail(tmp_path):
+    store = open_journaled(tmp_path)
+    work(store)
+    store.compact()
+    store.return_loan(2, 'b@test', T + 400)
+    want = state(store)
+    crash(store)
+
+    again = MemoryStore(Journal(str(tmp_path)))
+    assert again.journal.recovered['snapshot'] is not None
+    assert state(again) == want
+
+
+def test_torn_last_write_is_dropped(tmp_path):
+    store = open_journaled(tmp_path)
+    work(store)
+    want = state(store)
+    crash(store)
+    last = os.path.join(tmp_path, f'journal-{_numbered(str(tmp_path), "journal-", ".log")[-1]}.log')
+    size = os.path.getsize(last)
+    with open(last, 'ab') as f:   # a frame header whose body never made it
+        f.write(b'\x40\x00\x00\x00\x01\x02\x03\x04{"partial')
+
+    again = MemoryStore(Journal(str(tmp_path)))
+    assert state(again) == want
+    assert os.path.getsize(last) == size
+
+
+def test_a_second_process_is_refused(tmp_path):
+    open_journaled(tmp_path)
+    with pytest.raises(JournalError, match='open in another process'):
+        Journal(str(tmp_path))
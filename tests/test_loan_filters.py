@@ -0,0 +1,54 @@
+from datetime import datetime
+
+
+def stamp(day):
+    return int(datetime.strptime(day, '%Y-%m-%d').timestamp())
+
+
+def borrowed(main, email, day):
+    # a loan for `email` borrowed at noon on `day`
+    for book in main.STORE.list_books(avail_only=True):
+        status, loan = main.STORE.borrow(book['id'], email, 'Filter Test', stamp(day) + 43200)
+        if status == main.OK:
+            return loan
+    raise AssertionError('no book on the shelf')
+
+
+def listed(email):
+    return f'<small>{email}</small>'
+
+
+def page(staff, main, query):
+    resp = staff.get(main.p('/all-loans?' + query))
+    assert resp.status_code == 200
+    return resp.get_data(as_text=True)
+
+
+def test_day_range_is_inclusive(staff, main):
+    borrowed(main, 'range@test', '2021-03-10')
+    assert listed('range@test') in page(staff, main, 'user=range@test&from=2021-03-10&to=2021-03-10')
+    assert listed('range@test') not in page(staff, main, 'user=range@test&from=2021-03-11')
+    assert listed('range@test') not in page(staff, main, 'user=range@test&to=2021-03-09')
+
+
+def test_unusable_days_leave_the_range_open(staff, main):
+    borrowed(main, 'bounds@test', '2021-04-01')
+    for query in ('to=9999-12-31', 'from=0001-01-01', 'from=0001-01-01&to=9999-12-31', 'from=junk'):
+        html = page(staff, main, 'user=bounds@test&' + query)
+        assert listed('bounds@test') in html
+        assert main.BAD_DAYS in html
+
+
+def test_good_days_are_not_flagged(staff, main):
+    assert main.BAD_DAYS not in page(staff, main, 'from=2021-01-01&to=2021-12-31')
+
+
+def test_export_takes_the_same_bounds(staff, main):
+    borrowed(main, 'export@test', '2021-05-01')
+    for query in ('to=9999-12-31', 'from=0001-01-01', 'from=2021-05-01&to=2021-05-01'):
+        for fmt in ('csv', 'jsonl'):
+            resp = staff.get(main.p(f'/all-loans/export?user=export@test&format={fmt}&{query}'))
+            assert resp.status_code == 200
+            assert 'export@test' in resp.get_data(as_text=True)
+    resp = staff.get(main.p('/all-loans/export?user=export@test&from=2021-05-02'))
+    assert 'export@test' not in resp.get_data(as_text=True)
@@ -0,0 +1,63 @@
+import json
+import threading
+
+from scheduler import Scheduler
+
+T = 1_700_000_000
+
+
+def lend(store):
+    # three loans due at T+100, T+200 and T+300; the first comes back in time
+    store.borrow(2, 'a@test', 'A', T, 100)
+    store.borrow(2, 'b@test', 'B', T, 200)
+    store.borrow(1, 'c@test', 'C', T, 300)
+    store.return_loan(2, 'a@test', T + 50)
+
+
+def test_sweep_flags_only_loans_past_due(store):
+    lend(store)
+    assert store.mark_overdue(T + 99) == []
+    flagged = store.mark_overdue(T + 250)
+    assert [(l['user_email'], l['overdue_at']) for l in flagged] == [('b@test', T + 250)]
+    assert store.mark_overdue(T + 260) == []   # each loan is flagged once
+    assert [l['user_email'] for l in store.mark_overdue(T + 300)] == ['c@test']
+    overdue = store.loans_before(None, 10, status='overdue')
+    assert [l['user_email'] for l in overdue] == ['c@test', 'b@test']
+
+
+def test_returned_overdue_loan_leaves_the_overdue_list(store):
+    lend(store)
+    store.mark_overdue(T + 1000)
+    store.return_loan(2, 'b@test', T + 1001)
+    assert [l['user_email'] for l in store.loans_before(None, 10, status='overdue')] == ['c@test']
+
+
+def test_each_overdue_loan_queues_one_reminder(store):
+    lend(store)
+    store.mark_overdue(T + 1000)
+    store.mark_overdue(T + 2000)
+    first = store.claim_outbox(1, T + 3000)
+    rest  = store.claim_outbox(10, T + 3000)
+    assert store.claim_outbox(10, T + 3000) == []
+    sent = first + rest
+    assert [m['user_email'] for m in sent] == ['b@test', 'c@test']
+    assert {m['kind'] for m in sent} == {'overdue'}
+    assert {m['sent_at'] for m in sent} == {T + 3000}
+    assert json.loads(sent[0]['payload'])['due_at'] == T + 200
+
+
+def test_scheduler_keeps_running_a_failing_job():
+    sched, runs, done = Scheduler(), [], threading.Event()
+
+    @sched.every(0.01)
+    def flaky():
+        runs.append(1)
+        if len(runs) >= 3:
+            done.set()
+        raise RuntimeError('boom')
+
+    sched.start()
+    try:
+        assert done.wait(5)
+    finally:
+        sched.stop()